@@ -0,0 +1,139 @@
+import hashlib
+import io
+import json
+import logging
+import os
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+ASSET_DIRECTORIES = ("eew/forecast", "eew/warning", "info")
+
+# 1メッセージに添付できるファイル数の上限
+_ATTACHMENTS_PER_MESSAGE = 10
+
+
+class AssetCache:
+    # 震度画像を起動時にメモリへ読み込み、送信のたびにディスクを読まないようにする
+    # URLモードでは画像を一度だけアップロードし、以降はURLで参照する
+    # アップロードしたメッセージはpathに保存し、再起動後も画像が変わっていなければ使い回す
+    def __init__(self, directories=ASSET_DIRECTORIES, path=None):
+        self.directories = directories
+        self.path = path
+        self.assets = {}
+        self.urls = {}
+        self.channel_id = None
+        self.message_ids = []
+
+    def load(self):
+        for directory in self.directories:
+            for name in sorted(os.listdir(directory)):
+                if name.endswith('.png'):
+                    with open(f"{directory}/{name}", 'rb') as f:
+                        self.assets[f"{directory}/{name}"] = f.read()
+        return len(self.assets)
+
+    def signature(self):
+        digest = hashlib.sha256()
+        for path, data in self.assets.items():
+            digest.update(path.encode('utf-8'))
+            digest.update(hashlib.sha256(data).digest())
+        return digest.hexdigest()
+
+    def file(self, path):
+        data = self.assets.get(path)
+        if data is None:
+            return discord.File(path, filename=os.path.basename(path))
+        return discord.File(io.BytesIO(data), filename=os.path.basename(path))
+
+    def url(self, path):
+        return self.urls.get(path)
+
+    async def prepare(self, channel):
+        # 保存済みのメッセージを使い回し、使えなければアップロードし直す
+        # 使い回した場合はTrue、アップロードした場合はFalseを返す
+        saved = self._read()
+        if saved.get('channel_id') == channel.id:
+            self.channel_id = channel.id
+            self.message_ids = saved.get('message_ids', [])
+            if saved.get('signature') == self.signature() and self.message_ids:
+                try:
+                    await self._fetch(channel)
+                    return True
+                except discord.HTTPException as e:
+                    logger.warning("保存済みの震度画像のメッセージを取得できませんでした。再アップロードします: %s", e)
+                    self.urls.clear()
+        await self.upload(channel)
+        return False
+
+    async def upload(self, channel):
+        # アップロード先のメッセージを覚えておき、URLの期限が切れる前にrefreshで取り直す
+        paths = list(self.assets)
+        previous = self.message_ids if self.channel_id == channel.id else []
+        self.message_ids = []
+        for start in range(0, len(paths), _ATTACHMENTS_PER_MESSAGE):
+            chunk = paths[start:start + _ATTACHMENTS_PER_MESSAGE]
+            message = await channel.send(
+                content="震度画像のキャッシュ用メッセージです。削除しないでください。",
+                files=[discord.File(io.BytesIO(self.assets[path]), filename=_attachment_name(path)) for path in chunk],
+                silent=True
+            )
+            self.message_ids.append(message.id)
+            self._update_urls(chunk, message)
+        self.channel_id = channel.id
+        self._save()
+        # 使わなくなった前回のメッセージは削除する
+        for message_id in previous:
+            try:
+                await channel.get_partial_message(message_id).delete()
+            except discord.NotFound:
+                pass
+            except discord.HTTPException as e:
+                logger.warning("古い震度画像のメッセージ%dを削除できませんでした: %s", message_id, e)
+
+    async def refresh(self, channel):
+        try:
+            await self._fetch(channel)
+        except discord.HTTPException as e:
+            logger.warning("震度画像のURLの更新に失敗しました。再アップロードします: %s", e)
+            self.urls.clear()
+            try:
+                await self.upload(channel)
+            except Exception as e:
+                logger.exception("震度画像のアップロードに失敗しました: %s", e)
+
+    async def _fetch(self, channel):
+        for message_id in self.message_ids:
+            message = await channel.fetch_message(message_id)
+            self._update_urls(None, message)
+
+    def _read(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("震度画像のメッセージの記録を読み込めませんでした: %s", e)
+            return {}
+
+    def _save(self):
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"channel_id": self.channel_id, "message_ids": self.message_ids, "signature": self.signature()}, f)
+        os.replace(tmp_path, self.path)
+
+    def _update_urls(self, paths, message):
+        names = {_attachment_name(path): path for path in (paths or self.assets)}
+        for attachment in message.attachments:
+            path = names.get(attachment.filename)
+            if path is not None:
+                self.urls[path] = attachment.url
+
+
+def _attachment_name(path):
+    # 予報と警報で同じファイル名があるため、ディレクトリ名を含める
+    return path.replace('/', '_')
@@ -0,0 +1,102 @@
+# 震度画像の送信方法ごとの送信時間を比較するベンチマーク
+# python -m benchmarks.bench_assets
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import aiohttp
+import discord
+from aiohttp import web
+from discord.http import handle_message_parameters
+
+from assets import AssetCache
+
+IMAGE_PATH = "eew/warning/shindo5s.png"
+
+
+async def start_stub_server():
+    async def create_message(request):
+        await request.read()
+        return web.json_response({"id": "0"})
+
+    app = web.Application()
+    app.router.add_post('/channels/{channel_id}/messages', create_message)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/channels/0/messages"
+
+
+async def post(session, url, params):
+    # discord.pyのHTTPClient.requestと同じ方法でリクエストを組み立てる
+    if params.multipart:
+        form_data = aiohttp.FormData(quote_fields=False)
+        for field in params.multipart:
+            form_data.add_field(**field)
+        async with session.post(url, data=form_data) as response:
+            await response.read()
+    else:
+        async with session.post(url, json=params.payload) as response:
+            await response.read()
+    for f in params.files or ():
+        f.close()
+
+
+def build_embed(thumbnail_url):
+    embed = discord.Embed(title="⚠️緊急地震速報(地震動予報) 第1報", description="**03日06時31分頃石川県能登で地震、推定最大震度5強**", color=0xffd700)
+    embed.add_field(name="推定震源地", value="石川県能登", inline=True)
+    embed.add_field(name="マグニチュード", value="M5.9", inline=True)
+    embed.add_field(name="深さ", value="10km", inline=True)
+    embed.set_thumbnail(url=thumbnail_url)
+    return embed
+
+
+async def main(iterations):
+    cache = AssetCache()
+    cache.load()
+    name = os.path.basename(IMAGE_PATH)
+
+    cases = {
+        "ディスクから読み込み（従来）": lambda: handle_message_parameters(
+            embed=build_embed(f"attachment://{name}"), file=discord.File(IMAGE_PATH, filename=name)),
+        "メモリキャッシュ": lambda: handle_message_parameters(
+            embed=build_embed(f"attachment://{name}"), file=cache.file(IMAGE_PATH)),
+        "URL参照（添付なし）": lambda: handle_message_parameters(
+            embed=build_embed("https://cdn.discordapp.com/attachments/0/0/eew_warning_shindo5s.png")),
+    }
+
+    runner, url = await start_stub_server()
+    try:
+        async with aiohttp.ClientSession() as session:
+            for label, build in cases.items():
+                for _ in range(10):
+                    await post(session, url, build())
+                build_times = []
+                send_times = []
+                for _ in range(iterations):
+                    started_at = time.perf_counter()
+                    params = build()
+                    built_at = time.perf_counter()
+                    await post(session, url, params)
+                    finished_at = time.perf_counter()
+                    build_times.append(built_at - started_at)
+                    send_times.append(finished_at - started_at)
+                send_times.sort()
+                print(
+                    f"{label}: 準備 平均{statistics.mean(build_times) * 1e6:.1f}µs / "
+                    f"送信完了 p50 {send_times[len(send_times) // 2] * 1e3:.3f}ms "
+                    f"p99 {send_times[int(len(send_times) * 0.99)] * 1e3:.3f}ms"
+                )
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--iterations', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations))
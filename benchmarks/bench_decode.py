@@ -0,0 +1,94 @@
+# WebSocketで受信したフレームの解析方法ごとの処理速度を比較するベンチマーク
+# python -m benchmarks.bench_decode
+import argparse
+import json
+import random
+import time
+
+import decode
+
+# P2PQuakeで実際に流れてくる割合に近づけた構成（555: 地域ごとのピア数、561: 地震感知情報、9611: 感知情報の評価）
+MIX = {555: 0.55, 561: 0.25, 9611: 0.12, 554: 0.02, 551: 0.03, 552: 0.01, 556: 0.02}
+
+
+def make_frame(code, i, rng):
+    data = {"_id": f"bench{i:08x}", "code": code, "time": "2024/01/01 16:10:00.000"}
+    if code == 555:
+        data["areas"] = [{"id": area, "peer": rng.randint(1, 300)} for area in range(10, 910, 6)]
+    elif code == 561:
+        data.update({"area": rng.randint(10, 900), "user_agent": "jquake", "ver": "1.0"})
+    elif code == 9611:
+        data.update({"count": rng.randint(1, 50), "confidence": rng.random(), "area_confidences": {
+            str(area): {"confidence": rng.random(), "count": rng.randint(1, 9), "display": "A"} for area in range(10, 200, 10)
+        }})
+    elif code == 554:
+        data["type"] = "Detection"
+    elif code == 551:
+        data.update({
+            "issue": {"source": "気象庁", "time": "2024/01/01 16:10:00", "type": "DetailScale", "correct": "None"},
+            "earthquake": {"time": "2024/01/01 16:10:00", "maxScale": 70, "domesticTsunami": "Warning", "foreignTsunami": "Unknown",
+                           "hypocenter": {"name": "石川県能登地方", "latitude": 37.5, "longitude": 137.2, "depth": 10, "magnitude": 7.6}},
+            "points": [{"pref": "石川県", "addr": f"観測点{n}", "isArea": False, "scale": 40} for n in range(300)],
+        })
+    elif code == 552:
+        data.update({"cancelled": False, "issue": {"source": "気象庁", "time": "2024/01/01 16:22:00", "type": "Focus"},
+                     "areas": [{"grade": "Warning", "immediate": True, "name": f"沿岸{n}"} for n in range(30)]})
+    elif code == 556:
+        data.update({"test": False, "cancelled": False, "issue": {"time": "2024/01/01 16:10:10", "eventId": "20240101161006", "serial": "1"},
+                     "areas": [{"pref": "石川県", "name": f"地域{n}", "scaleFrom": 50, "scaleTo": 60, "kindCode": "19"} for n in range(20)]})
+    return json.dumps(data, ensure_ascii=False)
+
+
+def make_stream(count, seed=0):
+    rng = random.Random(seed)
+    codes = rng.choices(list(MIX), list(MIX.values()), k=count)
+    return [make_frame(code, i, rng) for i, code in enumerate(codes)]
+
+
+def load_stream(path):
+    # 受信したフレームを1行に1つずつ記録したファイル
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line for line in f.read().splitlines() if line.strip()]
+
+
+def full_parse(frames):
+    # 変更前と同じく全てのフレームを解析してからcodeを調べる
+    return [data for data in map(json.loads, frames) if data.get('code') in (551, 552, 556)]
+
+
+def run(label, handle, frames, repeat):
+    best = None
+    for _ in range(repeat):
+        cpu_started, wall_started = time.process_time(), time.perf_counter()
+        result = handle(frames)
+        cpu, wall = time.process_time() - cpu_started, time.perf_counter() - wall_started
+        best = (cpu, wall) if best is None or wall < best[1] else best
+    cpu, wall = best
+    print(f"{label}: {len(frames) / wall:,.0f}フレーム/秒 / CPU {cpu / len(frames) * 1e6:.2f}µs/フレーム ({len(result)}件を処理)")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recorded', help="1行に1フレームずつ記録したファイル")
+    parser.add_argument('--count', type=int, default=20000, help="合成するフレーム数")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    frames = load_stream(args.recorded) if args.recorded else make_stream(args.count)
+    print(f"{len(frames)}フレーム / 平均{sum(map(len, frames)) / len(frames):,.0f}文字")
+
+    expected = run("json.loads（全て解析）", full_parse, frames, args.repeat)
+    backends = [("json", json.loads)]
+    if decode.orjson is not None:
+        backends.append(("orjson", decode.orjson.loads))
+    for name, loads in backends:
+        decoder = decode.p2pquake_decoder(loads=loads)
+        result = run(f"先読み + {name}", lambda frames: [data for data in map(decoder, frames) if data is not None], frames, args.repeat)
+        assert result == expected
+    if decode.orjson is None:
+        print("orjsonがインストールされていないため、orjsonでの計測は省略しました。")
+
+
+if __name__ == '__main__':
+    main()
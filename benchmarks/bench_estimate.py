@@ -0,0 +1,80 @@
+# 緊急地震速報の報ごとに全ての地域の推定震度・到達時間を計算する時間を、地域ごとのループとNumPyで比較するベンチマーク
+# python -m benchmarks.bench_estimate
+import argparse
+import math
+import random
+import time
+
+from estimate import AreaEstimator, EARTH_RADIUS, P_VELOCITY, S_VELOCITY, SITE_AMPLIFICATION, _INTENSITY_BOUNDS
+
+
+def make_serials(count, seed=0):
+    # 報が進むごとに震源とマグニチュードが少しずつ変わる地震を想定する
+    rng = random.Random(seed)
+    latitude, longitude, depth, magnitude = 37.5, 137.2, 10.0, 5.5
+    serials = []
+    for _ in range(count):
+        latitude += rng.uniform(-0.05, 0.05)
+        longitude += rng.uniform(-0.05, 0.05)
+        depth = max(0.0, depth + rng.uniform(-5, 5))
+        magnitude = min(8.0, magnitude + rng.uniform(0, 0.15))
+        serials.append((latitude, longitude, depth, magnitude))
+    return serials
+
+
+def estimate_loop(estimator, latitude, longitude, depth, magnitude):
+    # 比較用: 同じ計算を地域ごとにPythonのループで行う
+    bounds = list(_INTENSITY_BOUNDS)
+    latitude, longitude = math.radians(latitude), math.radians(longitude)
+    mw = min(magnitude - 0.171, 8.3)
+    fault_half_length = 10 ** (0.5 * mw - 1.85) / 2
+    results = []
+    for name, area_latitude, area_longitude in zip(estimator.names, estimator.latitudes.tolist(), estimator.longitudes.tolist()):
+        a = (math.sin((area_latitude - latitude) / 2) ** 2
+             + math.cos(latitude) * math.cos(area_latitude) * math.sin((area_longitude - longitude) / 2) ** 2)
+        hypocentral = math.hypot(2 * EARTH_RADIUS * math.asin(math.sqrt(a)), depth)
+        distance = max(hypocentral - fault_half_length, 3.0)
+        log_pgv = (0.58 * mw + 0.0038 * min(depth, 300.0) - 1.29
+                   - math.log10(distance + 0.0028 * 10 ** (0.5 * mw)) - 0.002 * distance)
+        value = 2.165 + 2.262 * (log_pgv + math.log10(SITE_AMPLIFICATION))
+        rank = sum(value >= bound for bound in bounds)
+        if rank:
+            results.append((name, rank, value, hypocentral / P_VELOCITY, hypocentral / S_VELOCITY))
+    results.sort(key=lambda entry: (-entry[2], entry[4]))
+    return results
+
+
+def run(label, handle, serials, repeat):
+    times = []
+    for _ in range(repeat):
+        for serial in serials:
+            started_at = time.perf_counter()
+            handle(*serial)
+            times.append(time.perf_counter() - started_at)
+    times.sort()
+    print(f"{label}: 1報あたり p50 {times[len(times) // 2] * 1e6:.0f}µs / p99 {times[int(len(times) * 0.99)] * 1e6:.0f}µs / "
+          f"{len(serials)}報の合計 {sum(times) / repeat * 1e3:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--serials', type=int, default=25, help="1つの地震の報の数")
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    estimator = AreaEstimator()
+    serials = make_serials(args.serials)
+    print(f"{len(estimator)}地域 / {len(serials)}報")
+
+    # 両方の結果が一致することを確認する
+    for serial in serials:
+        expected = [(name, rank) for name, rank, *_ in estimate_loop(estimator, *serial)]
+        assert [(area.name, area.level.rank) for area in estimator.estimate(*serial).areas()] == expected
+
+    run("地域ごとのループ", lambda *serial: estimate_loop(estimator, *serial), serials, args.repeat)
+    run("NumPy（推定のみ）", estimator.estimate, serials, args.repeat)
+    run("NumPy（震度1以上の地域を並べ替えて取得）", lambda *serial: estimator.estimate(*serial).areas(), serials, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# 受信したフレームをイベントのモデルに正規化する処理時間と、1件あたりのメモリ使用量を計測するベンチマーク
+# python -m benchmarks.bench_events
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime
+
+import intensity
+from benchmarks.bench_decode import make_frame
+from events import TIME_FORMAT, normalize_p2pquake, normalize_wolfx, parse_time
+
+
+def load_frames(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        wolfx = json.load(f)
+    rng = random.Random(0)
+    p2pquake = [json.loads(make_frame(code, i, rng)) for i, code in enumerate((551, 552, 556))]
+    # 556の震源と発生時刻は合成フレームに含まれないため補う
+    p2pquake[2]["earthquake"] = {"originTime": "2024/01/01 16:10:00", "condition": "", "hypocenter": {
+        "name": "石川県能登地方", "latitude": 37.5, "longitude": 137.2, "depth": 10, "magnitude": 7.4}}
+    for area in p2pquake[2]["areas"]:
+        area["arrivalTime"] = "2024/01/01 16:10:30"
+    return [("Wolfx jma_eew", normalize_wolfx, data) for data in wolfx] + [
+        (f"P2PQuake {data['code']}", normalize_p2pquake, data) for data in p2pquake
+    ]
+
+
+def legacy_wolfx(data):
+    # 比較用: 変更前と同じく、重複の判定・保存・表示のそれぞれでdictから読み直して解析する
+    def origin_time():
+        try:
+            return datetime.strptime(data.get('OriginTime'), TIME_FORMAT)
+        except (TypeError, ValueError):
+            return None
+    # 突き合わせ
+    origin_time(), float(data.get('Magunitude')), data.get('Latitude'), data.get('Longitude')
+    # 保存
+    parsed = origin_time()
+    parsed.strftime("%Y-%m-%d %H:%M:%S") if parsed else None
+    intensity.from_label(data.get('MaxIntensity'))
+    # 表示
+    level = intensity.from_label(data.get('MaxIntensity'))
+    parsed = origin_time()
+    parsed.strftime("%d日%H時%M分") if parsed else '不明'
+    "{:.1f}".format(float(data.get('Magunitude')))
+    lines = []
+    for area in data.get('WarnArea', []):
+        try:
+            arrival_time = datetime.strptime(area.get('Time', '//////'), "%H%M%S").strftime("%H時%M分%S秒")
+        except ValueError:
+            arrival_time = '不明'
+        lines.append(f"地域: {area.get('Chiiki', '不明')}\n予想震度: {area.get('Shindo1', '不明')}\n到達時間: {arrival_time}\n状況: {area.get('Arrive', '不明')}")
+    return level, lines
+
+
+def normalized_wolfx(data):
+    # 正規化してから同じ値を使う
+    event = normalize_wolfx(data)
+    event.origin_time_text, event.magnitude_text, event.warn_area_lines
+    return event
+
+
+def timed(handle, data, repeat):
+    times = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        handle(data)
+        times.append(time.perf_counter() - started_at)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def allocations(handle, data, count=1000):
+    # 1件の正規化で確保するメモリと、イベントを保持し続けた場合のメモリ（受信したdictは除く）
+    tracemalloc.start()
+    handle(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    kept = [handle(data) for _ in range(count)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return peak, (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recorded', default='testdata.json', help="Wolfxの緊急地震速報の記録（testdata.json形式）")
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    frames = load_frames(args.recorded)
+    results = {}
+    for label, handle, data in frames:
+        seconds = timed(handle, data, args.repeat)
+        peak, kept = allocations(handle, data)
+        results.setdefault(label, []).append((seconds, peak, kept))
+    for label, entries in results.items():
+        count = len(entries)
+        print(f"{label} ({count}件): 正規化 {sum(e[0] for e in entries) / count * 1e6:.1f}µs/フレーム / "
+              f"確保 {sum(e[1] for e in entries) / count / 1024:.1f}KiB / 保持 {sum(e[2] for e in entries) / count:,.0f}バイト")
+
+    # Wolfxの緊急地震速報1報を処理する間に値を解析する時間
+    wolfx = [data for label, _, data in frames if label.startswith("Wolfx")]
+    for label, handle in (("変更前（処理ごとにdictから解析）", legacy_wolfx), ("正規化したモデルを共有", normalized_wolfx)):
+        print(f"{label}: {sum(timed(handle, data, args.repeat) for data in wolfx) / len(wolfx) * 1e6:.1f}µs/報")
+
+    # 時刻の解析方法の比較
+    value = "2024/01/01 16:10:00"
+    assert parse_time(value) == datetime.strptime(value, TIME_FORMAT)
+    print(f"時刻の解析: strptime {timed(lambda v: datetime.strptime(v, TIME_FORMAT), value, args.repeat * 10) * 1e6:.2f}µs / "
+          f"fromisoformat {timed(parse_time, value, args.repeat * 10) * 1e6:.2f}µs")
+
+    # 表示用の文字列は最初に使われたときに作り、以降は保存した結果を返す
+    event = max((handle(data) for _, handle, data in frames), key=lambda e: len(getattr(e, 'warn_areas', ())))
+    first = timed(lambda e: type(e).warn_area_lines.func(e), event, args.repeat)
+    event.warn_area_lines
+    print(f"地域ごとの表示（{len(event.warn_areas)}地域）: 作成 {first * 1e6:.2f}µs / 2回目以降 {timed(lambda e: e.warn_area_lines, event, args.repeat) * 1e6:.2f}µs")
+
+
+if __name__ == '__main__':
+    main()
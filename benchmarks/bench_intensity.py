@@ -0,0 +1,100 @@
+# 震度速報の観測点リストを文字列にする処理の、if/elifとテーブル参照の比較
+# python -m benchmarks.bench_intensity
+import argparse
+import random
+import timeit
+
+import intensity
+
+SCALE_CODES = (10, 20, 30, 40, 45, 46, 50, 55, 60, 70, -1)
+
+
+def legacy_points_info(points):
+    # 変更前のprocess_p2pquake_infoと同じく、メッセージごとに関数を定義して観測点ごとに呼び出す
+    def intensity_label(scale):
+        if scale == 10:
+            return "1"
+        elif scale == 20:
+            return "2"
+        elif scale == 30:
+            return "3"
+        elif scale == 40:
+            return "4"
+        elif scale == 45:
+            return "5弱"
+        elif scale == 50:
+            return "5強"
+        elif scale == 55:
+            return "6弱"
+        elif scale == 60:
+            return "6強"
+        elif scale == 70:
+            return "7"
+        else:
+            return "不明"
+
+    return "\n".join([f"{point['addr']}: 震度{intensity_label(point['scale'])}" for point in points])
+
+
+def table_points_info(points):
+    return "\n".join([f"{point['addr']}: 震度{intensity.from_scale(point['scale']).label}" for point in points])
+
+
+def legacy_lookup(points):
+    labels = []
+    for point in points:
+        scale = point['scale']
+        if scale >= 70:
+            labels.append('7')
+        elif scale >= 60:
+            labels.append('6強')
+        elif scale >= 55:
+            labels.append('6弱')
+        elif scale >= 50:
+            labels.append('5強')
+        elif scale >= 45:
+            labels.append('5弱')
+        elif scale >= 40:
+            labels.append('4')
+        elif scale >= 30:
+            labels.append('3')
+        elif scale >= 20:
+            labels.append('2')
+        elif scale >= 10:
+            labels.append('1')
+        else:
+            labels.append('不明')
+    return labels
+
+
+def table_lookup(points):
+    return [intensity.from_scale(point['scale']).label for point in points]
+
+
+def make_points(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        {"pref": f"県{i % 47}", "addr": f"観測点{i}", "isArea": False, "scale": rng.choice(SCALE_CODES)}
+        for i in range(count)
+    ]
+
+
+def main(repeat):
+    for count in (100, 500, 2000):
+        points = make_points(count)
+        cases = (
+            ("文字列化 if/elif", legacy_points_info),
+            ("文字列化 テーブル参照", table_points_info),
+            ("震度の判定のみ if/elif", legacy_lookup),
+            ("震度の判定のみ テーブル参照", table_lookup),
+        )
+        for label, func in cases:
+            elapsed = min(timeit.repeat(lambda: func(points), number=repeat, repeat=5)) / repeat
+            print(f"{count}地点 {label}: {elapsed * 1e6:.1f}µs/メッセージ ({elapsed / count * 1e9:.0f}ns/地点)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--repeat', type=int, default=200)
+    args = parser.parse_args()
+    main(args.repeat)
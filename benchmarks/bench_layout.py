@@ -0,0 +1,102 @@
+# 観測点が多い震度速報や対象地域が多い津波情報を、Discordの制限内に分割できているかの確認と処理時間の計測
+# python -m benchmarks.bench_layout
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import discord
+
+import intensity
+import layout
+from events import Point, TsunamiArea
+
+SCALE_CODES = (10, 20, 30, 40, 45, 46, 50, 55, 60, 70)
+GRADES = ("MajorWarning", "Warning", "Watch", "Unknown")
+CONDITIONS = ("", "到達を確認", "第１波の到達予想時刻")
+HEIGHTS = (("１０ｍ超", 10.0), ("３ｍ", 3.0), ("１ｍ", 1.0), ("", 0.0))
+PREFECTURES = ("北海道", "青森県", "岩手県", "宮城県", "秋田県", "山形県", "福島県", "茨城県", "栃木県", "群馬県", "新潟県", "富山県", "石川県", "福井県")
+
+
+def make_points(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        Point(rng.choice(PREFECTURES), f"{rng.choice(PREFECTURES)[:2]}観測点{i}", intensity.from_scale(rng.choice(SCALE_CODES)))
+        for i in range(count)
+    ]
+
+
+def make_tsunami_areas(count, seed=0):
+    # P2PQuake（552）を正規化したものと同じ形の地域（到達予想時刻がない地域・直ちに津波来襲の地域を含む）
+    rng = random.Random(seed)
+    issued_at = datetime(2024, 1, 1, 16, 10)
+    areas = []
+    for i in range(count):
+        height, height_value = rng.choice(HEIGHTS)
+        arrival_time = issued_at + timedelta(minutes=rng.randrange(120)) if rng.random() < 0.7 else None
+        areas.append(TsunamiArea(f"{rng.choice(PREFECTURES)}沿岸{i}", rng.choice(GRADES), rng.random() < 0.1, arrival_time, rng.choice(CONDITIONS), height, height_value))
+    return areas
+
+
+def check(messages):
+    # 分割後の全てのメッセージがDiscordの制限内であることを確認し、制限を超えた箇所を返す
+    errors = []
+    for page, embeds in enumerate(messages):
+        if len(embeds) > layout.EMBEDS_PER_MESSAGE:
+            errors.append(f"{page}件目: 埋め込み{len(embeds)}個")
+        total = sum(len(embed) for embed in embeds)
+        if total > layout.EMBED_TOTAL_LIMIT:
+            errors.append(f"{page}件目: 合計{total}文字")
+        for embed in embeds:
+            if len(embed.fields) > layout.FIELDS_PER_EMBED:
+                errors.append(f"{page}件目: フィールド{len(embed.fields)}個")
+            for field in embed.fields:
+                if len(field.name) > layout.FIELD_NAME_LIMIT or not 0 < len(field.value) <= layout.FIELD_VALUE_LIMIT:
+                    errors.append(f"{page}件目: {field.name[:20]} 名前{len(field.name)}文字・値{len(field.value)}文字")
+    return errors
+
+
+def lines_of(messages):
+    # 分割後のフィールドの値に含まれる行（分割で行が失われていないことの確認用）
+    return [line for embeds in messages for embed in embeds for field in embed.fields for line in field.value.split("\n")]
+
+
+def run(label, build, expected_lines=None):
+    started_at = time.perf_counter()
+    messages = build()
+    elapsed = time.perf_counter() - started_at
+    errors = check(messages)
+    if expected_lines is not None and sorted(lines_of(messages)) != sorted(expected_lines):
+        errors.append("分割の前後で行が一致しません")
+    print(f"  {'NG' if errors else 'OK'} {label}: {len(messages)}メッセージ / {sum(len(embeds) for embeds in messages)}埋め込み ({elapsed * 1e3:.2f}ms)")
+    for error in errors[:5]:
+        print(f"    {error}")
+    return not errors
+
+
+def base_embed():
+    embed = discord.Embed(title="🌍 震度速報", description="01日16時10分頃、\n**最大震度7**を観測する地震が発生しました。", color=0x9D00DE)
+    embed.set_footer(text="気象庁・震度速報 | Version test")
+    return embed
+
+
+def main():
+    ok = True
+    for count in (1, 1000, 3000, 10000):
+        points = make_points(count)
+        ok &= run(f"震度速報 {count}地点", lambda: layout.paginate(base_embed(), layout.point_fields(points)))
+    # 1つの都道府県に観測点が集中し、1行が制限を超える
+    points = [Point("北海道", f"{'長い名前の観測点' * 8}{i}", intensity.from_scale(70)) for i in range(300)]
+    ok &= run("1つの都道府県に長い名前の観測点 300地点", lambda: layout.paginate(base_embed(), layout.point_fields(points)))
+    for count in (1, 66, 500):
+        areas = make_tsunami_areas(count)
+        ok &= run(f"津波情報 {count}地域", lambda: layout.paginate(base_embed(), layout.tsunami_fields(areas)), [layout.tsunami_area_line(area) for area in areas])
+    ok &= run("1行が長いデータ", lambda: layout.paginate(base_embed(), layout.make_fields("data", ["x" * 5000])))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    argparse.ArgumentParser().parse_args()
+    main()
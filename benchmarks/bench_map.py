@@ -0,0 +1,107 @@
+# 震度分布図の描画時間（タイルのキャッシュの有無）と、描画中のイベントループの遅れを計測するベンチマーク
+# python -m benchmarks.bench_map
+import argparse
+import asyncio
+import logging
+import time
+
+import quake_map
+from benchmarks.bench_estimate import make_serials
+from estimate import AreaEstimator
+from quake_map import AreaLocator, MapRenderer, render_map
+
+
+def make_jobs(count):
+    # 緊急地震速報の報ごとの推定震度から地図の入力を作る
+    estimator = AreaEstimator()
+    locator = AreaLocator()
+    jobs = []
+    for latitude, longitude, depth, magnitude in make_serials(count):
+        areas = estimator.estimate(latitude, longitude, depth, magnitude).areas()
+        jobs.append((locator.points((area.name, area.pref, area.level.rank) for area in areas), (latitude, longitude)))
+    return jobs
+
+
+def measure_render(jobs):
+    quake_map._tile.cache_clear()
+    started_at = time.perf_counter()
+    render_map(*jobs[0])
+    cold = time.perf_counter() - started_at
+    times = []
+    for job in jobs:
+        started_at = time.perf_counter()
+        render_map(*job)
+        times.append(time.perf_counter() - started_at)
+    times.sort()
+    info = quake_map.tile_cache_info()
+    print(f"描画（タイルのキャッシュなし）: {cold * 1e3:.1f}ms")
+    print(f"描画（キャッシュあり）: p50 {times[len(times) // 2] * 1e3:.1f}ms / 最大 {times[-1] * 1e3:.1f}ms "
+          f"(タイル {info.hits}件再利用 / {info.misses}件作成)")
+
+
+async def measure_loop_lag(label, render, jobs, interval=0.005):
+    # 5msごとに起きるタスクの遅れを、イベントループが止まっていた時間として計測する
+    lags = []
+    running = True
+
+    async def ticker():
+        while running:
+            started_at = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - started_at - interval)
+
+    task = asyncio.create_task(ticker())
+    started_at = time.perf_counter()
+    results = await render(jobs)
+    elapsed = time.perf_counter() - started_at
+    running = False
+    await task
+    lags.sort()
+    rendered = sum(result is not None for result in results)
+    print(f"{label}: {rendered}/{len(results)}件描画 {elapsed:.2f}秒 / イベントループの遅れ p99 {lags[int(len(lags) * 0.99)] * 1e3:.1f}ms / 最大 {lags[-1] * 1e3:.1f}ms")
+
+
+async def main(count, burst):
+    jobs = make_jobs(count)
+    measure_render(jobs)
+
+    async def inline(jobs):
+        # 比較用: イベントループの中で描画する
+        results = []
+        for job in jobs:
+            results.append(render_map(*job))
+            await asyncio.sleep(0)
+        return results
+
+    # 省略した描画ごとの警告は出力しない
+    logging.getLogger('quake_map').setLevel(logging.ERROR)
+    renderer = MapRenderer()
+    renderer.start()
+    # 描画用のプロセスの起動とタイルの作成を待つ
+    await renderer.render('warm', *jobs[0])
+    try:
+        async def pooled(jobs):
+            results = []
+            for job in jobs:
+                results.append(await renderer.render('bench', *job))
+            return results
+
+        async def burst_render(jobs):
+            # 同じ地震の報が続けて届いた場合（描画待ちの上限を超えた分は省略し、古い報の地図は送信しない）
+            return await asyncio.gather(*(renderer.render('burst', *job) for job in jobs[:burst]))
+
+        await measure_loop_lag("イベントループで描画", inline, jobs)
+        await measure_loop_lag("プロセスプールで描画", pooled, jobs)
+        await measure_loop_lag(f"プロセスプールで{burst}報を同時に描画", burst_render, jobs)
+        stats = renderer.stats()
+        print(f"省略 {stats['dropped']}件 / 新しい報で破棄 {stats['superseded']}件")
+    finally:
+        renderer.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--serials', type=int, default=25, help="描画する報の数")
+    parser.add_argument('--burst', type=int, default=10, help="同時に描画を依頼する報の数")
+    args = parser.parse_args()
+    asyncio.run(main(args.serials, args.burst))
@@ -0,0 +1,107 @@
+# 続報の多い津波情報で、毎回全ての地域を送信する場合と、前回の報から変わった地域だけを送信する場合を比較するベンチマーク
+# python -m benchmarks.bench_tsunami
+import argparse
+import random
+import time
+
+import discord
+
+import layout
+from events import format_time, normalize_p2pquake
+from tsunami_state import GRADE_RANKS, TsunamiTracker
+
+GRADES = [grade for grade in GRADE_RANKS if grade != "Unknown"]
+HEIGHTS = {"Watch": "１ｍ", "Warning": "３ｍ", "MajorWarning": "５ｍ"}
+
+
+def make_bulletins(areas, count, changes, seed=0):
+    # 最初の報で全ての地域に発表し、続報ごとに一部の地域の種類・到達予想時刻が変わる
+    rng = random.Random(seed)
+    state = {f"沿岸{n}": [rng.choice(GRADES), 16 * 60 + rng.randrange(10, 60)] for n in range(areas)}
+    bulletins = []
+    for index in range(count):
+        if index:
+            for name in rng.sample(sorted(state), changes):
+                if rng.random() < 0.5:
+                    state[name][0] = GRADES[min(max(GRADES.index(state[name][0]) + rng.choice((-1, 1)), 0), len(GRADES) - 1)]
+                else:
+                    state[name][1] += rng.randrange(1, 10)
+        minutes = 16 * 60 + 20 + index * 10
+        bulletins.append({
+            "code": 552, "id": str(index), "cancelled": False,
+            "issue": {"source": "気象庁", "time": f"2024/01/01 {minutes // 60:02d}:{minutes % 60:02d}:00", "type": "Focus"},
+            "areas": [{
+                "name": name, "grade": grade, "immediate": False,
+                "firstHeight": {"arrivalTime": f"2024/01/01 {arrival // 60 % 24:02d}:{arrival % 60:02d}:00"},
+                "maxHeight": {"description": HEIGHTS[grade], "value": None},
+            } for name, (grade, arrival) in state.items()],
+        })
+    return bulletins
+
+
+def full_rebuild(event, tracker):
+    # 比較用: 変更前と同じく、報ごとに全ての地域の文字列を作り直して新しいメッセージで送信する
+    lines = [
+        f"**{area.name}**\n"
+        f"予報種別: {area.grade}\n"
+        f"第1波到達予想時刻: {format_time(area.arrival_time, '%d日%H時%M分')}\n"
+        f"状況: {area.condition}\n"
+        f"予想高さ: {area.height} ({f'{area.height_value:g}' if area.height_value is not None else '不明'}m)\n"
+        f"{'直ちに津波来襲と予想されています。' if area.immediate else ''}"
+        for area in event.tsunami_areas
+    ]
+    embed = discord.Embed(title="🌊 津波情報", description="津波情報が発表されました。")
+    return layout.paginate(embed, layout.make_fields("対象地域", lines, separator="\n\n")), []
+
+
+def incremental(event, tracker):
+    # 変わった地域だけを新しいメッセージで送信し、まとめのメッセージは編集する
+    changes = tracker.update(event)
+    if changes is None:
+        return [], []
+    summary = layout.paginate(discord.Embed(title="🌊 津波情報"), layout.tsunami_fields(changes.areas))[:1]
+    if changes.first:
+        return summary, []
+    lines = [layout.tsunami_area_line(new) for _, new in (*changes.upgraded, *changes.downgraded, *changes.updated)]
+    lines.extend(layout.tsunami_area_line(area) for area in (*changes.added, *changes.cleared))
+    return layout.paginate(discord.Embed(title="🌊 津波情報の更新"), layout.make_fields("変更", lines)), summary
+
+
+def size(messages):
+    return sum(len(embed) for embeds in messages for embed in embeds)
+
+
+def run(label, handle, events, repeat):
+    times = []
+    for _ in range(repeat):
+        tracker = TsunamiTracker()
+        layout.tsunami_area_line.cache_clear()
+        sent = edited = characters = 0
+        for event in events:
+            started_at = time.perf_counter()
+            messages, edits = handle(event, tracker)
+            times.append(time.perf_counter() - started_at)
+            sent += len(messages)
+            edited += len(edits)
+            characters += size(messages) + size(edits)
+    times.sort()
+    print(f"{label}: 1報あたり p50 {times[len(times) // 2] * 1e6:.0f}µs / p99 {times[int(len(times) * 0.99)] * 1e6:.0f}µs / "
+          f"新しいメッセージ {sent}件 / 編集 {edited}件 / 送信する文字数 {characters:,}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--areas', type=int, default=66, help="発表する地域の数")
+    parser.add_argument('--bulletins', type=int, default=30, help="一連の津波情報の報の数")
+    parser.add_argument('--changes', type=int, default=3, help="続報ごとに変わる地域の数")
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    events = [normalize_p2pquake(data) for data in make_bulletins(args.areas, args.bulletins, args.changes)]
+    print(f"{args.areas}地域 / {args.bulletins}報 / 続報ごとに{args.changes}地域が変化")
+    run("毎回全ての地域を送信", full_rebuild, events, args.repeat)
+    run("変わった地域だけを送信", incremental, events, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
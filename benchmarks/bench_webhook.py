@@ -0,0 +1,117 @@
+# BOTからのchannel.sendとWebhook（wait=false）で、複数チャンネルへの配信にかかる時間を比較するベンチマーク
+# Discordの代わりにローカルのHTTPサーバーへ送信する
+# python -m benchmarks.bench_webhook
+import argparse
+import asyncio
+import time
+
+import aiohttp
+import discord
+from aiohttp import web
+from discord.http import HTTPClient, Route, handle_message_parameters
+
+from webhook import WebhookDelivery
+
+
+async def start_stub_server(latency):
+    # Discordの処理時間の代わりにlatency秒待ってから応答する
+    async def create_message(request):
+        await request.read()
+        await asyncio.sleep(latency)
+        return web.json_response({"id": "0", "channel_id": request.match_info['channel_id']})
+
+    async def execute_webhook(request):
+        await request.read()
+        await asyncio.sleep(latency)
+        if request.query.get('wait') == 'true':
+            return web.json_response({"id": "0"})
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_post('/channels/{channel_id}/messages', create_message)
+    app.router.add_post('/webhooks/{webhook_id}/{token}', execute_webhook)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def build_embed():
+    embed = discord.Embed(title="⚠️緊急地震速報(地震動予報) 第1報", description="**03日06時31分頃石川県能登で地震、推定最大震度5強**", color=0xffd700)
+    embed.add_field(name="推定震源地", value="石川県能登", inline=True)
+    embed.add_field(name="マグニチュード", value="M5.9", inline=True)
+    embed.add_field(name="深さ", value="10km", inline=True)
+    return embed
+
+
+def make_http(base):
+    # BOTのchannel.sendが使うdiscord.pyのHTTPClientをローカルのサーバーに向ける
+    Route.BASE = base
+    http = HTTPClient(asyncio.get_running_loop())
+    http._HTTPClient__session = aiohttp.ClientSession()
+    http._global_over = asyncio.Event()
+    http._global_over.set()
+    http.token = "bench"
+    return http
+
+
+async def measure(label, send_round, rounds):
+    for _ in range(5):
+        await send_round()
+    times = []
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        await send_round()
+        times.append(time.perf_counter() - started_at)
+    times.sort()
+    print(f"{label}: p50 {times[len(times) // 2] * 1e3:.2f}ms / p99 {times[int(len(times) * 0.99)] * 1e3:.2f}ms")
+
+
+async def main(channels, rounds, latency):
+    runner, base = await start_stub_server(latency)
+    http = make_http(base)
+    webhooks = WebhookDelivery(webhook_rate=float('inf'), webhook_burst=float('inf'))
+    targets = [(channel_id, f"{base}/webhooks/{channel_id}/token") for channel_id in range(1, channels + 1)]
+
+    def make_messages(start=0):
+        return [{"embeds": [build_embed()], "silent": False}][start:]
+
+    async def bot_round():
+        await asyncio.gather(*(
+            http.send_message(channel_id, params=handle_message_parameters(embeds=[build_embed()]))
+            for channel_id, _ in targets
+        ))
+
+    async def webhook_round():
+        await webhooks.send(targets, make_messages, None)
+
+    async def unpooled_round():
+        # 比較用: 送信ごとに新しいセッション（接続）を作る
+        async def post(url):
+            async with aiohttp.ClientSession() as session:
+                params = handle_message_parameters(embeds=[build_embed()])
+                async with session.post(url, params={"wait": "false"}, json=params.payload) as response:
+                    await response.read()
+        await asyncio.gather(*(post(url) for _, url in targets))
+
+    print(f"{channels}チャンネル / {rounds}回 / サーバーの処理時間 {latency * 1e3:.0f}ms")
+    try:
+        await measure("BOT (channel.send)", bot_round, rounds)
+        await measure("Webhook (wait=false, セッションを使い回す)", webhook_round, rounds)
+        await measure("Webhook (wait=false, 毎回接続)", unpooled_round, rounds)
+        assert webhooks.fallback == 0
+    finally:
+        await webhooks.close()
+        await http.close()
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--channels', type=int, default=20)
+    parser.add_argument('-n', '--rounds', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help="ローカルのサーバーが応答するまでの秒数")
+    args = parser.parse_args()
+    asyncio.run(main(args.channels, args.rounds, args.latency))
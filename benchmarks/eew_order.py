@@ -0,0 +1,117 @@
+# 緊急地震速報の重複・順序の入れ替わりの試験: testdata.json・testdata1.jsonの報を重複させたり順番を入れ替えたりして
+# EEWTrackerに渡し、送信される報が報数の昇順になり、同じ報を二重に送信せず、取消報・最終報を捨てないことを確認する
+# python -m benchmarks.eew_order
+import argparse
+import copy
+import json
+import random
+import sys
+import time
+
+from eew_state import EEWTracker
+from events import normalize_wolfx
+
+RECORDED = ("testdata.json", "testdata1.json")
+
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        frames = json.load(f)
+    for data in frames:
+        # testdata1.jsonにはtypeが含まれていない
+        data.setdefault("type", "jma_eew")
+    return frames
+
+
+def cancel_of(data):
+    # 同じ報数で発表された取消報
+    data = copy.deepcopy(data)
+    data.update(isCancel=True, isFinal=False, Title="緊急地震速報（予報）取消")
+    return data
+
+
+def run(frames, tracker=None):
+    # 受け付けた報の(報数, 取消か)を受信順に返す
+    tracker = tracker or EEWTracker()
+    accepted = []
+    for data in frames:
+        event = normalize_wolfx(data)
+        if event is not None and tracker.accept_event(event):
+            accepted.append((event.serial, event.is_cancel))
+    return accepted, tracker
+
+
+def reorder(frames, rng, window):
+    # 受信時刻にwindow件分までのずれを加え、近い報同士の順番を入れ替える
+    return [data for _, data in sorted(((index + rng.uniform(0, window), data) for index, data in enumerate(frames)), key=lambda entry: entry[0])]
+
+
+def increasing(accepted):
+    return all(a[0] < b[0] or (a[0] == b[0] and not a[1] and b[1]) for a, b in zip(accepted, accepted[1:]))
+
+
+def scenarios(frames, rng, trials):
+    serials = [data["Serial"] for data in frames]
+    last = max(serials)
+
+    accepted, _ = run(frames)
+    yield "受信順", accepted == [(serial, False) for serial in serials], f"{len(accepted)}/{len(frames)}件を送信"
+
+    # 複数の接続から同じ報が届く
+    doubled = [data for data in frames for _ in range(3)]
+    accepted, tracker = run(doubled)
+    yield "全ての報が3回ずつ届く", accepted == [(serial, False) for serial in serials], f"{len(accepted)}件を送信 / 重複 {tracker.dropped_duplicate}件"
+
+    # 順番が入れ替わった報は古いものを捨て、送信する報は報数の昇順で最終報は必ず送信する
+    ok = True
+    sent = dropped = 0
+    for _ in range(trials):
+        shuffled = reorder([data for data in frames for _ in range(2)], rng, window=4)
+        accepted, tracker = run(shuffled)
+        sent += len(accepted)
+        dropped += tracker.dropped_stale
+        ok &= increasing(accepted) and accepted[-1] == (last, False) and len(set(accepted)) == len(accepted)
+    yield f"順番の入れ替わり（{trials}回）", ok, f"平均 {sent / trials:.1f}件を送信 / 古い報 平均{dropped / trials:.1f}件"
+
+    # 最終報の代わりに、直前の報と同じ報数の取消報が発表され、複数の接続から届く
+    with_cancel = [*frames[:-1], cancel_of(frames[-2]), cancel_of(frames[-2])]
+    accepted, tracker = run(with_cancel)
+    expected = [*((serial, False) for serial in serials[:-1]), (serials[-2], True)]
+    yield "同じ報数の取消報", accepted == expected, f"{len(accepted)}件を送信 / 取消報 {sum(cancel for _, cancel in accepted)}件 / 重複 {tracker.dropped_duplicate}件"
+
+    # 再起動後は保存済みの報数を読み込み、それより新しい報だけを送信する
+    middle = len(frames) // 2
+    tracker = EEWTracker()
+    tracker.warm(frames[0]["EventID"], serials[middle - 1])
+    accepted, _ = run(frames, tracker)
+    yield "再起動後に全ての報を再受信", accepted == [(serial, False) for serial in serials[middle:]], f"{len(accepted)}件を送信"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recorded', nargs='+', default=RECORDED, help="Wolfxの緊急地震速報の記録（testdata.json形式）")
+    parser.add_argument('--trials', type=int, default=200, help="順番を入れ替える試行回数")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    failed = False
+    for path in args.recorded:
+        frames = load(path)
+        print(f"{path}: {len(frames)}報 (第{frames[0]['Serial']}報〜第{frames[-1]['Serial']}報)")
+        for label, ok, detail in scenarios(frames, rng, args.trials):
+            print(f"  {'OK' if ok else 'NG'} {label}: {detail}")
+            failed |= not ok
+
+        events = [normalize_wolfx(data) for data in frames] * 1000
+        tracker = EEWTracker()
+        started_at = time.perf_counter()
+        for event in events:
+            tracker.accept_event(event)
+        print(f"  判定 1報あたり {(time.perf_counter() - started_at) / len(events) * 1e9:.0f}ns")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
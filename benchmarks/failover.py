@@ -0,0 +1,178 @@
+# 冗長化の試験: 同じマシンで2つのプロセスを動かし、リーダーを強制終了・正常終了させたときの引き継ぎ時間と
+# 二重送信・送信漏れの有無を確認する（全てのプロセスが同じ時刻に同じ情報を受信したものとして扱う）
+# python -m benchmarks.failover
+import argparse
+import asyncio
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from leader import LeaderLease, StandbyBuffer
+
+
+async def child(name, path, output, started_at, rate, count, ttl):
+    # BOTと同じく、リーダーは配信して記録し、待機中は保持して引き継ぎ時に未配信のものだけを配信する
+    out = os.open(output, os.O_WRONLY | os.O_APPEND)
+
+    def write(line):
+        os.write(out, f"{line}\n".encode())
+
+    def deliver(index):
+        write(f"deliver {name} {index} {time.time():.3f}")
+        lease.mark(f"frame:{index}")
+
+    async def take_over(leader):
+        write(f"{'leader' if leader else 'standby'} {name} {time.time():.3f}")
+        if not leader:
+            return
+        entries = standby.drain()
+        undelivered = await lease.undelivered(key for _, key, _ in entries)
+        for _, key, index in entries:
+            if key in undelivered:
+                deliver(index)
+
+    lease = LeaderLease(path, instance_id=name, ttl=ttl, renew_interval=ttl / 3, on_change=take_over).open()
+    standby = StandbyBuffer(window=ttl + 10)
+    task = asyncio.create_task(lease.run())
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    try:
+        index = int(max(0, time.time() - started_at) * rate)
+        while index < count and not stopping.is_set():
+            delay = started_at + index / rate - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(stopping.wait(), delay)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+            if lease.is_leader:
+                deliver(index)
+            else:
+                standby.add(f"frame:{index}", index)
+            index += 1
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        os.close(out)
+
+
+def spawn(name, args, path, output, started_at):
+    return subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.failover', '--child', name, '--lease', path, '--output', output,
+        '--started-at', str(started_at), '--rate', str(args.rate), '--count', str(args.count), '--ttl', str(args.ttl),
+    ])
+
+
+def lease_state(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT holder, expires_at FROM lease WHERE name = 'leader'").fetchone()
+
+
+def wait_for_leader(path, exclude=None, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            state = lease_state(path)
+        except sqlite3.Error:
+            state = None
+        if state is not None and state[0] != exclude and state[1] > time.time():
+            return state
+        time.sleep(0.05)
+    raise TimeoutError("リーダーが決まりませんでした")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=float, default=20, help="1秒あたりの受信数")
+    parser.add_argument('--count', type=int, default=600, help="受信する情報の数")
+    parser.add_argument('--ttl', type=float, default=3, help="リースの有効期間（秒）")
+    parser.add_argument('--child')
+    parser.add_argument('--lease')
+    parser.add_argument('--output')
+    parser.add_argument('--started-at', type=float)
+    args = parser.parse_args()
+    if args.child:
+        asyncio.run(child(args.child, args.lease, args.output, args.started_at, args.rate, args.count, args.ttl))
+        return
+
+    duration = args.count / args.rate
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "lease.db")
+        output = os.path.join(directory, "deliveries.log")
+        open(output, 'w').close()
+        LeaderLease(path).open()
+        # 起動に時間がかかっても同じ時刻から受信を始める
+        started_at = time.time() + 2
+        processes = {name: spawn(name, args, path, output, started_at) for name in ("a", "b")}
+        results = []
+        try:
+            # 送信の時刻ちょうどではなく、送信と送信の間で停止する
+            time.sleep(max(0, started_at + (int(args.count / 3) + 0.5) / args.rate - time.time()))
+            holder, expires_at = wait_for_leader(path)
+            # 1回目: リーダーを強制終了し、リースの期限切れを待って引き継ぐ
+            killed = holder
+            processes[holder].send_signal(signal.SIGKILL)
+            killed_at = time.time()
+            processes[holder].wait()
+            holder, expires_at = lease_state(path)
+            new_holder, _ = wait_for_leader(path, exclude=holder)
+            results.append(("強制終了", killed_at, expires_at, new_holder))
+            # 強制終了したプロセスの代わりを待機させる
+            processes["c"] = spawn("c", args, path, output, started_at)
+
+            time.sleep(max(0, started_at + (int(args.count * 2 / 3) + 0.5) / args.rate - time.time()))
+            holder, _ = wait_for_leader(path)
+            # 2回目: リーダーを正常終了し、手放したリースをすぐに引き継ぐ
+            processes[holder].send_signal(signal.SIGTERM)
+            stopped_at = time.time()
+            new_holder, _ = wait_for_leader(path, exclude=holder)
+            results.append(("正常終了", stopped_at, None, new_holder))
+            for process in processes.values():
+                process.wait(timeout=duration + 30)
+        finally:
+            for process in processes.values():
+                if process.poll() is None:
+                    process.kill()
+
+        with open(output, 'r', encoding='utf-8') as f:
+            lines = [line.split() for line in f]
+    elected = {}
+    for entry in lines:
+        if entry[0] == 'leader':
+            elected.setdefault(entry[1], []).append(float(entry[2]))
+    deliveries = [int(entry[2]) for entry in lines if entry[0] == 'deliver']
+    duplicates = len(deliveries) - len(set(deliveries))
+    senders = {}
+    for entry in lines:
+        if entry[0] == 'deliver':
+            senders.setdefault(int(entry[2]), []).append(f"{entry[1]} {entry[3]}")
+    # 強制終了したプロセスが送信した直後、記録を書き込む前に停止した場合は引き継いだプロセスが再送する（防げない）
+    last_killed = max((int(entry[2]) for entry in lines if entry[0] == 'deliver' and entry[1] == killed), default=None)
+    in_flight = int(len(senders.get(last_killed, ())) > 1)
+    missing = args.count - len(set(deliveries))
+
+    failed = False
+    for label, stopped_at, expires_at, new_holder in results:
+        acquired_at = min(t for t in elected[new_holder] if t >= stopped_at)
+        after_expiry = f" / リースの期限切れから {(acquired_at - expires_at) * 1e3:.0f}ms" if expires_at else ""
+        print(f"{label}: {new_holder}が引き継ぎ 停止から {(acquired_at - stopped_at) * 1e3:.0f}ms{after_expiry}")
+        if expires_at and acquired_at - expires_at > 1:
+            failed = True
+    print(f"送信: {len(deliveries)}件 / 二重送信 {duplicates - in_flight}件 / 送信漏れ {missing}件 ({args.count}件中)")
+    if in_flight:
+        print(f"  強制終了の時点で記録前だった送信の再送: {last_killed}番目")
+    for index, sent in sorted(senders.items()):
+        if len(sent) > 1 and not (in_flight and index == last_killed):
+            print(f"  二重送信: {index}番目 ({', '.join(sent)})")
+    if failed or duplicates - in_flight or missing:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
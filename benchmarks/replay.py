@@ -0,0 +1,438 @@
+# WolfxとP2PQuakeのWebSocketをローカルで再現し、Discordへ送信せずにBOTの処理を計測する
+# python -m benchmarks.replay --rate 100 --count 1000
+# python -m benchmarks.replay --recorded testdata1.json --speed 10
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+REPLAY_CHANNEL_ID = 1
+MARKER = re.compile(r"#R(\d+)")
+FEEDS = ("wolfx", "p2pquake")
+MIXES = {
+    "eew": {"jma_eew": 1.0},
+    "p2pquake": {551: 0.5, 552: 0.2, 556: 0.3},
+    "all": {"jma_eew": 0.4, 551: 0.3, 552: 0.1, 556: 0.2},
+}
+
+
+class FeedServer:
+    # /wolfx と /p2pquake でWebSocketを待ち受け、接続中の全クライアントへフレームを送る
+    # /p2pquake/history はP2PQuakeの履歴APIの代わり
+    def __init__(self):
+        self.connections = {feed: set() for feed in FEEDS}
+        self.connected = {feed: asyncio.Event() for feed in FEEDS}
+        self.history = []
+        self.runner = None
+        self.port = None
+
+    async def start(self):
+        app = web.Application()
+        for feed in FEEDS:
+            app.router.add_get(f'/{feed}', self._handler(feed))
+        app.router.add_get('/p2pquake/history', self._history)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    def url(self, feed):
+        return f"ws://127.0.0.1:{self.port}/{feed}"
+
+    def history_url(self):
+        return f"http://127.0.0.1:{self.port}/p2pquake/history"
+
+    async def _history(self, request):
+        codes = {int(code) for code in request.query.getall('codes', [])}
+        limit = int(request.query.get('limit', 100))
+        frames = [data for data in reversed(self.history) if not codes or data.get('code') in codes]
+        return web.json_response(frames[:limit])
+
+    def _handler(self, feed):
+        async def handler(request):
+            ws = web.WebSocketResponse()
+            await ws.prepare(request)
+            self.connections[feed].add(ws)
+            self.connected[feed].set()
+            try:
+                async for _ in ws:
+                    pass
+            finally:
+                self.connections[feed].discard(ws)
+            return ws
+        return handler
+
+    async def broadcast(self, feed, data):
+        if feed == "p2pquake":
+            self.history.append(data)
+        text = json.dumps(data, ensure_ascii=False)
+        for ws in list(self.connections[feed]):
+            await ws.send_str(text)
+
+    async def disconnect(self, feed):
+        for ws in list(self.connections[feed]):
+            await ws.close()
+        self.connected[feed].clear()
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class FakeMessage:
+    _ids = iter(range(1, 1 << 62))
+
+    def __init__(self, sink, channel):
+        self.id = next(self._ids)
+        self.sink = sink
+        self.channel = channel
+        self.attachments = []
+
+    async def edit(self, **kwargs):
+        await self.sink.record(self.channel, "edit", kwargs)
+        return self
+
+    async def delete(self):
+        await self.sink.record(self.channel, "delete", {})
+
+
+class FakeChannel:
+    def __init__(self, sink, channel_id):
+        self.id = channel_id
+        self.sink = sink
+
+    async def send(self, content=None, **kwargs):
+        await self.sink.record(self, "send", kwargs)
+        return FakeMessage(self.sink, self)
+
+
+class FakeSink:
+    # Discordの代わりに送信時刻と内容を記録する
+    def __init__(self, send_delay=0.0):
+        self.send_delay = send_delay
+        self.channels = {}
+        self.records = []
+        self.delivered = {}
+
+    def channel(self, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = FakeChannel(self, channel_id)
+        return channel
+
+    async def record(self, channel, action, kwargs):
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        now = time.monotonic()
+        self.records.append((now, channel.id, action))
+        for marker in _markers(kwargs):
+            self.delivered.setdefault(marker, now)
+
+
+def _markers(kwargs):
+    embeds = list(kwargs.get("embeds") or ())
+    if kwargs.get("embed") is not None:
+        embeds.append(kwargs["embed"])
+    found = set()
+    for embed in embeds:
+        texts = [embed.title or "", embed.description or ""]
+        texts.extend(f"{field.name}{field.value}" for field in embed.fields)
+        for text in texts:
+            found.update(int(marker) for marker in MARKER.findall(text))
+    return found
+
+
+def tag(feed, data, marker):
+    # 送信したフレームと配信されたメッセージを対応付けるため、表示される項目に目印を付ける
+    data = copy.deepcopy(data)
+    suffix = f" #R{marker}"
+    if feed == "wolfx" and data.get("type") == "jma_eew":
+        data["Hypocenter"] = f"{data.get('Hypocenter', '')}{suffix}"
+    elif data.get("code") in (551, 556):
+        hypocenter = data.setdefault("earthquake", {}).setdefault("hypocenter", {})
+        hypocenter["name"] = f"{hypocenter.get('name', '')}{suffix}"
+        if data.get("points"):
+            data["points"][0]["addr"] += suffix
+    elif data.get("code") == 552 and data.get("areas"):
+        data["areas"][0]["name"] += suffix
+    else:
+        return data, None
+    return data, marker
+
+
+def load_recorded(path):
+    # testdata.jsonのようなWolfxのリスト、または {"feed", "t", "data"} のJSON Lines
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    try:
+        frames = json.loads(text)
+    except json.JSONDecodeError:
+        return [tuple(entry[key] for key in ("t", "feed", "data")) for entry in map(json.loads, text.splitlines()) if entry]
+    if isinstance(frames, dict):
+        frames = [frames]
+    schedule = []
+    start = None
+    for data in frames:
+        # testdata1.jsonにはtypeが含まれていない
+        data.setdefault("type", "jma_eew")
+        announced = datetime.strptime(data["AnnouncedTime"], "%Y/%m/%d %H:%M:%S")
+        start = start or announced
+        schedule.append(((announced - start).total_seconds(), "wolfx", data))
+    return schedule
+
+
+def synthetic_schedule(count, rate, mix, noise=0.0, seed=0):
+    with open('testdata.json', 'r', encoding='utf-8') as f:
+        wolfx_template = json.load(f)[0]
+    rng = random.Random(seed)
+    kinds = list(MIXES[mix])
+    weights = [MIXES[mix][kind] for kind in kinds]
+    base = datetime(2099, 1, 1)
+    schedule = []
+    for i in range(count):
+        t = i / rate
+        # 別の地震として扱われるように発生時刻を10秒ずつずらす
+        origin = base + timedelta(seconds=10 * i)
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "jma_eew":
+            schedule.append((t, "wolfx", _wolfx_frame(wolfx_template, i, origin)))
+        else:
+            schedule.append((t, "p2pquake", _p2pquake_frame(kind, i, origin)))
+        if noise and rng.random() < noise:
+            schedule.append((t, "p2pquake", {"code": rng.choice((554, 555, 561)), "id": f"noise{i}", "time": origin.strftime("%Y/%m/%d %H:%M:%S.000")}))
+            schedule.append((t, "wolfx", {"type": "heartbeat", "ver": "replay", "id": f"hb{i}", "timestamp": int(t * 1000)}))
+    return schedule
+
+
+def _wolfx_frame(template, i, origin):
+    data = copy.deepcopy(template)
+    data.update({
+        "EventID": origin.strftime("%Y%m%d%H%M%S"),
+        "Serial": 1,
+        "AnnouncedTime": (origin + timedelta(seconds=5)).strftime("%Y/%m/%d %H:%M:%S"),
+        "OriginTime": origin.strftime("%Y/%m/%d %H:%M:%S"),
+        "Hypocenter": f"合成震源{i}",
+        "isFinal": False,
+        "isCancel": False,
+    })
+    return data
+
+
+def _p2pquake_frame(code, i, origin):
+    time_str = origin.strftime("%Y/%m/%d %H:%M:%S")
+    if code == 551:
+        return {
+            "code": 551, "id": f"replay{i}", "time": f"{time_str}.000",
+            "issue": {"source": "気象庁", "time": time_str, "type": "DetailScale", "correct": "None"},
+            "earthquake": {
+                "time": time_str, "maxScale": 40, "domesticTsunami": "None", "foreignTsunami": "Unknown",
+                "hypocenter": {"name": f"合成震源{i}", "latitude": 37.5, "longitude": 137.2, "depth": 10, "magnitude": 5.0},
+            },
+            "points": [{"pref": "石川県", "addr": "輪島市", "isArea": False, "scale": 40}],
+        }
+    if code == 552:
+        return {
+            "code": 552, "id": f"replay{i}", "time": f"{time_str}.000", "cancelled": False,
+            "issue": {"source": "気象庁", "time": time_str, "type": "Focus"},
+            "areas": [{
+                "grade": "Watch", "immediate": False, "name": f"合成沿岸{i}",
+                "firstHeight": {"arrivalTime": time_str, "condition": "第１波の到達予想時刻"},
+                "maxHeight": {"description": "１ｍ", "value": 1},
+            }],
+        }
+    return {
+        "code": 556, "id": f"replay{i}", "time": f"{time_str}.000", "cancelled": False,
+        "issue": {"time": time_str, "eventId": f"R{origin.strftime('%Y%m%d%H%M%S')}", "serial": "1"},
+        "earthquake": {
+            "originTime": time_str, "arrivalTime": time_str, "condition": "",
+            "hypocenter": {"name": f"合成震源{i}", "reduceName": "石川県", "latitude": 37.5, "longitude": 137.2, "depth": 10, "magnitude": 6.0},
+        },
+        "areas": [{"pref": "石川県", "name": "石川県能登", "scaleFrom": 50, "scaleTo": 60, "kindCode": "10", "arrivalTime": time_str}],
+    }
+
+
+def load_bot(server, sink, channels=1, channel_rate=None, global_rate=None):
+    # bot.pyをDiscordに接続せずに読み込み、接続先と送信先をローカルに差し替える
+    # 前回の実行で保存された受信履歴を読み込まないように、保存先は一時ディレクトリにする
+    os.environ['EventStoreFile'] = os.path.join(tempfile.mkdtemp(), 'events.db')
+    import bot
+    from fanout import TokenBucket
+    from subscriptions import Subscription, SubscriptionRegistry
+
+    async def change_presence(**kwargs):
+        pass
+
+    async def wait_until_ready():
+        pass
+
+    bot.client.get_channel = sink.channel
+    bot.client.change_presence = change_presence
+    bot.client.wait_until_ready = wait_until_ready
+    bot.WOLFX_WS_URL = server.url("wolfx")
+    bot.P2PQUAKE_WS_URL = server.url("p2pquake")
+    bot.p2pquake_feed.backfill.url = server.history_url()
+    bot.subscriptions = SubscriptionRegistry(
+        os.path.join(tempfile.mkdtemp(), 'subscriptions.json'),
+        default=Subscription(REPLAY_CHANNEL_ID)
+    )
+    for channel_id in range(REPLAY_CHANNEL_ID + 1, REPLAY_CHANNEL_ID + channels):
+        bot.subscriptions.add(Subscription(channel_id))
+    if channel_rate is not None:
+        # 0の場合はチャンネルごとのレート制限を無効にする
+        bot.fanout.channel_rate = channel_rate or float('inf')
+        bot.fanout.channel_burst = 5 if channel_rate else float('inf')
+    if global_rate is not None:
+        bot.fanout.global_bucket = TokenBucket(global_rate or float('inf'), global_rate or float('inf'))
+    return bot
+
+
+async def drop_connections(server, interval):
+    # 一定間隔でサーバー側から接続を切り、再接続と履歴からの取得を確認する
+    while True:
+        await asyncio.sleep(interval)
+        for feed in FEEDS:
+            await server.disconnect(feed)
+
+
+async def replay(schedule, speed=1.0, send_delay=0.0, channels=1, channel_rate=None, global_rate=None, drop_every=None, settle=5.0, timeout=600.0):
+    server = await FeedServer().start()
+    sink = FakeSink(send_delay)
+    bot = load_bot(server, sink, channels, channel_rate, global_rate)
+    bot.dispatcher.start()
+    bot.presence.start()
+    tasks = [asyncio.create_task(bot.fetch_wolfx()), asyncio.create_task(bot.fetch_p2pquake()), asyncio.create_task(bot.event_store.run())]
+    await asyncio.gather(*(server.connected[feed].wait() for feed in FEEDS))
+
+    if drop_every:
+        tasks.append(asyncio.create_task(drop_connections(server, drop_every)))
+
+    sent_at = {}
+    started_at = time.monotonic()
+    for marker, (t, feed, data) in enumerate(sorted(schedule, key=lambda entry: entry[0])):
+        delay = started_at + t / speed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        data, marker = tag(feed, data, marker)
+        if marker is not None:
+            sent_at[marker] = time.monotonic()
+        await server.broadcast(feed, data)
+    finished_sending = time.monotonic()
+
+    # 送信した全てのフレームが配信されるか、一定時間配信が止まるまで待つ
+    deadline = finished_sending + timeout
+    last_count = -1
+    last_change = time.monotonic()
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+        if len(sink.delivered) != last_count:
+            last_count = len(sink.delivered)
+            last_change = time.monotonic()
+        if set(sent_at) <= set(sink.delivered) and bot.dispatcher.queue.empty():
+            break
+        if time.monotonic() - last_change > settle and bot.dispatcher.queue.empty():
+            break
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await bot.dispatcher.stop()
+    await bot.presence.stop()
+    await server.stop()
+    # 描画中の震度分布図の追加を待つ
+    await asyncio.gather(*bot.map_tasks, return_exceptions=True)
+    bot.map_renderer.stop()
+    feeds = {feed.name: feed.stats() for feed in (bot.wolfx_feed, bot.p2pquake_feed)}
+    result = report(schedule, sent_at, sink, started_at, bot.dispatcher.stats(), feeds)
+    result["maps"] = bot.map_renderer.stats() if bot.settings.quake_map else None
+    return result
+
+
+def report(schedule, sent_at, sink, started_at, dispatch_stats, feeds):
+    latencies = sorted(sink.delivered[marker] - sent_at[marker] for marker in sent_at if marker in sink.delivered)
+    last_delivery = max(sink.delivered.values(), default=started_at)
+    elapsed = max(last_delivery - started_at, 1e-9)
+    return {
+        "frames": len(schedule),
+        "tracked": len(sent_at),
+        "delivered": len(latencies),
+        "messages": len(sink.records),
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50": latencies[len(latencies) // 2] if latencies else None,
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else None,
+        "mean": statistics.mean(latencies) if latencies else None,
+        "dropped": dispatch_stats["dropped"],
+        "feeds": {
+            name: {key: stats[key] for key in ("reconnects", "max_gap", "duplicates", "backfilled")}
+            for name, stats in feeds.items()
+        },
+    }
+
+
+def print_report(result):
+    def ms(value):
+        return f"{value * 1000:.1f}ms" if value is not None else "N/A"
+
+    print(f"フレーム: {result['frames']}件 (計測対象: {result['tracked']}件, 配信: {result['delivered']}件, 破棄: {result['dropped']}件)")
+    print(f"送信メッセージ: {result['messages']}件 / {result['elapsed']:.2f}秒")
+    print(f"スループット: {result['throughput']:.1f}件/秒")
+    print(f"受信→送信の遅延: p50 {ms(result['p50'])} / p99 {ms(result['p99'])} / 平均 {ms(result['mean'])}")
+    if result.get('maps'):
+        maps = result['maps']
+        print(f"震度分布図: 描画 {maps['rendered']}件 / 省略 {maps['dropped']}件 / 新しい報で破棄 {maps['superseded']}件 / 時間切れ {maps['timeouts']}件")
+    for name, stats in result['feeds'].items():
+        print(f"{name}: 再接続 {stats['reconnects']}回 / 最大切断時間 {ms(stats['max_gap'])} / 重複 {stats['duplicates']}件 / 履歴から取得 {stats['backfilled']}件")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WolfxとP2PQuakeのフレームをローカルで再生してBOTの処理を計測します")
+    parser.add_argument('--recorded', help="再生する記録（testdata.json形式、または feed/t/data のJSON Lines）")
+    parser.add_argument('--speed', type=float, default=1.0, help="記録の再生速度の倍率")
+    parser.add_argument('--rate', type=float, default=100.0, help="合成フレームの送信レート（件/秒）")
+    parser.add_argument('--count', type=int, default=1000, help="合成フレームの件数")
+    parser.add_argument('--mix', choices=MIXES, default="eew", help="合成フレームの種類")
+    parser.add_argument('--noise', type=float, default=0.0, help="配信されないフレーム（554/555/561、ハートビート）を混ぜる割合")
+    parser.add_argument('--send-delay', type=float, default=0.0, help="Discordへの送信1回あたりの疑似遅延（秒）")
+    parser.add_argument('--channels', type=int, default=1, help="配信先のチャンネル数")
+    parser.add_argument('--channel-rate', type=float, help="チャンネルごとの送信レート（件/秒、0で無制限）")
+    parser.add_argument('--global-rate', type=float, help="全体の送信レート（件/秒、0で無制限）")
+    parser.add_argument('--drop-every', type=float, help="指定した秒数ごとにサーバー側から接続を切る")
+    parser.add_argument('--edit', action='store_true', help="EEWEditMessageを有効にする")
+    parser.add_argument('--map', action='store_true', help="QuakeMapを有効にする（震度分布図を描画して編集で追加する）")
+    parser.add_argument('--json', action='store_true', help="結果をJSONで出力する")
+    parser.add_argument('--log-level', default="INFO", help="BOTのログレベル（LogLevel）")
+    args = parser.parse_args()
+
+    os.environ['LogLevel'] = args.log_level
+
+    if args.edit:
+        os.environ['EEWEditMessage'] = 'True'
+    if args.map:
+        os.environ['QuakeMap'] = 'True'
+    if args.recorded:
+        schedule = load_recorded(args.recorded)
+    else:
+        schedule = synthetic_schedule(args.count, args.rate, args.mix, args.noise)
+
+    result = asyncio.run(replay(
+        schedule, speed=args.speed, send_delay=args.send_delay, channels=args.channels,
+        channel_rate=args.channel_rate, global_rate=args.global_rate, drop_every=args.drop_every
+    ))
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print_report(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+# 長時間の稼働試験: 数日分の受信（551/552/556/jma_eew、ハートビートなど）を圧縮してローカルのWebSocketから再生し、
+# メモリ（RSS・tracemalloc）、タスク数、処理遅延のp99と、重複の判定などに使う状態の件数が増え続けないかを1日ごとに確認する
+# python -m benchmarks.soak --days 7 --speed 7200
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import psutil
+
+from benchmarks.replay import FakeSink, FeedServer, _p2pquake_frame, _wolfx_frame, load_bot
+
+DAY = 24 * 60 * 60
+INTENSITIES = ("1", "2", "3", "4", "5弱", "5強")
+TSUNAMI_GRADES = ("Watch", "Warning", "MajorWarning")
+
+
+class CountingSink(FakeSink):
+    # 長時間の試験で記録が溜まらないように、送信・編集の件数だけを数える
+    def __init__(self, send_delay=0.0):
+        super().__init__(send_delay)
+        self.counts = {"send": 0, "edit": 0}
+
+    async def record(self, channel, action, kwargs):
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        self.counts[action] += 1
+
+
+def soak_schedule(days, quakes_per_day, tsunamis_per_day, seed=0):
+    # 1日ごとに地震（緊急地震速報の続報・震度速報・震源・震度の情報）と津波情報の続報を発生させる
+    with open('testdata.json', 'r', encoding='utf-8') as f:
+        template = json.load(f)[0]
+    rng = random.Random(seed)
+    base = datetime(2099, 1, 1)
+    schedule = []
+    # Wolfxのハートビート（60秒ごと）とP2PQuakeの配信しない情報（10分ごと）
+    for t in range(0, days * DAY, 60):
+        schedule.append((t, "wolfx", {"type": "heartbeat", "ver": "soak", "id": f"hb{t}", "timestamp": t * 1000}))
+    for t in range(0, days * DAY, 600):
+        schedule.append((t, "p2pquake", {"code": 555, "id": f"peer{t}", "time": (base + timedelta(seconds=t)).strftime("%Y/%m/%d %H:%M:%S.000")}))
+
+    index = 0
+    for day in range(days):
+        for _ in range(quakes_per_day):
+            start = day * DAY + rng.uniform(0, DAY - 600)
+            origin = base + timedelta(seconds=int(start))
+            warn = rng.random() < 0.15
+            magnitude = rng.uniform(3.0, 5.5)
+            serials = rng.randint(1, 8)
+            t = start
+            for serial in range(1, serials + 1):
+                t += rng.uniform(1, 5)
+                magnitude += rng.uniform(0, 0.2)
+                data = _wolfx_frame(template, index, origin)
+                data.update({
+                    "EventID": f"{origin:%Y%m%d%H%M%S}{index % 10}", "Serial": serial, "isFinal": serial == serials, "isWarn": warn,
+                    "Magunitude": round(magnitude, 1), "MaxIntensity": rng.choice(INTENSITIES),
+                })
+                schedule.append((t, "wolfx", data))
+            index += 1
+            if warn:
+                schedule.append((start + 5, "p2pquake", _p2pquake_frame(556, index, origin)))
+                index += 1
+            for delay, issue_type in ((90, "ScalePrompt"), (180, "Destination"), (300, "DetailScale")):
+                data = _p2pquake_frame(551, index, origin)
+                data["issue"]["type"] = issue_type
+                data["points"] = [{"pref": "石川県", "addr": f"観測点{n}", "isArea": False, "scale": rng.choice((10, 20, 30, 40))} for n in range(rng.randint(1, 30))]
+                schedule.append((start + delay, "p2pquake", data))
+                index += 1
+        for _ in range(tsunamis_per_day):
+            # 30分ごとに一部の沿岸の予報が変わり、4時間後に解除される
+            start = day * DAY + rng.uniform(0, DAY - 5 * 60 * 60)
+            grades = {f"沿岸{n}": rng.choice(TSUNAMI_GRADES) for n in range(rng.randint(5, 40))}
+            for bulletin in range(9):
+                t = start + bulletin * 30 * 60
+                issued = base + timedelta(seconds=int(t))
+                if bulletin:
+                    for name in rng.sample(sorted(grades), min(3, len(grades))):
+                        grades[name] = rng.choice(TSUNAMI_GRADES)
+                data = _p2pquake_frame(552, index, issued)
+                data["cancelled"] = bulletin == 8
+                data["areas"] = [] if bulletin == 8 else [
+                    {**data["areas"][0], "name": name, "grade": grade} for name, grade in grades.items()
+                ]
+                schedule.append((t, "p2pquake", data))
+                index += 1
+    schedule.sort(key=lambda entry: entry[0])
+    return schedule
+
+
+def state_caps(bot):
+    # 件数に上限がある状態（上限以内であれば増えていても問題ない）
+    return {
+        "feed_recent": bot.wolfx_feed.recent_size + bot.p2pquake_feed.recent_size,
+    }
+
+
+def state_sizes(bot):
+    # 受信を続けると増える可能性のある状態の件数
+    return {
+        "eew_tracker": len(bot.eew_tracker.events),
+        "eew_clusters": len(bot.eew_correlator.clusters),
+        "eew_messages": len(bot.eew_updater.entries),
+        "tsunami_messages": len(bot.tsunami_updater.entries),
+        "feed_recent": len(bot.wolfx_feed.recent) + len(bot.p2pquake_feed.recent),
+        "dispatch_locks": len(bot.dispatcher._locks),
+        "map_tasks": len(bot.map_tasks),
+        "test_events": len(bot.test_events),
+    }
+
+
+class Sampler:
+    # 一定間隔でRSS・tracemallocの使用量・タスク数と、前回からの処理遅延を記録する
+    def __init__(self, bot, interval):
+        self.bot = bot
+        self.interval = interval
+        self.process = psutil.Process()
+        self.samples = []
+        self.day = 0
+        self._processed = 0
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.sample()
+
+    def sample(self):
+        dispatcher = self.bot.dispatcher
+        new = dispatcher.processed - self._processed
+        self._processed = dispatcher.processed
+        latencies = list(dispatcher.latencies)[-new:] if new else []
+        self.samples.append({
+            "day": self.day,
+            "rss": self.process.memory_info().rss,
+            "traced": tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+            "tasks": len(asyncio.all_tasks()),
+            "latencies": latencies,
+        })
+
+
+def summarize(samples, day):
+    entries = [sample for sample in samples if sample["day"] == day]
+    latencies = sorted(latency for sample in entries for latency in sample["latencies"])
+    traced = [sample["traced"] for sample in entries if sample["traced"] is not None]
+    return {
+        "rss": max(sample["rss"] for sample in entries),
+        "traced": traced[-1] if traced else None,
+        "tasks_min": min(sample["tasks"] for sample in entries),
+        # 再接続の間は一時的に減るため、増加の判定には中央値を使う
+        "tasks": statistics.median_low(sample["tasks"] for sample in entries),
+        "tasks_max": max(sample["tasks"] for sample in entries),
+        "handled": len(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else None,
+    }
+
+
+async def soak(schedule, days, speed, drop_every, sample_interval, trace):
+    server = await FeedServer().start()
+    sink = CountingSink()
+    # Discordのレート制限は再現せず、BOTの内部の処理だけを計測する
+    bot = load_bot(server, sink, channel_rate=0, global_rate=0)
+    # 期限切れで消える状態は再生中の時刻で判定し、圧縮した1日の間にも実際の1日分の期限切れが起きるようにする
+    clock_base = time.monotonic()
+
+    def clock():
+        return clock_base + (time.monotonic() - clock_base) * speed
+
+    for cache in (bot.eew_tracker, bot.eew_correlator, bot.eew_updater, bot.tsunami_updater, bot.tsunami_tracker):
+        cache.clock = clock
+    # setup_hookと同じく常駐するタスクを起動する（ネットワークを使う速度の計測・コマンドの同期は除く）
+    bot.dispatcher.start()
+    bot.presence.start()
+    for name, factory in (
+        ('fetch_p2pquake', bot.fetch_p2pquake),
+        ('fetch_wolfx', bot.fetch_wolfx),
+        ('change_bot_presence', lambda: bot.change_bot_presence(bot.client)),
+        ('watch_settings', bot.watch_settings),
+        ('event_store', bot.event_store.run),
+    ):
+        bot.supervisor.start(name, factory)
+    await asyncio.gather(*(event.wait() for event in server.connected.values()))
+
+    if trace:
+        tracemalloc.start()
+    sampler = Sampler(bot, sample_interval)
+    sampler_task = asyncio.create_task(sampler.run())
+    snapshots = {}
+    started_at = time.monotonic()
+    last_drop = started_at
+    for t, feed, data in schedule:
+        day = int(t // DAY)
+        if day != sampler.day:
+            # 1日の区切りで状態を記録する
+            sampler.sample()
+            if trace and sampler.day == 0:
+                snapshots["warmup"] = tracemalloc.take_snapshot()
+            sampler.samples[-1]["state"] = state_sizes(bot)
+            sampler.day = day
+        delay = started_at + t / speed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if drop_every and time.monotonic() - last_drop > drop_every:
+            # 再接続のループと履歴からの取得も繰り返し動かす
+            last_drop = time.monotonic()
+            for name in server.connections:
+                await server.disconnect(name)
+            del server.history[:-100]
+        await server.broadcast(feed, data)
+
+    # 配信キューが空になるまで待ってから最後の状態を記録する
+    while not bot.dispatcher.queue.empty():
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(1)
+    gc.collect()
+    sampler.sample()
+    sampler.samples[-1]["state"] = state_sizes(bot)
+    sampler.samples[-1]["caps"] = state_caps(bot)
+    if trace:
+        snapshots["end"] = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+    sampler_task.cancel()
+    await bot.supervisor.stop()
+    await bot.dispatcher.stop()
+    await bot.presence.stop()
+    await server.stop()
+    return sampler.samples, snapshots, sink.counts, time.monotonic() - started_at
+
+
+def top_allocators(snapshots, limit):
+    if "warmup" not in snapshots:
+        return []
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+    end = snapshots["end"].filter_traces(filters)
+    warmup = snapshots["warmup"].filter_traces(filters)
+    return [
+        (str(stat.traceback[0]), stat.size_diff, stat.count_diff)
+        for stat in end.compare_to(warmup, 'lineno')[:limit]
+    ]
+
+
+def day_state(samples, day):
+    return next((sample["state"] for sample in reversed(samples) if sample["day"] == day and "state" in sample), {})
+
+
+def check(days, samples, args, baseline):
+    # 1日目は接続やキャッシュの作成が含まれるため、2日目と最終日を比べる
+    first, last = days[1], days[-1]
+    mb = 1024 * 1024
+    results = [
+        ("RSSの増加", (last["rss"] - first["rss"]) / mb, args.max_rss_growth, "MB"),
+        ("タスク数の増加", last["tasks"] - first["tasks"], args.max_task_growth, "件"),
+        ("最終日の処理遅延p99", (last["p99"] or 0) * 1000, args.max_p99, "ms"),
+        ("処理遅延p99の悪化", ((last["p99"] or 0) - (first["p99"] or 0)) * 1000, args.max_p99_growth, "ms"),
+    ]
+    if first["traced"] is not None:
+        results.append(("tracemallocの増加", (last["traced"] - first["traced"]) / mb, args.max_traced_growth, "MB"))
+    # 期限切れで消える状態は1日の終わりの件数が増え続けず、上限のある状態は上限を超えない
+    first_state, last_state = day_state(samples, 1), day_state(samples, len(days) - 1)
+    caps = next(sample["caps"] for sample in reversed(samples) if "caps" in sample)
+    for name, size in last_state.items():
+        if name in caps:
+            results.append((f"{name}の件数", size, caps[name], "件"))
+        else:
+            results.append((f"{name}の増加", size - first_state.get(name, 0), args.max_state_growth, "件"))
+    if baseline:
+        # 前回の結果より許容範囲を超えて悪化した場合も失敗にする
+        for label, value, _, unit in list(results):
+            if label in baseline:
+                results.append((f"{label}（前回比）", value, baseline[label] * (1 + args.tolerance) + args.slack.get(unit, 0), unit))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数日分の受信を圧縮して再生し、メモリ・タスク数・処理遅延が増え続けないかを確認します")
+    parser.add_argument('--days', type=int, default=7, help="再生する日数（3以上）")
+    parser.add_argument('--speed', type=float, default=7200, help="再生速度の倍率（7200で1日を12秒）")
+    parser.add_argument('--quakes-per-day', type=int, default=30)
+    parser.add_argument('--tsunamis-per-day', type=int, default=1)
+    parser.add_argument('--drop-every', type=float, default=10.0, help="指定した秒数ごとにサーバー側から接続を切る（0で切らない）")
+    parser.add_argument('--sample-interval', type=float, default=0.25)
+    parser.add_argument('--no-tracemalloc', action='store_true', help="tracemallocを使わない（処理遅延への影響をなくす）")
+    parser.add_argument('--top', type=int, default=10, help="表示するメモリ確保の多い行の数")
+    parser.add_argument('--max-rss-growth', type=float, default=16.0, help="2日目から最終日までのRSSの増加の上限（MB）")
+    parser.add_argument('--max-traced-growth', type=float, default=4.0, help="2日目から最終日までのtracemallocの増加の上限（MB）")
+    parser.add_argument('--max-task-growth', type=int, default=2, help="2日目から最終日までのタスク数（中央値）の増加の上限")
+    parser.add_argument('--max-p99', type=float, default=250.0, help="最終日の処理遅延p99の上限（ms）")
+    parser.add_argument('--max-state-growth', type=int, default=10, help="2日目から最終日までの状態（重複の判定など）の件数の増加の上限")
+    parser.add_argument('--max-p99-growth', type=float, default=50.0, help="2日目から最終日までの処理遅延p99の悪化の上限（ms）")
+    parser.add_argument('--baseline', help="前回の結果（--saveで保存したJSON）と比較する")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="前回の結果からの悪化の許容割合")
+    parser.add_argument('--save', help="結果をJSONで保存する")
+    parser.add_argument('--log-level', default="WARNING", help="BOTのログレベル（LogLevel）")
+    args = parser.parse_args()
+    if args.days < 3:
+        parser.error("--daysは3以上で指定してください")
+    # 前回比で値が小さい場合に、わずかな揺れで失敗しないようにする
+    args.slack = {"MB": 2.0, "件": 1, "ms": 10.0}
+
+    os.environ['LogLevel'] = args.log_level
+    os.environ['SpeedtestInterval'] = '0'
+    schedule = soak_schedule(args.days, args.quakes_per_day, args.tsunamis_per_day)
+    print(f"{args.days}日分 {len(schedule)}件を{args.speed:g}倍速で再生します（1日あたり{DAY / args.speed:.1f}秒）")
+    samples, snapshots, counts, elapsed = asyncio.run(soak(
+        schedule, args.days, args.speed, args.drop_every, args.sample_interval, not args.no_tracemalloc
+    ))
+
+    days = [summarize(samples, day) for day in range(args.days)]
+    mb = 1024 * 1024
+    for day, summary in enumerate(days):
+        state = day_state(samples, day)
+        traced = f"{summary['traced'] / mb:.1f}MB" if summary['traced'] is not None else "N/A"
+        p99 = f"{summary['p99'] * 1000:.1f}ms" if summary['p99'] is not None else "N/A"
+        print(f"{day + 1}日目: RSS {summary['rss'] / mb:.1f}MB / tracemalloc {traced} / タスク {summary['tasks_min']}〜{summary['tasks_max']}件（中央値 {summary['tasks']}件） / "
+              f"処理 {summary['handled']}件 p99 {p99}")
+        print(f"  状態: {', '.join(f'{name}={size}' for name, size in state.items())}")
+    print(f"送信: {counts['send']}件 / 編集: {counts['edit']}件 / {elapsed:.1f}秒")
+
+    allocators = top_allocators(snapshots, args.top)
+    if allocators:
+        print("2日目の開始から増えたメモリ確保（行ごと）:")
+        for location, size, count in allocators:
+            print(f"  {size / 1024:+10.1f}KiB {count:+7d}件 {location}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    results = check(days, samples, args, baseline)
+    failed = False
+    for label, value, limit, unit in results:
+        ok = value <= limit
+        failed |= not ok
+        print(f"{'OK' if ok else 'NG'} {label}: {value:.1f}{unit}（上限 {limit:.1f}{unit}）")
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({label: value for label, value, _, _ in results if "前回比" not in label}, f, ensure_ascii=False, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
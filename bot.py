@@ -1,43 +1,159 @@
 import discord
 from discord import app_commands
-from dotenv import load_dotenv
-from datetime import datetime
-import speedtest
-import aiohttp
+from datetime import datetime, timedelta
 import asyncio
 import random
 import psutil
 import json
 import os
-import traceback
-
-load_dotenv()
+import logging
+import functools
+import io
+import math
+import time
+from dispatch import Dispatcher, current_item, PRIORITY_EEW, PRIORITY_TSUNAMI, PRIORITY_INFO
+from eew_state import EEWTracker, EEWCorrelator
+from eew_updater import EEWMessageUpdater
+from tsunami_state import TsunamiTracker, GRADE_COLORS, GRADE_LABELS, grade_rank
+from subscriptions import Subscription, SubscriptionRegistry, FORECAST_WARNING_CHOICES
+import intensity
+import layout
+from fanout import FanOut
+from webhook import WebhookDelivery
+from assets import AssetCache
+from estimate import AreaEstimator
+from quake_map import MapRenderer, AreaLocator, MAP_FILENAME
+from connection import FeedConnection, P2PQuakeBackfill, p2pquake_identity, wolfx_identity
+from decode import p2pquake_decoder, wolfx_decoder
+from presence import PresenceManager, PRESENCE_ALERT, PRESENCE_EEW_FINAL
+from lifecycle import TaskSupervisor, sync_commands
+from settings import load_settings, SettingsError, RESTART_REQUIRED
+from event_store import EventStore
+from leader import LeaderLease, StandbyBuffer
+from events import normalize_p2pquake, normalize_wolfx, KIND_EEW, KIND_QUAKE, KIND_TSUNAMI, KIND_P2P_EEW
+import metrics
+from probe import NetworkProber
+import log
+
+STARTED_AT = time.monotonic()
+
+settings = load_settings()
+# 震度分布図の描画用のプロセスはforkで作るため、ログのスレッドやデータベースの接続を作る前に起動する
+map_renderer = MapRenderer(workers=settings.map_workers)
+if settings.quake_map:
+    map_renderer.start()
+log.setup(settings.log_level, settings.log_format)
+logger = logging.getLogger('bot')
 
 intents = discord.Intents.default()
 intents.message_content = True
 client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
 
-channel_id = int(os.getenv('ChannelID'))
 VER = "beta 0.1.5"
 
-status_p2pquake = "接続していません"
-status_wolfx = "接続していません"
-
 WOLFX_WS_URL = 'wss://ws-api.wolfx.jp/jma_eew'
 P2PQUAKE_WS_URL = 'https://api.p2pquake.net/v2/ws'
+P2PQUAKE_HISTORY_URL = 'https://api.p2pquake.net/v2/history'
+
+supervisor = TaskSupervisor()
+dispatcher = Dispatcher(
+    workers=settings.dispatch_workers,
+    maxsize=settings.dispatch_queue_size
+)
+eew_tracker = EEWTracker()
+eew_correlator = EEWCorrelator()
+eew_updater = EEWMessageUpdater()
+tsunami_tracker = TsunamiTracker()
+# 津波情報のまとめも一連の情報ごとに1つのメッセージを編集する
+tsunami_updater = EEWMessageUpdater(ttl=tsunami_tracker.idle_ttl, label="津波情報")
+fanout = FanOut()
+webhooks = WebhookDelivery()
+event_store = EventStore(settings.event_store_file, retention_days=settings.event_store_retention_days).open()
+prober = NetworkProber(interval=settings.speedtest_interval * 60)
+asset_cache = AssetCache(path=settings.asset_cache_file)
+asset_cache.load()
+area_estimator = AreaEstimator()
+# 埋め込みに表示する推定震度の地域数
+EEW_ESTIMATE_LIMIT = 20
+area_locator = AreaLocator()
+
+def default_subscription(settings):
+    if settings.channel_id is None:
+        return None
+    return Subscription(settings.channel_id, forecast_warning=settings.forecast_warning, webhook_url=settings.webhook_url)
+
+subscriptions = SubscriptionRegistry(settings.subscription_file, default=default_subscription(settings))
+
+def reload_settings():
+    # 新しい設定を検証してから丸ごと差し替える（WebSocketの接続は維持する）
+    global settings
+    new_settings = load_settings()
+    changed = settings.changes(new_settings)
+    settings = new_settings
+    subscriptions.set_default(default_subscription(settings))
+    log.set_level(settings.log_level)
+    restart_required = [name for name in changed if name in RESTART_REQUIRED]
+    if changed:
+        logger.info("設定を再読み込みしました: %s", ', '.join(changed))
+    if restart_required:
+        logger.warning("次の設定は再起動するまで反映されません: %s", ', '.join(restart_required))
+    return changed, restart_required
+
+async def watch_settings(path='.env', interval=5):
+    # .envが更新されたら自動で再読み込みする
+    last_mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    while True:
+        await asyncio.sleep(interval)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if mtime == last_mtime:
+            continue
+        last_mtime = mtime
+        try:
+            reload_settings()
+        except SettingsError as e:
+            logger.error("設定の再読み込みに失敗しました: %s", e)
+
+async def apply_presence(text):
+    await client.wait_until_ready()
+    await client.change_presence(status=discord.Status.online, activity=discord.CustomActivity(name=text))
+
+presence = PresenceManager(apply_presence)
+# 地震情報などをステータスに表示しておく秒数
+PRESENCE_TTL = 20
 
 with open('testdata.json', 'r', encoding='utf-8') as f:
-    test_data_list = json.load(f)
+    test_events = [normalize_wolfx(data) for data in json.load(f)]
+
+@client.event
+async def setup_hook():
+    # ゲートウェイへの接続を待たずにフィードへの接続を始める（届いた情報は配信キューで待機する）
+    dispatcher.start()
+    presence.request("CPU, RAM, Ping計測中")
+    presence.start()
+    supervisor.start('fetch_p2pquake', fetch_p2pquake)
+    supervisor.start('fetch_wolfx', fetch_wolfx)
+    supervisor.start('change_bot_presence', functools.partial(change_bot_presence, client))
+    supervisor.start('watch_settings', watch_settings)
+    supervisor.start('event_store', event_store.run)
+    if leader_lease is not None:
+        supervisor.start('leader_lease', leader_lease.run)
+    if settings.speedtest_interval:
+        supervisor.start('speedtest', prober.run)
+    if settings.metrics_port:
+        supervisor.start('metrics', metrics.MetricsServer(collect_metrics, settings.metrics_host, settings.metrics_port).run)
+    if settings.thumbnail_mode == 'URL':
+        supervisor.start('refresh_assets', refresh_assets)
+    supervisor.start(
+        'sync_commands',
+        functools.partial(sync_commands, tree, client.application_id, settings.command_sync_file),
+        restart=False
+    )
 
 @client.event
 async def on_ready():
-    print("Bot起動完了")
-    await tree.sync()
-    await client.change_presence(status=discord.Status.online, activity=discord.CustomActivity(name=f"CPU, RAM, Ping計測中"))
-    client.fetch_p2pquake_task = asyncio.create_task(fetch_p2pquake())
-    client.fetch_wolfx_task = asyncio.create_task(fetch_wolfx())
-    client.change_bot_presence_task = asyncio.create_task(change_bot_presence(client))
+    # 再接続のたびに呼ばれるため、ここではタスクを起動しない
+    logger.info("Bot起動完了 (起動から%.2f秒)", time.monotonic() - STARTED_AT)
 
 async def change_bot_presence(client):
     while True:
@@ -47,218 +163,376 @@ async def change_bot_presence(client):
             memory_usage = memory_info.percent
 
             latency = client.latency * 1000
-            ping = round(latency) if latency != float('inf') else "N/A"
+            # ゲートウェイに接続する前はnanになる
+            ping = round(latency) if math.isfinite(latency) else "N/A"
 
             status_message = f"CPU: {cpu_usage}% | RAM: {memory_usage}% | Ping: {ping}ms"
-            await client.change_presence(status=discord.Status.online, activity=discord.CustomActivity(name=status_message))
-            await asyncio.sleep(10)
-        except (discord.ConnectionClosed, ConnectionResetError) as e:
-            print(f"ステータス更新中に接続エラーが発生しました: {e}")
-            await asyncio.sleep(5)
+            presence.request(status_message)
         except Exception as e:
-            print(f"予期しないエラーが発生しました: {e}")
-            traceback.print_exc()
-
-async def run_speedtest():
+            logger.exception("予期しないエラーが発生しました: %s", e)
+        # エラーが続いても同じ間隔で実行する
+        await asyncio.sleep(10)
+
+async def refresh_assets():
+    asset_channel_id = settings.asset_channel_id
+    if asset_channel_id is None:
+        logger.warning("AssetChannelIDが指定されていないため、震度画像は添付して送信します。")
+        return
+    await client.wait_until_ready()
+    channel = client.get_channel(asset_channel_id)
+    if channel is None:
+        logger.warning("震度画像のアップロード先のチャンネル%sが見つかりません。", asset_channel_id)
+        return
+    # 冗長化している場合は、リーダーだけがアップロードする（待機中は添付して送信する）
+    while leader_lease is not None and not leader_lease.is_leader:
+        await asyncio.sleep(1)
     try:
-        st = await asyncio.to_thread(speedtest.Speedtest)
-        await asyncio.to_thread(st.get_best_server)
-        download_speed = await asyncio.to_thread(lambda: int(st.download() / 10**6))
-        upload_speed = await asyncio.to_thread(lambda: int(st.upload() / 10**6))
-        server_info = st.results.server['name']
+        if await asset_cache.prepare(channel):
+            logger.info("アップロード済みの震度画像を使います。(%d件)", len(asset_cache.urls))
+        else:
+            logger.info("震度画像をアップロードしました。(%d件)", len(asset_cache.urls))
     except Exception as e:
-        download_speed = "N/A"
-        upload_speed = "N/A"
-        server_info = "N/A"
-        print(f"スピードテストに失敗しました: {e}")
-    
-    return server_info, download_speed, upload_speed
+        logger.exception("震度画像のアップロードに失敗しました: %s", e)
+    # 添付ファイルのURLには有効期限があるため定期的に取り直す
+    while True:
+        await asyncio.sleep(6 * 60 * 60)
+        if leader_lease is None or leader_lease.is_leader:
+            await asset_cache.refresh(channel)
+
+# 受信したデータは配信キューに積むだけにして、送信はワーカーに任せる
+def process_p2pquake_message(data):
+    # フレームはここで1回だけ正規化し、重複の判定・絞り込み・保存・表示は全て正規化したイベントで行う
+    event = normalize_p2pquake(data)
+    if event is None:
+        return
+    event_store.record(event)
+    if event.kind == KIND_QUAKE:
+        submit(PRIORITY_INFO, process_p2pquake_info, event)
+    elif event.kind == KIND_TSUNAMI:
+        submit(PRIORITY_TSUNAMI, process_p2pquake_tsunami, event, key='p2pquake_tsunami')
+    elif event.kind == KIND_P2P_EEW:
+        if not eew_correlator.accept_event(event):
+            return
+        submit(PRIORITY_EEW, process_p2pquake_eew, event, key='p2pquake_eew')
+
+def process_wolfx_message(data):
+    # 正規化・保存の前に、生のisWarnで配信先が受け取らない種類の報を捨てる
+    if not eew_filter(data.get('isWarn', False)):
+        return
+    event = normalize_wolfx(data)
+    if event is None:
+        return
+    event_store.record(event)
+    if not eew_tracker.accept_event(event):
+        return
+    if not eew_correlator.accept_event(event):
+        return
+    submit(PRIORITY_EEW, process_eew_data, event, key='wolfx_eew')
+
+# 冗長化: 同じマシンで複数のインスタンスを動かし、リースを持つリーダーだけが配信する
+# 待機中のインスタンスも接続・重複の判定は続け、配信する代わりに引き継ぎに備えて保持する
+standby = StandbyBuffer(window=settings.leader_lease_ttl + 10)
+# 津波情報は続報の間隔が長いため、最新の報は保持時間に関係なく残して引き継ぎ時に前回の報として使う
+standby_tsunami = None
+
+def delivery_key(event):
+    return f"{event.source}:{event.frame_id}" if event.frame_id else None
+
+def submit(priority, handler, event, key=None):
+    if leader_lease is None or leader_lease.is_leader:
+        dispatcher.submit(priority, handler, event, key=key)
+    else:
+        hold(priority, handler, event, key)
+
+def hold(priority, handler, event, key=None, received_at=None):
+    global standby_tsunami
+    if event.kind == KIND_TSUNAMI:
+        # キューから戻した報より新しい報を既に保持している場合は残す
+        if standby_tsunami is None or standby_tsunami.issue_time is None or event.issue_time is None or event.issue_time >= standby_tsunami.issue_time:
+            standby_tsunami = event
+    else:
+        standby.add(delivery_key(event), (priority, handler, event, key), now=received_at)
+
+def leader_gate(priority, handler, event, key, received_at):
+    # キューに積んだ後にリーダーでなくなった場合は送信せず、待機中に受信した情報と同じく保持する
+    if leader_lease.is_leader:
+        return True
+    hold(priority, handler, event, key, received_at)
+    return False
+
+def mark_delivered(event):
+    # 送信・編集が成功した情報を配信済みとして記録し、引き継いだインスタンスが再送しないようにする
+    if leader_lease is not None and event is not None:
+        leader_lease.mark(delivery_key(event))
+
+async def take_over(leader):
+    # リーダーを引き継いだら、待機中に受信した情報のうち前のリーダーが配信していないものを配信する
+    global standby_tsunami
+    if not leader:
+        return
+    entries = standby.drain()
+    tsunami, standby_tsunami = standby_tsunami, None
+    keys = [key for _, key, _ in entries if key is not None]
+    if tsunami is not None:
+        keys.append(delivery_key(tsunami))
+    undelivered = await leader_lease.undelivered(keys) if keys else set()
+    count = 0
+    # キューから戻した情報は後から追加されるため、受信順に並べ直す
+    for received_at, key, (priority, handler, event, dispatch_key) in sorted(entries, key=lambda entry: entry[0]):
+        # キーがない情報は配信済みか判定できないため、二重に送信しないよう配信しない
+        if key in undelivered:
+            dispatcher.submit(priority, handler, event, key=dispatch_key, received_at=received_at)
+            count += 1
+    if tsunami is not None:
+        if delivery_key(tsunami) in undelivered:
+            dispatcher.submit(PRIORITY_TSUNAMI, process_p2pquake_tsunami, tsunami, key='p2pquake_tsunami')
+            count += 1
+        else:
+            # 前のリーダーが送信した報と比べて、次の報から変わった地域だけを送信する
+            tsunami_tracker.update(tsunami)
+    if entries or tsunami is not None:
+        logger.warning("待機中に受信した%d件のうち、未配信の%d件を配信します。", len(entries) + (tsunami is not None), count)
+
+leader_lease = None
+if settings.leader_lease_file:
+    leader_lease = LeaderLease(settings.leader_lease_file, ttl=settings.leader_lease_ttl, on_change=take_over).open()
+    dispatcher.gate = leader_gate
+
+async def interaction_check(interaction):
+    # 冗長化している場合はリーダーだけがコマンドに応答する
+    return leader_lease is None or leader_lease.is_leader
+
+tree.interaction_check = interaction_check
 
 # WebSocket connection
-async def websocket_listener(url, process_function, status_variable_name):
-    retry_count = 0
-    async with aiohttp.ClientSession() as session:
-        while True:
-            try:
-                async with session.ws_connect(url) as ws:
-                    globals()[status_variable_name] = "接続しています"
-                    print(f"{url}へ接続しました。")
-                    retry_count = 0
-                    async for msg in ws:
-                        if msg.type == aiohttp.WSMsgType.TEXT:
-                            data = json.loads(msg.data)
-                            await process_function(data)
-                        elif msg.type == aiohttp.WSMsgType.CLOSED:
-                            print(f"{url}: サーバーによって接続が閉じられました。再接続します。")
-                            break
-                        elif msg.type == aiohttp.WSMsgType.ERROR:
-                            print(f"{url}: WebSocketエラーが発生しました。再接続します。")
-                            break
-            except aiohttp.ClientError as e:
-                print(f"{url}: WebSocket接続エラー: {e}")
-            except ConnectionResetError:
-                print(f"{url}: 接続がリセットされました。再接続します。")
-            except Exception as e:
-                print(f"{url}: 予期しないエラーが発生しました: {e}")
-                traceback.print_exc()
-            finally:
-                retry_count += 1
-                globals()[status_variable_name] = "再接続中"
-                print(f"{url}: 5秒後に再接続を試みます... (試行回数: {retry_count})")
-                await asyncio.sleep(5)
-
-async def process_p2pquake_message(data):
-    if data['code'] == 551:
-        await process_p2pquake_info(data)
-    elif data["code"] == 552:
-        await process_p2pquake_tsunami(data)
-    elif data['code'] == 556:
-        await process_p2pquake_eew(data)
-
-async def process_wolfx_message(data):
-    if data.get('type') == 'jma_eew':
-        await process_eew_data(data)
+p2pquake_feed = FeedConnection(
+    'P2PQuake', process_p2pquake_message,
+    identity=p2pquake_identity,
+    connections=settings.feed_connections,
+    backfill=P2PQuakeBackfill(P2PQUAKE_HISTORY_URL),
+    started_at=STARTED_AT,
+    # 551: 地震情報, 552: 津波予報, 556: 緊急地震速報（警報）以外は解析せずに捨てる
+    decode=p2pquake_decoder((551, 552, 556))
+)
+# Wolfxは60秒ごとにハートビートを送ってくるため、それ以上受信がなければ再接続する
+wolfx_feed = FeedConnection(
+    'Wolfx', process_wolfx_message,
+    identity=wolfx_identity,
+    connections=settings.feed_connections,
+    idle_timeout=150,
+    started_at=STARTED_AT,
+    # ハートビートなどは解析せずに捨てる
+    decode=wolfx_decoder(("jma_eew",))
+)
 
 async def fetch_p2pquake():
-    while True:
-        try:
-            await websocket_listener(
-                P2PQUAKE_WS_URL,
-                process_p2pquake_message,
-                'status_p2pquake'
-            )
-        except Exception as e:
-            print(f"fetch_p2pquake: エラーが発生しました: {e}")
-            traceback.print_exc()
-            await asyncio.sleep(5)
+    await p2pquake_feed.run(P2PQUAKE_WS_URL)
 
 async def fetch_wolfx():
-    while True:
-        try:
-            await websocket_listener(
-                WOLFX_WS_URL,
-                process_wolfx_message,
-                'status_wolfx'
-            )
-        except Exception as e:
-            print(f"fetch_wolfx: エラーが発生しました: {e}")
-            traceback.print_exc()
-            await asyncio.sleep(5)
+    await wolfx_feed.run(WOLFX_WS_URL)
+
+def warm_state():
+    # 保存済みの情報を受信済みとして読み込み、再起動しても同じ情報を再送しないようにする
+    for event_id, serial, closed in event_store.latest_serials(time.time() - eew_tracker.idle_ttl):
+        eew_tracker.warm(event_id, serial, closed)
+    p2pquake_feed.warm(event_store.recent_frames('p2pquake', p2pquake_feed.recent_size))
+    wolfx_feed.warm(event_store.recent_frames('wolfx', wolfx_feed.recent_size))
+
+warm_state()
+
+# Metrics
+def collect_metrics(exposition):
+    feeds = (p2pquake_feed, wolfx_feed)
+    feed_stats = {feed.name: feed.stats() for feed in feeds}
+    exposition.counter("frames_received_total", "受信したフレーム数（種類ごと）", [
+        ((("feed", feed.name), ("kind", kind)), count)
+        for feed in feeds for kind, count in getattr(feed.decode, 'received', {}).items()
+    ])
+    exposition.counter("frames_duplicate_total", "重複として捨てたフレーム数", [((("feed", name),), stats['duplicates']) for name, stats in feed_stats.items()])
+    exposition.counter("frames_backfilled_total", "再接続時に履歴から取得したフレーム数", [((("feed", name),), stats['backfilled']) for name, stats in feed_stats.items()])
+    exposition.counter("feed_reconnects_total", "再接続の回数", [((("feed", name),), stats['reconnects']) for name, stats in feed_stats.items()])
+    exposition.gauge("feed_connections", "接続中のWebSocketの数", [((("feed", name),), stats['active']) for name, stats in feed_stats.items()])
+    exposition.gauge("feed_rtt_seconds", "WebSocketの往復時間", [((("feed", name),), stats['rtt']) for name, stats in feed_stats.items()])
+    exposition.gauge("feed_last_frame_age_seconds", "最後にフレームを受信してからの秒数", [((("feed", name),), stats['last_frame_age']) for name, stats in feed_stats.items()])
+    exposition.histogram("decode_seconds", "フレームの解析時間", *(feed.decode_seconds for feed in feeds))
+    exposition.gauge("dispatch_queue_size", "配信キューの件数", [((), dispatcher.queue.qsize())])
+    exposition.counter("dispatch_dropped_total", "配信キューが満杯で捨てた件数", [((), dispatcher.dropped)])
+    exposition.counter("dispatch_failed_total", "処理中にエラーが発生した件数", [((), dispatcher.failed)])
+    exposition.histogram("dispatch_queue_wait_seconds", "配信キューでの待ち時間", dispatcher.wait_seconds)
+    exposition.histogram("handler_seconds", "受信したデータの処理時間", dispatcher.handler_seconds)
+    exposition.histogram("discord_send_seconds", "Discordへの送信1回あたりの時間", fanout.send_seconds)
+    exposition.counter("discord_rate_limited_total", "レート制限で送信を待った回数", [((), fanout.rate_limited)])
+    exposition.counter("discord_send_failed_total", "送信に失敗した回数", [((), fanout.failed)])
+    exposition.histogram("webhook_send_seconds", "Webhookへの送信1回あたりの時間", webhooks.send_seconds)
+    exposition.counter("webhook_sent_total", "Webhookで送信したメッセージ数", [((), webhooks.sent)])
+    exposition.counter("webhook_fallback_total", "Webhookに失敗してBOTから送信した回数", [((), webhooks.fallback)])
+    exposition.counter("webhook_failed_total", "BOTからの送信にも失敗した回数", [((), webhooks.failed)])
+    map_stats = map_renderer.stats()
+    exposition.histogram("map_render_seconds", "震度分布図の描画時間", map_renderer.render_seconds)
+    exposition.gauge("map_pending", "描画中・描画待ちの震度分布図の数", [((), map_stats['pending'])])
+    exposition.counter("map_dropped_total", "描画待ちが多いため省略した震度分布図の数", [((), map_stats['dropped'])])
+    exposition.counter("map_superseded_total", "新しい報の描画が始まったため送信しなかった震度分布図の数", [((), map_stats['superseded'])])
+    exposition.counter("map_timeouts_total", "時間内に描画が終わらなかった震度分布図の数", [((), map_stats['timeouts'])])
+    if leader_lease is not None:
+        lease_stats = leader_lease.stats()
+        exposition.gauge("leader", "リーダーとして配信しているか（1: リーダー, 0: 待機中）", [((), int(lease_stats['leader']))])
+        exposition.counter("leader_elections_total", "リーダーになった回数", [((), lease_stats['elections'])])
+        exposition.gauge("standby_buffered", "待機中に受信し、引き継ぎに備えて保持している情報の数", [((), len(standby))])
+        exposition.counter("dispatch_deferred_total", "リーダーでなくなったため送信せずに保持した件数", [((), dispatcher.deferred)])
+    tsunami_stats = tsunami_tracker.stats()
+    exposition.counter("tsunami_bulletins_total", "前回の報から変わった地域を送信した津波情報の数", [((), tsunami_stats['bulletins'])])
+    exposition.counter("tsunami_unchanged_total", "変わった地域がないため送信しなかった津波情報の数", [((), tsunami_stats['unchanged'])])
+    log_stats = log.stats()
+    exposition.counter("log_dropped_total", "キューが満杯で捨てたログの件数", [((), log_stats['dropped'])])
+    exposition.counter("log_suppressed_total", "同じ警告・エラーの繰り返しとして省略したログの件数", [((), log_stats['suppressed'])])
+    exposition.histogram("alert_delivery_seconds", "受信からDiscordへの送信・編集が完了するまでの時間", metrics.delivery_seconds)
+
+# Delivery
+def resolve_channels(subs):
+    channels = []
+    for sub in subs:
+        channel = client.get_channel(sub.channel_id)
+        if channel is None:
+            logger.warning("チャンネル%dが見つかりません。", sub.channel_id)
+            continue
+        channels.append(channel)
+    return channels
+
+async def send_fallback(channel_id, messages):
+    await client.wait_until_ready()
+    channel = client.get_channel(channel_id)
+    if channel is None:
+        raise LookupError(f"チャンネル{channel_id}が見つかりません。")
+    return await fanout.send_all(channel, messages)
+
+async def deliver(embed, kind, fields=(), image_path=None, channels=None, silent=False, edit_key=None, updater=eew_updater, map_job=None, **filters):
+    subs = subscriptions.match(kind, **filters) if channels is None else []
+    edit = edit_key is not None
+    targets = []
+    if settings.delivery_mode == "Webhook" and not edit:
+        # Webhookはゲートウェイの準備を待たずに送信できる
+        targets = [(sub.channel_id, sub.webhook_url) for sub in subs if sub.webhook_url]
+        subs = [sub for sub in subs if not sub.webhook_url]
+    if channels is None:
+        channels = []
+        if subs:
+            # 起動直後はチャンネルを取得できないため、ゲートウェイの準備ができるまで待つ
+            await client.wait_until_ready()
+            channels = resolve_channels(subs)
+
+    # アップロード済みの画像はURLで参照し、添付ファイルを送らない
+    image_url = asset_cache.url(image_path) if image_path else None
+    if image_path:
+        embed.set_thumbnail(url=image_url or f"attachment://{os.path.basename(image_path)}")
+
+    # 制限を超える長さのフィールドは複数の埋め込み・メッセージに分ける
+    pages = layout.paginate(embed, fields)
+
+    def make_messages(start=0):
+        # start件目以降のメッセージだけを作る（画像の添付ファイルは先頭のメッセージを作る場合だけ開く）
+        messages = [{"embeds": embeds, "silent": silent} for embeds in pages[start:]]
+        if image_path and not image_url and start == 0:
+            messages[0]["file"] = asset_cache.file(image_path)
+        return messages
+
+    event = current_item.get()
+    if edit:
+        # 編集モードでは先頭のメッセージを更新する（送信・編集は後で行うため、成功した時点で配信済みとする）
+        # 1メッセージに収まらない分は続きのメッセージとして同じように更新し、前回より減った続きのメッセージは削除する
+        for channel in channels:
+            messages = make_messages()
+            first = updater.update((channel.id, *edit_key), functools.partial(fanout.send_to, channel), messages[0]["embeds"], messages[0].get("file"), silent=silent, on_sent=functools.partial(mark_delivered, event))
+            for index, message in enumerate(messages[1:], 1):
+                updater.update((channel.id, *edit_key, index), functools.partial(send_after, first, channel), message["embeds"], silent=silent)
+            index = len(messages)
+            while updater.discard((channel.id, *edit_key, index)):
+                index += 1
+    else:
+        results, webhook_results = await asyncio.gather(fanout.send(channels, make_messages), webhooks.send(targets, make_messages, send_fallback))
+        if (not channels and not targets) or not all(isinstance(result, BaseException) for result in (*results, *webhook_results)):
+            mark_delivered(event)
+        if map_job is not None and settings.quake_map:
+            # Webhookで送信したメッセージはwait=falseのため編集できず、地図は続けて送信する
+            # BOTから代わりに送信した場合は送信したメッセージを編集する
+            messages = [result[0] for result in (*results, *webhook_results) if isinstance(result, list) and result]
+            urls = [url for (_, url), result in zip(targets, webhook_results) if isinstance(result, int)]
+            follow_with_map(map_job, pages[0], messages, urls)
+
+async def send_after(task, channel, **kwargs):
+    # 続きのメッセージは先頭のメッセージの後に送信する
+    await asyncio.wait([task])
+    return await fanout.send_to(channel, **kwargs)
+
+# 震度分布図
+map_tasks = set()
+
+def follow_with_map(map_job, embeds, messages, webhook_urls):
+    # 文字の情報を先に送信し、描画が終わったら地図を追加する（配信のワーカーは描画を待たない）
+    if not messages and not webhook_urls:
+        return
+    task = asyncio.create_task(attach_map(map_job, embeds, messages, webhook_urls))
+    map_tasks.add(task)
+    task.add_done_callback(map_tasks.discard)
 
-# P2PQuake info
-async def process_p2pquake_info(data):
-    quaketype = data.get('issue', {}).get('type', '不明')
-    source = data.get('issue', {}).get('source', '不明')
-    details = data.get('earthquake', {})
-    place = details.get('hypocenter', {}).get('name', '不明')
-    magnitude = details.get('hypocenter', {}).get('magnitude', '不明')
-    formatted_mag = "{:.1f}".format(magnitude) if isinstance(magnitude, (int, float)) else '不明'
-    depth = details.get('hypocenter', {}).get('depth', '不明')
-    depth = "ごく浅い" if depth == 0 else (f"{depth}km" if depth != '不明' else '不明')
-    max_intensity = details.get('maxScale', '不明')
-    domestic_tsunami = details.get('domesticTsunami', '情報なし')
-    occurrence_time = details.get('time', '不明')
-    formatted_time = '不明'
-    comments = data.get('comments', {}).get('freeFormComment', '不明')
-
-    if occurrence_time != '不明':
-        try:
-            occurrence_time_obj = datetime.strptime(occurrence_time, "%Y/%m/%d %H:%M:%S")
-            formatted_time = occurrence_time_obj.strftime("%d日%H時%M分")
-        except ValueError:
-            formatted_time = '不明'
-
-    tsunami_text = (
-        "この地震による津波の心配はありません。" if domestic_tsunami == "None" else
-        "この地震による津波の有無は不明です。" if domestic_tsunami == "Unknown" else
-        "この地震による津波の有無は現在調査中です。" if domestic_tsunami == "Checking" else
-        "この地震により若干の海面変動が予想されますが、被害の心配はありません。" if domestic_tsunami == "NonEffective" else
-        "この地震により津波注意報が発表されています。" if domestic_tsunami == "Watch" else
-        "この地震により津波警報が発表されています。" if domestic_tsunami == "Warning" else
-        "情報なし"
-    )
-    foreign_tsunami_text = (
-        "この地震による日本への津波の心配はありません。" if domestic_tsunami == "None" else
-        "この地震による津波の有無は不明です。" if domestic_tsunami == "Unknown" else
-        "日本への津波の有無については現在調査中です。" if domestic_tsunami == "Checking" else
-        "この地震による日本への津波の心配はありませんが、若干の海面変動があるかもしれません。" if domestic_tsunami == "NonEffective" else
-        "この地震により津波注意報が発表されています。" if domestic_tsunami == "Watch" else
-        "この地震により津波警報が発表されています。" if domestic_tsunami == "Warning" else
-        "情報なし"
+async def attach_map(map_job, embeds, messages, webhook_urls):
+    data = await map_renderer.render(*map_job)
+    if data is None:
+        return
+    embeds = [embed.copy() for embed in embeds]
+    embeds[0].set_image(url=f"attachment://{MAP_FILENAME}")
+    results = await asyncio.gather(
+        *(message.edit(embeds=embeds, attachments=[*message.attachments, discord.File(io.BytesIO(data), filename=MAP_FILENAME)]) for message in messages),
+        *(webhooks.post(url, [discord.Embed(color=embeds[0].color).set_image(url=f"attachment://{MAP_FILENAME}")], discord.File(io.BytesIO(data), filename=MAP_FILENAME), silent=True) for url in webhook_urls),
+        return_exceptions=True
     )
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.warning("震度分布図の追加に失敗しました: %s", result)
+        elif result is not None:
+            metrics.record_delivery(result, "地図を追加")
 
-    if max_intensity >= 70:
-        color = 0x9D00DE
-        image = 'shindo7.png'
-        formatted_intensity = '7'
-    elif max_intensity >= 60:
-        color = 0xFE3B3B
-        image = 'shindo6s.png'
-        formatted_intensity = '6強'
-    elif max_intensity >= 55:
-        color = 0xFD6767
-        image = 'shindo6w.png'
-        formatted_intensity = '6弱'
-    elif max_intensity >= 50:
-        color = 0xC0392B
-        image = 'shindo5s.png'
-        formatted_intensity = '5強'
-    elif max_intensity >= 45:
-        color = 0xE74C3C
-        image = 'shindo5w.png'
-        formatted_intensity = '5弱'
-    elif max_intensity >= 40:
-        color = 0xE67E22
-        image = 'shindo4.png'
-        formatted_intensity = '4'
-    elif max_intensity >= 30:
-        color = 0xF1C40F
-        image = 'shindo3.png'
-        formatted_intensity = '3'
-    elif max_intensity >= 20:
-        color = 0x2ECC71
-        image = 'shindo2.png'
-        formatted_intensity = '2'
-    elif max_intensity >= 10:
-        color = 0x3498DB
-        image = 'shindo1.png'
-        formatted_intensity = '1'
-    else:
-        color = 0x95A5A6
-        image = 'unknown.png'
-        formatted_intensity = '不明'
+# P2PQuake info
+TSUNAMI_TEXTS = {
+    "None": "この地震による津波の心配はありません。",
+    "Unknown": "この地震による津波の有無は不明です。",
+    "Checking": "この地震による津波の有無は現在調査中です。",
+    "NonEffective": "この地震により若干の海面変動が予想されますが、被害の心配はありません。",
+    "Watch": "この地震により津波注意報が発表されています。",
+    "Warning": "この地震により津波警報が発表されています。",
+}
+FOREIGN_TSUNAMI_TEXTS = {
+    "None": "この地震による日本への津波の心配はありません。",
+    "Unknown": "この地震による津波の有無は不明です。",
+    "Checking": "日本への津波の有無については現在調査中です。",
+    "NonEffective": "この地震による日本への津波の心配はありませんが、若干の海面変動があるかもしれません。",
+    "Watch": "この地震により津波注意報が発表されています。",
+    "Warning": "この地震により津波警報が発表されています。",
+}
+
+async def process_p2pquake_info(event):
+    quaketype = event.issue_type
+    source = event.issue_source
+    place = event.hypocenter
+    formatted_mag = event.magnitude_text
+    depth = event.depth_text
+    domestic_tsunami = event.domestic_tsunami
+    formatted_time = event.origin_time_text
+
+    tsunami_text = TSUNAMI_TEXTS.get(domestic_tsunami, "情報なし")
+    foreign_tsunami_text = FOREIGN_TSUNAMI_TEXTS.get(domestic_tsunami, "情報なし")
+
+    scale_info = event.max_intensity
+    fields = []
+    color = scale_info.color
+    image = scale_info.image
+    formatted_intensity = scale_info.label
 
     if quaketype == "ScalePrompt":  # 震度速報
-        def intensity(scale):
-            if scale == 10:
-                return "1"
-            elif scale == 20:
-                return "2"
-            elif scale == 30:
-                return "3"
-            elif scale == 40:
-                return "4"
-            elif scale == 45:
-                return "5弱"
-            elif scale == 50:
-                return "5強"
-            elif scale == 55:
-                return "6弱"
-            elif scale == 60:
-                return "6強"
-            elif scale == 70:
-                return "7"
-            else:
-                return "不明"
-
-        points_info = "\n".join([f"{point['addr']}: 震度{intensity(point['scale'])}" for point in data['points']])
         dataname = "震度速報"
         embed = discord.Embed(title="🌍 震度速報", description=f"{formatted_time}頃、\n**最大震度{formatted_intensity}**を観測する地震が発生しました。\n**{tsunami_text}** \n今後の情報に注意してください。", color=color)
-        embed.add_field(name="震度情報", value=points_info, inline=False)
+        fields.extend(layout.point_fields(event.points))
 
-        await client.change_presence(status=discord.Status.online, activity=discord.CustomActivity(name=f"震度速報: 最大震度{formatted_intensity}を観測する地震がありました"))
-        await asyncio.sleep(20)
-        await client.change_presence(status=discord.Status.online, activity=discord.CustomActivity(name=f"CPU, RAM, Ping計測中"))
+        presence.request(f"震度速報: 最大震度{formatted_intensity}を観測する地震がありました", PRESENCE_ALERT, ttl=PRESENCE_TTL)
 
     elif quaketype == "Destination":  # 震源情報
         dataname = "震源に関する情報"
@@ -267,9 +541,7 @@ async def process_p2pquake_info(data):
         embed.add_field(name="マグニチュード", value=f"M{formatted_mag}", inline=True)
         embed.add_field(name="深さ", value=depth, inline=True)
 
-        await client.change_presence(status=discord.Status.online, activity=discord.CustomActivity(name=f"震源情報: {place}で地震がありました"))
-        await asyncio.sleep(20)
-        await client.change_presence(status=discord.Status.online, activity=discord.CustomActivity(name=f"CPU, RAM, Ping計測中"))
+        presence.request(f"震源情報: {place}で地震がありました", PRESENCE_ALERT, ttl=PRESENCE_TTL)
 
     elif quaketype == "DetailScale":  # 地震情報
         dataname = "震源・震度に関する情報"
@@ -278,16 +550,11 @@ async def process_p2pquake_info(data):
         embed.add_field(name="マグニチュード", value=f"M{formatted_mag}", inline=True)
         embed.add_field(name="深さ", value=depth, inline=True)
 
-        await client.change_presence(status=discord.Status.online, activity=discord.CustomActivity(name=f"地震情報: {place}で最大震度{formatted_intensity}の地震がありました"))
-        await asyncio.sleep(20)
-        await client.change_presence(status=discord.Status.online, activity=discord.CustomActivity(name=f"CPU, RAM, Ping計測中"))
+        presence.request(f"地震情報: {place}で最大震度{formatted_intensity}の地震がありました", PRESENCE_ALERT, ttl=PRESENCE_TTL)
 
     elif quaketype == "Foreign":  # 遠地地震、噴火情報
-        comments = data.get('comments', {}).get('freeFormComment', None)
-        is_eruption = (
-            data.get('earthquake', {}).get('hypocenter', {}).get('name') == '不明' or
-            (comments and '大規模な噴火が発生しました' in comments)
-        )
+        comments = event.comments
+        is_eruption = place == '不明' or '大規模な噴火が発生しました' in comments
         embed = discord.Embed(
             title="🌋 遠地噴火情報" if is_eruption else "🌍 遠地地震情報",
             description=f"{formatted_time}頃、\n海外で大きな{'噴火' if is_eruption else '地震'}がありました。\n**{foreign_tsunami_text}**",
@@ -305,324 +572,408 @@ async def process_p2pquake_info(data):
             dataname = "遠地地震に関する情報"
 
         if comments:
-            embed.add_field(name="コメント", value=comments, inline=False)
+            fields.extend(layout.make_fields("コメント", comments.splitlines()))
 
-        await client.change_presence(
-            status=discord.Status.online,
-            activity=discord.CustomActivity(name=f"遠地{'噴火' if is_eruption else '地震'}: {place}, M{formatted_mag}")
-        )
-        await asyncio.sleep(20)
-        await client.change_presence(
-            status=discord.Status.online,
-            activity=discord.CustomActivity(name=f"CPU, RAM, Ping計測中")
-        )
+        presence.request(f"遠地{'噴火' if is_eruption else '地震'}: {place}, M{formatted_mag}", PRESENCE_ALERT, ttl=PRESENCE_TTL)
 
     elif quaketype == "Other":  # その他の地震情報
         embed = discord.Embed(title="🌍 地震情報(その他)", description=f"{formatted_time}頃、\n地震がありました。", color=color)
-        embed.add_field(name="data", value=data, inline=True)
+        fields.extend(layout.make_fields("data", str(event.raw).splitlines(), inline=True))
     
-    channel = client.get_channel(channel_id)
     embed.set_footer(text=f"{source}・{dataname} | Version {VER}")
 
+    filters = dict(observed=scale_info, areas=event.areas)
+    if quaketype in ("ScalePrompt", "Destination", "DetailScale"):
+        filters['map_job'] = info_map_job(event)
     if quaketype != "Destination" and quaketype != "Other":
-        file = discord.File(f"info/{image}", filename=image)
-        embed.set_thumbnail(url=f"attachment://{image}")
-        await channel.send(embed=embed, file=file)
+        await deliver(embed, 'info', fields, image_path=f"info/{image}", **filters)
     else:
-        await channel.send(embed=embed)
+        await deliver(embed, 'info', fields, **filters)
 
+def info_map_job(event):
+    if not settings.quake_map:
+        return None
+    points = area_locator.points((point.addr, point.pref, point.level.rank) for point in event.points if point.level.rank)
+    epicenter = (event.latitude, event.longitude) if event.latitude is not None else None
+    if not points and epicenter is None:
+        return None
+    return (('info', event.frame_id), points, epicenter)
 
-# P2PQuake eew
-async def process_p2pquake_eew(data):
-    hypocenter_name = data.get('earthquake', {}).get('hypocenter', {}).get('name', '不明')
-    magnitude = data.get('earthquake', {}).get('hypocenter', {}).get('magnitude', '不明')
-    depth = data.get('earthquake', {}).get('hypocenter', {}).get('depth', '不明')
-    condition = data.get('earthquake', {}).get('condition', '')
-    cancelled = data.get('cancelled', 'False')
-    channel = client.get_channel(channel_id)
 
-    if cancelled:
-        embed = discord.Embed(title="❌先程の緊急地震速報はキャンセルされました", description="", color=discord.Color.green)
+# P2PQuake eew
+async def process_p2pquake_eew(event):
+    if event.cancelled:
+        embed = discord.Embed(title="❌先程の緊急地震速報はキャンセルされました", description="", color=discord.Color.green())
         embed.set_footer(text=f"気象庁 | Version {VER}")
-        await channel.send(embed=embed)
+        await deliver(embed, 'eew', is_warn=True)
         return
 
-    areas_info = []
-    for area in data.get('areas', []):
-        arrival_time = area.get('arrivalTime', '不明')
-        try:
-            arrival_time_obj = datetime.strptime(arrival_time, "%Y/%m/%d %H:%M:%S")
-            formatted_arrival_time = arrival_time_obj.strftime("%H時%M分%S秒")
-        except ValueError:
-            formatted_arrival_time = '不明'
-        areas_info.append(f"{area.get('name', '不明')}（{formatted_arrival_time}）")
-
-    areas_text = "\n".join(areas_info)
-
-    origin_time_str = data.get('earthquake', {}).get('originTime', '不明')
-    formatted_origin_time = '不明'
-    if origin_time_str != '不明':
-        try:
-            origin_time_obj = datetime.strptime(origin_time_str, "%Y/%m/%d %H:%M:%S")
-            formatted_origin_time = origin_time_obj.strftime("%d日%H時%M分%S秒")
-        except ValueError:
-            formatted_origin_time = '不明'
-
     embed = discord.Embed(title="🚨緊急地震速報", description="緊急地震速報です。強い揺れに警戒して下さい。\n緊急地震速報が発令された地域では、震度5弱以上の揺れが来るかもしれません。\n落ち着いて、身の安全を図ってください。", color=0xff0000)
-    embed.add_field(name="発震時間", value=formatted_origin_time, inline=True)
-    embed.add_field(name="震源地", value=hypocenter_name, inline=True)
-    embed.add_field(name="マグニチュード", value=f"M{magnitude}", inline=True)
-    embed.add_field(name="深さ", value=f"{depth}km", inline=True)
-    if condition == '仮定震源要素':
+    embed.add_field(name="発震時間", value=event.origin_time_text, inline=True)
+    embed.add_field(name="震源地", value=event.hypocenter, inline=True)
+    embed.add_field(name="マグニチュード", value=f"M{event.magnitude_text}", inline=True)
+    embed.add_field(name="深さ", value=f"{event.depth}km" if event.depth is not None else '不明', inline=True)
+    if event.condition == '仮定震源要素':
         embed.add_field(name="仮定震源要素", value="以上の情報は仮に割り振られた情報であり、地震学的な意味を持ちません", inline=True)
-    embed.add_field(name="発表地域、到達予想時刻", value=areas_text if areas_text else "発表なし", inline=False)
+    fields = layout.make_fields("発表地域、到達予想時刻", event.warn_area_lines or ["発表なし"])
     embed.set_footer(text=f"気象庁・緊急地震速報（警報）| Version {VER}")
 
-    await channel.send(embed=embed)
+    await deliver(embed, 'eew', fields, is_warn=True, areas=event.areas)
 
 # P2PQuake tsunami
-async def process_p2pquake_tsunami(data):
-    issue_info = data.get('issue', {})
-    issue_type = issue_info.get('type', '不明')
-    issue_time_str = issue_info.get('time', '不明')
-    source = issue_info.get('source', '不明')
-
-    cancelled = data.get('cancelled', False)
-    areas = data.get('areas', [])
-
-    if issue_time_str != '不明':
-        try:
-            issue_time_obj = datetime.strptime(issue_time_str, "%Y/%m/%d %H:%M:%S")
-            formatted_issue_time = issue_time_obj.strftime("%d日%H時%M分")
-        except ValueError:
-            formatted_issue_time = '不明'
-    else:
-        formatted_issue_time = '不明'
-
-    if cancelled:
-        description = f"津波情報が解除されました。"
-        color = 0x00BFFF
-        embed = discord.Embed(title="🌊 津波情報", description=description, color=color)
-    else:
-        description = f"津波情報が発表されました。"
-        color = 0xFF4500
-        embed = discord.Embed(title="🌊 津波情報", description=description, color=color)
-        embed.add_field(name="発表時間", value=formatted_issue_time, inline=True)
-
-        if areas:
-            areas_info = []
-            for area in areas:
-                name = area.get('name', '不明')
-                grade = area.get('grade', '不明')
-                immediate = area.get('immediate', False)
-                first_height = area.get('firstHeight', {})
-                arrival_time_str = first_height.get('arrivalTime', '不明')
-                condition = first_height.get('condition', '不明')
-
-                if arrival_time_str != '不明':
-                    try:
-                        arrival_time_obj = datetime.strptime(arrival_time_str, "%Y/%m/%d %H:%M:%S")
-                        formatted_arrival_time = arrival_time_obj.strftime("%d日%H時%M分")
-                    except ValueError:
-                        formatted_arrival_time = '不明'
-                else:
-                    formatted_arrival_time = '不明'
-
-                max_height = area.get('maxHeight', {})
-                max_height_desc = max_height.get('description', '不明')
-                max_height_value = max_height.get('value', '不明')
-
-                area_text = (
-                    f"**{name}**\n"
-                    f"予報種別: {grade}\n"
-                    f"第1波到達予想時刻: {formatted_arrival_time}\n"
-                    f"状況: {condition}\n"
-                    f"予想高さ: {max_height_desc} ({max_height_value}m)\n"
-                    f"{'直ちに津波来襲と予想されています。' if immediate else ''}"
-                )
-                areas_info.append(area_text)
-
-            areas_text = "\n\n".join(areas_info)
-            embed.add_field(name="対象地域", value=areas_text, inline=False)
+def tsunami_summary(event, changes):
+    # 発表中の全ての地域のまとめ（一連の情報の間、同じメッセージを編集する）
+    if changes.closed:
+        embed = discord.Embed(title="🌊 津波情報", description="津波情報が解除されました。", color=0x00BFFF)
+        embed.add_field(name="発表時間", value=event.issue_time_text, inline=True)
+        return embed, []
+    grade = max((area.grade for area in changes.areas), key=grade_rank)
+    embed = discord.Embed(
+        title="🌊 津波情報",
+        description=f"**{GRADE_LABELS.get(grade, grade)}**などが発表されています。\n今後の情報に注意してください。",
+        color=GRADE_COLORS.get(grade, 0xFF4500)
+    )
+    embed.add_field(name="発表時間", value=event.issue_time_text, inline=True)
+    return embed, layout.tsunami_fields(changes.areas)
+
+def tsunami_change_fields(changes):
+    # 引き上げ・新たな発表を先に表示する
+    def label(area):
+        return GRADE_LABELS.get(area.grade, area.grade)
+    fields = []
+    fields.extend(layout.make_fields("⚠️ 引き上げ", [f"{label(old)} → **{label(new)}** {layout.tsunami_area_line(new)}" for old, new in changes.upgraded]))
+    fields.extend(layout.make_fields("⚠️ 新たに発表", [f"{label(area)} {layout.tsunami_area_line(area)}" for area in changes.added]))
+    fields.extend(layout.make_fields("引き下げ", [f"{label(old)} → {label(new)} {layout.tsunami_area_line(new)}" for old, new in changes.downgraded]))
+    fields.extend(layout.make_fields("解除", [f"**{area.name}** {label(area)}" for area in changes.cleared]))
+    fields.extend(layout.make_fields("到達予想時刻・高さの変更", [layout.tsunami_area_line(new) for _, new in changes.updated]))
+    return fields
+
+async def process_p2pquake_tsunami(event):
+    changes = tsunami_tracker.update(event)
+    if changes is None:
+        logger.info("前回の報から変わった地域がないため、津波情報を送信しませんでした。")
+        # 引き継いだインスタンスが前回の報として使えるように、送信しなかった報も配信済みとする
+        mark_delivered(event)
+        return
+    footer = f"{event.issue_source}・津波情報 | Version {VER}"
+    edit_key = ('tsunami', changes.key)
+    areas = tuple(area.name for area in (*changes.areas, *changes.cleared))
+
+    if not changes.first:
+        # 2報目以降は変わった地域だけを新しいメッセージで送信する
+        changed = [*changes.added, *(new for _, new in changes.upgraded), *(new for _, new in changes.downgraded), *(new for _, new in changes.updated)]
+        if changes.closed:
+            embed = discord.Embed(title="🌊 津波情報", description="津波情報が解除されました。", color=0x00BFFF)
+        elif changes.escalated:
+            grade = max((area.grade for area in (*changes.added, *(new for _, new in changes.upgraded))), key=grade_rank)
+            embed = discord.Embed(title="🌊 津波情報の更新", description=f"**{GRADE_LABELS.get(grade, grade)}に引き上げられた地域があります。**", color=GRADE_COLORS.get(grade, 0xFF4500))
         else:
-            embed.add_field(name="対象地域", value="エリアなし", inline=False)
+            embed = discord.Embed(title="🌊 津波情報の更新", description="津波予報の内容が変わりました。", color=0x00BFFF)
+        embed.add_field(name="発表時間", value=event.issue_time_text, inline=True)
+        embed.set_footer(text=footer)
+        await deliver(embed, 'tsunami', tsunami_change_fields(changes), areas=tuple(area.name for area in (*changed, *changes.cleared)))
 
-    embed.set_footer(text=f"{source}・津波情報 | Version {VER}")
-    channel = client.get_channel(channel_id)
-    await channel.send(embed=embed)
+    # まとめのメッセージは最初の報で送信し、以降は編集する
+    embed, fields = tsunami_summary(event, changes)
+    embed.set_footer(text=footer)
+    await deliver(embed, 'tsunami', fields, edit_key=edit_key, updater=tsunami_updater, areas=areas)
 
 # Wolfx
-async def process_eew_data(data, is_test=False):
-    forecast_warning = os.getenv('ForecastWarning')
-    accuracy_boolean = os.getenv('AccuracyBoolean', 'False').lower() == 'true'
-
-    if forecast_warning == 'None':
-        return
-    elif forecast_warning == 'Warning' and not data.get('isWarn', False):
-        return
-    elif forecast_warning == 'Forecast' and data.get('isWarn', False):
-        return
+# 配信先のどれか1つでも受け取る種類の緊急地震速報だけを処理する
+def eew_filter(is_warn):
+    return subscriptions.wants_eew(is_warn)
 
-    report_number = data.get('Serial', '不明')
-    is_final = data.get('isFinal', False)
-    is_cancel = data.get('isCancel', False)
-    is_assumption = data.get('isAssumption', False)
-    warn_area = data.get('WarnArea', [])
-    magnitude = data.get('Magunitude', '不明')
-    formatted_mag = "{:.1f}".format(float(magnitude)) if magnitude != '不明' else '不明'
-    max_intensity = data.get('MaxIntensity', '不明')
-    ac_epicenter = data.get('Accuracy', {}).get('Epicenter', '不明')
-    ac_depth = data.get('Accuracy', {}).get('Depth', '不明')
-    ac_magnitude = data.get('Accuracy', {}).get('Magnitude', '不明')
-    origin_time_str = data.get('OriginTime', '不明')
-    hypocenter = data.get('Hypocenter', '不明')
-    depth = data.get('Depth', '不明')
-    channel = client.get_channel(channel_id)
-    dataname = "緊急地震速報（警報）" if data.get('isWarn', False) else "緊急地震速報（予報）"
+async def process_eew_data(event, is_test=False, channels=None):
+    dataname = "緊急地震速報（警報）" if event.is_warn else "緊急地震速報（予報）"
+    edit_key = (is_test, event.event_id) if settings.eew_edit_message else None
 
-    if is_cancel:
+    if event.is_cancel:
         embed = discord.Embed(title='緊急地震速報【キャンセル】', description='先程の緊急地震速報はキャンセルされました', color=0x00FF00)
-        await channel.send(embed=embed)
+        await deliver(embed, 'eew', channels=channels, silent=is_test, edit_key=edit_key, is_warn=event.is_warn)
         return
 
-    try:
-        origin_time_obj = datetime.strptime(origin_time_str, "%Y/%m/%d %H:%M:%S")
-        formatted_origin_time = origin_time_obj.strftime("%d日%H時%M分")
-    except ValueError:
-        formatted_origin_time = '不明'
-
-    title_type = "警報" if data.get('isWarn', False) else "地震動予報"
-    title = f"{'**テストデータです！**' if is_test else ''}{"🚨" if data.get('isWarn', False) else "⚠️"}緊急地震速報({title_type}) 第{report_number}報{'【最終報】' if is_final else ''}"
-    description = f"**{formatted_origin_time}頃{hypocenter}で地震、推定最大震度{max_intensity}**"
-    color = 0xff0000 if data.get('isWarn', False) else 0xffd700
+    # 深さが分からない場合は深発地震として扱わない
+    is_deep = event.depth is not None and event.depth >= 150
+    title_type = "警報" if event.is_warn else "地震動予報"
+    title = f"{'**テストデータです！**' if is_test else ''}{'🚨' if event.is_warn else '⚠️'}緊急地震速報({title_type}) 第{event.serial if event.serial is not None else '不明'}報{'【最終報】' if event.is_final else ''}"
+    description = f"**{event.origin_time_text}頃{event.hypocenter}で地震、推定最大震度{event.intensity_label}**"
+    color = 0xff0000 if event.is_warn else 0xffd700
 
-    if max_intensity in ["6弱", "6強", "7"]:
+    if event.max_intensity.scale >= 55:
         description += "\n\n**緊急地震速報の特別警報です。身の安全を確保してください**"
     else:
-        description += "\n\n**強い揺れに警戒してください**" if data.get('isWarn', False) else "\n\n**揺れに備えてください**"
+        description += "\n\n**強い揺れに警戒してください**" if event.is_warn else "\n\n**揺れに備えてください**"
 
-    if int(depth) >= 150:
+    if is_deep:
         description += "\n\n震源が深いため、震央から離れた場所で揺れが大きくなることがあります"
 
-    if is_assumption:
+    if event.is_assumption:
         description += "\n\n**以下の情報は仮に割り振られた情報であり、地震学的な意味を持ちません**"
 
     embed = discord.Embed(title=title, description=description, color=color)
-    embed.add_field(name="推定震源地", value=hypocenter, inline=True)
-    embed.add_field(name="マグニチュード", value=f"M{formatted_mag}", inline=True)
-    embed.add_field(name="深さ", value=f"{depth}km", inline=True)
-    if accuracy_boolean:
+    embed.add_field(name="推定震源地", value=event.hypocenter, inline=True)
+    embed.add_field(name="マグニチュード", value=f"M{event.magnitude_text}", inline=True)
+    embed.add_field(name="深さ", value=f"{event.depth}km" if event.depth is not None else '不明', inline=True)
+    if settings.accuracy:
+        ac_epicenter, ac_depth, ac_magnitude = event.accuracy
         embed.add_field(name="震源の精度", value=ac_epicenter, inline=True)
         embed.add_field(name="深さの精度", value=ac_depth, inline=True)
         embed.add_field(name="Mの精度", value=ac_magnitude, inline=True)
 
-    if warn_area:
-        areas_info = []
-        for area in warn_area:
-            chiiki_name = area.get('Chiiki', '不明')
-            shindo1 = area.get('Shindo1', '不明')
-            shindo2 = area.get('Shindo2', '不明')
-            time_str = area.get('Time', '//////')
-            arrive_status = area.get('Arrive', '不明')
-
-            if time_str != '//////' and time_str != '':
-                try:
-                    arrival_time_obj = datetime.strptime(time_str, "%H%M%S")
-                    arrival_time = arrival_time_obj.strftime("%H時%M分%S秒")
-                except ValueError:
-                    arrival_time = '不明'
-            else:
-                arrival_time = '不明'
-
-            area_info = f"地域: {chiiki_name}\n予想震度: {shindo1}\n到達時間: {arrival_time}\n状況: {arrive_status}"
-            areas_info.append(area_info)
-        areas_text = "\n\n".join(areas_info)
-        embed.add_field(name="各地域の予想震度・到達時間 (気象庁発表)", value=areas_text, inline=False)
-    else:
-        chiiki = None
+    fields = layout.make_fields("各地域の予想震度・到達時間 (気象庁発表)", event.warn_area_lines, separator="\n\n")
+
+    # 報ごとに震源とマグニチュードから全ての地域の震度と主要動の到達時間を推定する（仮定震源要素の場合は推定しない）
+    estimate = None if event.is_assumption else area_estimator.estimate(event.latitude, event.longitude, event.depth, event.magnitude)
+    estimated_areas = estimate.areas() if estimate is not None else []
+    if settings.eew_estimate and estimated_areas:
+        estimate_info = []
+        for area in estimated_areas[:EEW_ESTIMATE_LIMIT]:
+            arrival_time = (event.origin_time + timedelta(seconds=area.s_seconds)).strftime("%H時%M分%S秒") if event.origin_time else '不明'
+            estimate_info.append(f"{area.name}: 震度{area.level.label} / {arrival_time}（発生から{area.s_seconds:.0f}秒）")
+        fields += layout.make_fields("各地域の推定震度・主要動の到達予想時刻 (震源からの推定)", estimate_info)
 
     embed.set_footer(text=f"気象庁・{dataname}| Version {VER}")
 
-    if max_intensity == '1':
-        image = 'shindo1.png'
-    elif max_intensity == '2':
-        image = 'shindo2.png'
-    elif max_intensity == '3':
-        image = 'shindo3.png'
-    elif max_intensity == '4':
-        image = 'shindo4.png'
-    elif max_intensity == '5弱':
-        image = 'shindo5w.png'
-    elif max_intensity == '5強':
-        image = 'shindo5s.png'
-    elif max_intensity == '6弱':
-        image = 'shindo6w.png'
-    elif max_intensity == '6強':
-        image = 'shindo6s.png'
-    elif max_intensity == '7':
-        image = 'shindo7.png'
-    elif int(depth) >= 150:
+    if event.max_intensity.rank:
+        image = event.max_intensity.image
+    elif is_deep:
         image = 'deep.png'
     else:
         image = 'unknown.png'
 
-    file_path = "eew/warning" if data.get('isWarn', False) else "eew/forecast"
-    file = discord.File(f"{file_path}/{image}", filename=image)
-    embed.set_thumbnail(url=f"attachment://{image}")
+    file_path = "eew/warning" if event.is_warn else "eew/forecast"
 
-    await channel.send(embed=embed, file=file, silent=is_test)
-    await client.change_presence(status=discord.Status.online, activity=discord.CustomActivity(name=f"{data['Hypocenter']}最大震度{max_intensity}の地震"))
-    if is_final:
-        await client.change_presence(status=discord.Status.online, activity=discord.CustomActivity(name=f"{data['Hypocenter']}最大震度{max_intensity}の地震"))
-        await asyncio.sleep(20)
-        await client.change_presence(status=discord.Status.online, activity=discord.CustomActivity(name=f"CPU, RAM, Ping計測中"))
+    await deliver(
+        embed, 'eew', fields, image_path=f"{file_path}/{image}", channels=channels, silent=is_test, edit_key=edit_key,
+        is_warn=event.is_warn,
+        observed=event.max_intensity,
+        areas=event.areas,
+        estimated=[(area.search_name, area.level.rank) for area in estimated_areas],
+        map_job=eew_map_job(event, estimated_areas)
+    )
+    # 最終報は続報中の表示より優先度を下げ、他の地震の情報が届いたらそちらを表示する
+    presence.request(
+        f"{event.hypocenter}最大震度{event.intensity_label}の地震",
+        PRESENCE_EEW_FINAL if event.is_final else PRESENCE_ALERT,
+        ttl=PRESENCE_TTL
+    )
+
+def eew_map_job(event, estimated_areas):
+    # 同じ地震の新しい報の地図を描画し始めたら、古い報の地図は送信しない
+    if not settings.quake_map or not estimated_areas:
+        return None
+    points = area_locator.points((area.name, area.pref, area.level.rank) for area in estimated_areas)
+    return (('eew', event.event_id), points, (event.latitude, event.longitude))
 
 @tree.command(name="testdata", description="eewのテストをします")
 async def testdata(interaction: discord.Interaction):
     await interaction.response.send_message("# 実際の地震ではありません \nテストデータの送信を開始します。")
-    for data in test_data_list:
-        await process_eew_data(data,is_test=True)
+    for event in test_events:
+        if eew_filter(event.is_warn):
+            await process_eew_data(event,is_test=True,channels=[interaction.channel])
         await asyncio.sleep(random.uniform(0.5, 1))
 
-async def run_speedtest():
+@tree.command(name="subscribe", description="このチャンネルに地震情報を配信します")
+@app_commands.default_permissions(manage_channels=True)
+@app_commands.describe(forecast_warning="送信する緊急地震速報の種類", min_intensity="送信する最小震度", regions="送信する地域（カンマ区切り、部分一致）", webhook="Webhookを作成して送信する（DeliveryModeがWebhookのときに使用）")
+@app_commands.choices(
+    forecast_warning=[app_commands.Choice(name=choice, value=choice) for choice in FORECAST_WARNING_CHOICES],
+    min_intensity=[app_commands.Choice(name=f"震度{entry.label}", value=entry.scale) for entry in intensity.SCALES]
+)
+async def subscribe(interaction: discord.Interaction, forecast_warning: str = "All", min_intensity: int = 0, regions: str = "", webhook: bool = False):
+    previous = subscriptions.get(interaction.channel_id)
+    webhook_url = None
+    if webhook:
+        try:
+            webhook_url = await subscription_webhook(interaction.channel, previous)
+        except (discord.Forbidden, AttributeError):
+            await interaction.response.send_message("Webhookを作成できませんでした。BOTにウェブフックの管理権限があるか確認してください。", ephemeral=True)
+            return
+    subscription = Subscription(
+        interaction.channel_id,
+        forecast_warning=forecast_warning,
+        min_intensity=min_intensity,
+        regions=[region.strip() for region in regions.split(',') if region.strip()],
+        webhook_url=webhook_url
+    )
+    subscriptions.add(subscription)
+    await interaction.response.send_message(
+        f"このチャンネルを配信先に登録しました。\n緊急地震速報: {forecast_warning}\n最小震度: {intensity.from_scale(min_intensity).label if min_intensity else 'なし'}\n地域: {', '.join(subscription.regions) or 'すべて'}\n送信方法: {'Webhook' if webhook_url else 'BOT'}",
+        ephemeral=True
+    )
+    if previous is not None and previous.webhook_url and previous.webhook_url != webhook_url:
+        await delete_webhook(previous.webhook_url)
+
+async def subscription_webhook(channel, previous):
+    # 登録済みのWebhookが残っていれば使い回し、削除されていれば作成し直す
+    if previous is not None and previous.webhook_url:
+        try:
+            await discord.Webhook.from_url(previous.webhook_url, client=client).fetch(prefer_auth=False)
+            return previous.webhook_url
+        except discord.NotFound:
+            pass
+    created = await channel.create_webhook(name=client.user.name, reason="地震情報の配信")
+    return created.url
+
+async def delete_webhook(url):
+    # 配信先の登録を変更・解除して使わなくなったWebhookは削除する
     try:
-        st = await asyncio.to_thread(speedtest.Speedtest)
-        await asyncio.to_thread(st.get_best_server)
-        download_speed = await asyncio.to_thread(lambda: int(st.download() / 10**6))
-        upload_speed = await asyncio.to_thread(lambda: int(st.upload() / 10**6))
-        server_info = st.results.server['name']
-    except Exception as e:
-        download_speed = "N/A"
-        upload_speed = "N/A"
-        server_info = "N/A"
-        print(f"スピードテストに失敗しました: {e}")
-    
-    return server_info, download_speed, upload_speed
+        await discord.Webhook.from_url(url, client=client).delete(reason="地震情報の配信の変更", prefer_auth=False)
+    except discord.NotFound:
+        pass
+    except discord.HTTPException as e:
+        logger.warning("使わなくなったWebhookの削除に失敗しました: %s", e)
+
+@tree.command(name="unsubscribe", description="このチャンネルへの配信を停止します")
+@app_commands.default_permissions(manage_channels=True)
+async def unsubscribe(interaction: discord.Interaction):
+    removed = subscriptions.remove(interaction.channel_id)
+    if removed:
+        await interaction.response.send_message("このチャンネルへの配信を停止しました。", ephemeral=True)
+        if removed.webhook_url:
+            await delete_webhook(removed.webhook_url)
+    else:
+        await interaction.response.send_message("このチャンネルは配信先に登録されていません。", ephemeral=True)
+
+@tree.command(name="subscriptions", description="このサーバーの配信先を表示します")
+async def list_subscriptions(interaction: discord.Interaction):
+    guild_channel_ids = {channel.id for channel in interaction.guild.channels} if interaction.guild else {interaction.channel_id}
+    lines = [
+        f"<#{sub.channel_id}> 緊急地震速報: {sub.forecast_warning} / 最小震度: {intensity.from_scale(sub.min_intensity).label if sub.min_intensity else 'なし'} / 地域: {', '.join(sub.regions) or 'すべて'} / 送信方法: {'Webhook' if sub.webhook_url else 'BOT'}"
+        for sub in subscriptions.all() if sub.channel_id in guild_channel_ids
+    ]
+    await interaction.response.send_message("\n".join(lines) if lines else "配信先は登録されていません。", ephemeral=True)
+
+@tree.command(name="reload", description=".envの設定を再読み込みします")
+@app_commands.default_permissions(administrator=True)
+async def reload(interaction: discord.Interaction):
+    # 設定はBOT全体に影響するため、BOTの所有者だけが実行できる
+    if not await client.is_owner(interaction.user):
+        await interaction.response.send_message("このコマンドはBOTの所有者のみ実行できます。", ephemeral=True)
+        return
+    try:
+        changed, restart_required = reload_settings()
+    except SettingsError as e:
+        await interaction.response.send_message(f"設定の再読み込みに失敗しました: {e}", ephemeral=True)
+        return
+    message = f"設定を再読み込みしました。変更: {', '.join(changed) or 'なし'}"
+    if restart_required:
+        message += f"\n次の設定は再起動するまで反映されません: {', '.join(restart_required)}"
+    await interaction.response.send_message(message, ephemeral=True)
+
+HISTORY_KINDS = {
+    KIND_EEW: "緊急地震速報",
+    KIND_P2P_EEW: "緊急地震速報（警報）",
+    KIND_QUAKE: "地震情報",
+    KIND_TSUNAMI: "津波予報",
+}
+HISTORY_PAGE_SIZE = 10
+
+@tree.command(name="history", description="受信した地震情報の履歴を表示します")
+@app_commands.describe(kind="表示する情報の種類", page="ページ番号")
+@app_commands.choices(kind=[app_commands.Choice(name=name, value=kind) for kind, name in HISTORY_KINDS.items()])
+async def history(interaction: discord.Interaction, kind: app_commands.Choice[str] = None, page: app_commands.Range[int, 1] = 1):
+    # 次のページがあるかを調べるため1件多く取得する
+    rows = await event_store.history(kind.value if kind else None, limit=HISTORY_PAGE_SIZE + 1, offset=(page - 1) * HISTORY_PAGE_SIZE)
+    lines = []
+    for row in rows[:HISTORY_PAGE_SIZE]:
+        occurred = row['origin_time'] or datetime.fromtimestamp(row['received_at']).strftime("%Y-%m-%d %H:%M:%S")
+        details = [HISTORY_KINDS[row['kind']]]
+        if row['serial'] is not None:
+            details.append(f"第{row['serial']}報")
+        if row['hypocenter']:
+            details.append(row['hypocenter'])
+        if row['magnitude'] is not None:
+            details.append(f"M{row['magnitude']:.1f}")
+        if row['max_intensity'] is not None:
+            details.append(f"最大震度{intensity.from_scale(row['max_intensity']).label}")
+        lines.append(f"`{occurred}` {' / '.join(details)}")
+    embed = discord.Embed(title="受信履歴", description="\n".join(lines) if lines else "履歴はありません。", color=0x00ff00)
+    footer = f"{page}ページ目"
+    if len(rows) > HISTORY_PAGE_SIZE:
+        footer += f" | 次のページ: /history page:{page + 1}"
+    embed.set_footer(text=footer)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+def speed_embed():
+    result = prober.result
+    if result is not None:
+        description = f"{datetime.fromtimestamp(prober.measured_at).strftime('%Y/%m/%d %H:%M')}に計測"
+    elif prober.running:
+        description = "計測中です"
+    else:
+        description = "まだ計測していません"
+    embed = discord.Embed(title=f"インターネット速度", description=description, color=0x00ff00)
+    embed.add_field(name="サーバー", value=result['server'] if result else "N/A", inline=True)
+    embed.add_field(name="ダウンロード", value=f"{result['download']}Mbps" if result else "N/A", inline=True)
+    embed.add_field(name="アップロード", value=f"{result['upload']}Mbps" if result else "N/A", inline=True)
+    if prober.error:
+        embed.add_field(name="前回の計測", value=f"失敗しました: {prober.error}"[:layout.FIELD_VALUE_LIMIT], inline=False)
+    return embed
 
 @tree.command(name="status", description="BOTのステータスを表示します")
 async def status(interaction: discord.Interaction):
-    await interaction.response.defer()
-
+    # 計測済みの値だけを使い、その場では計測しない
     embed_1 = discord.Embed(title=f"ステータス", description="基本情報", color=0x00ff00)
     embed_1.add_field(name="CPU使用率", value=f"{psutil.cpu_percent()}%", inline=True)
     embed_1.add_field(name="メモリ使用量", value=f"{psutil.virtual_memory().percent}%", inline=True)
     embed_1.add_field(name="Ping", value=f"{round(client.latency * 1000)}ms", inline=True)
-    embed_1.add_field(name="P2PQuake(地震津波情報)", value=status_p2pquake, inline=True)
-    embed_1.add_field(name="Wolfx(緊急地震速報)", value=status_wolfx, inline=True)
-    embed_1.set_footer(text=f"1/2")
-
-    await interaction.followup.send(embed=embed_1)
-
-    speedtest_message = await interaction.followup.send("インターネット速度を計測中です...")
-
-    server_info, download_speed, upload_speed = await run_speedtest()
-
-    embed_2 = discord.Embed(title=f"インターネット速度", description="インターネット情報", color=0x00ff00)
-    embed_2.add_field(name="サーバー", value=server_info, inline=True)
-    embed_2.add_field(name="ダウンロード", value=f"{download_speed}Mbps", inline=True)
-    embed_2.add_field(name="アップロード", value=f"{upload_speed}Mbps", inline=True)
-    embed_2.set_footer(text=f"2/2")
-
-    await speedtest_message.edit(content=None, embed=embed_2)
-
-client.run(os.getenv('TOKEN'))
\ No newline at end of file
+    embed_1.add_field(name="P2PQuake(地震津波情報)", value=p2pquake_feed.status, inline=True)
+    embed_1.add_field(name="Wolfx(緊急地震速報)", value=wolfx_feed.status, inline=True)
+    for feed in (p2pquake_feed, wolfx_feed):
+        feed_stats = feed.stats()
+        uptime = feed_stats['uptime']
+        last_gap = feed_stats['last_gap']
+        rtt = feed_stats['rtt']
+        embed_1.add_field(
+            name=f"{feed.name}接続状況",
+            value=f"稼働率: {f'{uptime * 100:.2f}%' if uptime is not None else 'N/A'} / 再接続: {feed_stats['reconnects']}回 / 直近の切断: {f'{last_gap:.1f}秒' if last_gap is not None else 'なし'} / 不要なフレーム: {feed_stats['skipped']}件 / RTT: {f'{rtt * 1000:.0f}ms' if rtt is not None else 'N/A'}",
+            inline=True
+        )
+    dispatch_stats = dispatcher.stats()
+    p99 = dispatch_stats['p99']
+    embed_1.add_field(name="配信キュー", value=f"{dispatch_stats['queue']}件 (破棄: {dispatch_stats['dropped']}件)", inline=True)
+    embed_1.add_field(name="配信遅延(p99)", value=f"{round(p99 * 1000)}ms" if p99 is not None else "N/A", inline=True)
+    eew_stats = eew_tracker.stats()
+    embed_1.add_field(name="EEW破棄数", value=f"重複: {eew_stats['duplicate']}件 / 古い報: {eew_stats['stale']}件", inline=True)
+    fanout_stats = fanout.stats()
+    embed_1.add_field(name="配信先", value=f"{len(subscriptions.all())}チャンネル (失敗: {fanout_stats['failed']}件 / レート制限待ち: {fanout_stats['rate_limited']}件)", inline=True)
+    if fanout_stats['slowest']:
+        slow_channel_id, slow_p99 = fanout_stats['slowest']
+        embed_1.add_field(name="最も遅い配信先(p99)", value=f"<#{slow_channel_id}> {round(slow_p99 * 1000)}ms", inline=True)
+    webhook_stats = webhooks.stats()
+    if settings.delivery_mode == "Webhook":
+        embed_1.add_field(name="Webhook", value=f"送信: {webhook_stats['sent']}件 / BOTから送信: {webhook_stats['fallback']}件 / 失敗: {webhook_stats['failed']}件", inline=True)
+    updater_stats = eew_updater.stats()
+    if updater_stats['sent']:
+        embed_1.add_field(name="EEWメッセージ", value=f"送信: {updater_stats['sent']}件 / 編集: {updater_stats['edited']}件 / 統合: {updater_stats['coalesced']}件", inline=True)
+    for source, source_stats in eew_correlator.stats().items():
+        lag = source_stats['median_lag']
+        embed_1.add_field(
+            name=f"EEW受信({source})",
+            value=f"先着: {source_stats['first']}件 / 後着: {source_stats['merged']}件 (遅延中央値: {f'{round(lag * 1000)}ms' if lag is not None else 'N/A'})",
+            inline=True
+        )
+    task_stats = supervisor.stats()
+    embed_1.add_field(
+        name="タスク",
+        value=f"稼働中: {sum(entry['running'] for entry in task_stats.values())}件 / 再起動: {sum(entry['restarts'] for entry in task_stats.values())}回",
+        inline=True
+    )
+    if leader_lease is not None:
+        lease_stats = leader_lease.stats()
+        embed_1.add_field(name="冗長化", value=f"リーダー: {leader_lease.instance_id} (引き継ぎ: {lease_stats['elections']}回)", inline=True)
+    presence_stats = presence.stats()
+    embed_1.add_field(name="ステータス更新", value=f"反映: {presence_stats['applied']}件 / 統合: {presence_stats['coalesced']}件 / 省略: {presence_stats['skipped']}件", inline=True)
+    embeds = [embed_1]
+    # SpeedtestInterval=0の場合は計測しないため、インターネット速度は表示しない
+    if prober.interval:
+        embeds.append(speed_embed())
+    for index, embed in enumerate(embeds):
+        embed.set_footer(text=f"{index + 1}/{len(embeds)}")
+
+    await interaction.response.send_message(embeds=embeds)
+
+if __name__ == '__main__':
+    # discord.pyのログも同じ出力にまとめる
+    client.run(settings.token, log_handler=None)
@@ -0,0 +1,297 @@
+import asyncio
+import collections
+import random
+import struct
+import logging
+import time
+from datetime import datetime
+
+import aiohttp
+
+from decode import loads
+from metrics import Histogram, current_trace, new_trace
+
+logger = logging.getLogger(__name__)
+
+
+class P2PQuakeBackfill:
+    # 再接続したときに、切断中に発表された情報を履歴APIから取得する
+    def __init__(self, url, codes=(551, 552, 556), limit=20):
+        self.url = url
+        self.codes = codes
+        self.limit = limit
+        self.last_time = None
+
+    def observe(self, data):
+        frame_time = _parse_p2pquake_time(data.get('time'))
+        if frame_time is not None and (self.last_time is None or frame_time > self.last_time):
+            self.last_time = frame_time
+
+    async def fetch(self, session):
+        if self.last_time is None:
+            return []
+        params = [('codes', code) for code in self.codes] + [('limit', self.limit)]
+        async with session.get(self.url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            response.raise_for_status()
+            history = await response.json()
+        # 同じ時刻に複数の情報が発表されることがあるため、同時刻のものも含める（受信済みのものは呼び出し側で除く）
+        missed = []
+        for data in reversed(history):  # 履歴は新しい順に返ってくるため、古い順に並べ直す
+            frame_time = _parse_p2pquake_time(data.get('time'))
+            if frame_time is not None and frame_time >= self.last_time:
+                missed.append((frame_time, data))
+        missed.sort(key=lambda entry: entry[0])
+        return [data for _, data in missed]
+
+
+def _parse_p2pquake_time(value):
+    try:
+        return datetime.strptime(value, "%Y/%m/%d %H:%M:%S.%f")
+    except (TypeError, ValueError):
+        try:
+            return datetime.strptime(value, "%Y/%m/%d %H:%M:%S")
+        except (TypeError, ValueError):
+            return None
+
+
+def p2pquake_identity(data):
+    return data.get('id') or data.get('_id')
+
+
+def wolfx_identity(data):
+    if data.get('type') == 'jma_eew':
+        return ('jma_eew', data.get('EventID'), data.get('Serial'), data.get('isCancel', False))
+    return None
+
+
+class FeedConnection:
+    # 1つのフィードに対して複数の接続を同時に張り、同じ情報は最初に届いたものだけを処理する
+    def __init__(self, name, on_message, identity=None, connections=1, heartbeat=15.0, idle_timeout=None,
+                 backoff_base=0.5, backoff_max=30.0, backfill=None, recent_size=1000, started_at=None, decode=loads,
+                 rtt_interval=30.0, healthy_after=10.0):
+        self.name = name
+        self.on_message = on_message
+        # 不要なフレームにはNoneを返す関数を渡すと、解析せずに捨てられる
+        self.decode = decode
+        self.identity = identity
+        self.connections = connections
+        self.heartbeat = heartbeat
+        self.rtt_interval = rtt_interval
+        self.rtt = None
+        self.idle_timeout = idle_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # 接続してもすぐに切られる場合は待ち時間を延ばし続け、healthy_after秒以上つながった場合だけ元に戻す
+        self.healthy_after = healthy_after
+        self.backfill = backfill
+        self.recent = collections.OrderedDict()
+        self.recent_size = recent_size
+
+        self.active = 0
+        # プロセスの起動時刻を渡すと、起動から最初のデータを受信するまでの時間を計測できる
+        self.started_at = started_at
+        self.up_since = None
+        self.down_since = None
+        self.uptime_total = 0.0
+        self.reconnects = 0
+        self.last_gap = None
+        self.max_gap = 0.0
+        self.duplicates = 0
+        self.backfilled = 0
+        self.last_frame_at = None
+        self.first_frame = None
+        self.decode_seconds = Histogram()
+        self.log = logging.LoggerAdapter(logger, {"feed": name})
+        self._ever_connected = False
+        self._session = None
+        self._backfill_task = None
+
+    @property
+    def status(self):
+        if self.active:
+            return f"接続しています ({self.active}/{self.connections})" if self.connections > 1 else "接続しています"
+        return "再接続中" if self._ever_connected else "接続していません"
+
+    async def run(self, url):
+        self.started_at = self.started_at or time.monotonic()
+        self.down_since = self.down_since or self.started_at
+        async with aiohttp.ClientSession() as session:
+            self._session = session
+            await asyncio.gather(*(self._listen(session, url, index) for index in range(self.connections)))
+
+    async def _listen(self, session, url, index):
+        log = logging.LoggerAdapter(logger, {"feed": self.name, "connection": index + 1})
+        attempt = 0
+        while True:
+            connected = False
+            connected_at = None
+            try:
+                # 往復時間を計測するためPONGを自分で受け取る（サーバーからのPINGにも自分で応答する）
+                async with session.ws_connect(url, heartbeat=self.heartbeat, autoping=False) as ws:
+                    connected = True
+                    connected_at = time.monotonic()
+                    self._on_connected()
+                    log.info("%sへ接続しました。", url)
+                    rtt_task = asyncio.create_task(self._measure_rtt(ws)) if self.rtt_interval else None
+                    try:
+                        await self._receive(ws, log)
+                    finally:
+                        if rtt_task is not None:
+                            rtt_task.cancel()
+            except asyncio.TimeoutError as e:
+                # aiohttpの接続時のタイムアウト（ServerTimeoutError）もここで受け取る
+                if connected and self.idle_timeout is not None:
+                    log.warning("%s秒間データを受信しなかったため再接続します。", self.idle_timeout)
+                else:
+                    log.warning("接続がタイムアウトしました。再接続します: %s", e)
+            except aiohttp.ClientError as e:
+                log.warning("WebSocket接続エラー: %s", e)
+            except ConnectionResetError:
+                log.warning("接続がリセットされました。再接続します。")
+            except Exception as e:
+                log.exception("予期しないエラーが発生しました: %s", e)
+            finally:
+                if connected:
+                    self._on_disconnected()
+            if connected_at is not None and time.monotonic() - connected_at >= self.healthy_after:
+                attempt = 0
+
+            # 1回目も短く待ち、以降は指数的に待ち時間を延ばす（ジッター付き）
+            delay = self._backoff(attempt)
+            attempt += 1
+            log.info("%.1f秒後に再接続を試みます... (試行回数: %d)", delay, attempt)
+            await asyncio.sleep(delay)
+
+    async def _receive(self, ws, log):
+        while True:
+            msg = await ws.receive(timeout=self.idle_timeout)
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                self._handle(msg.data)
+            elif msg.type == aiohttp.WSMsgType.PING:
+                await ws.pong(msg.data)
+            elif msg.type == aiohttp.WSMsgType.PONG:
+                # ハートビートのPING（空）への応答は無視する
+                if len(msg.data) == 8:
+                    self.rtt = (time.perf_counter_ns() - struct.unpack('!q', msg.data)[0]) / 1e9
+            elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.CLOSED):
+                log.warning("サーバーによって接続が閉じられました。再接続します。")
+                return
+            elif msg.type == aiohttp.WSMsgType.ERROR:
+                log.warning("WebSocketエラーが発生しました。再接続します。")
+                return
+
+    async def _measure_rtt(self, ws):
+        while not ws.closed:
+            try:
+                await ws.ping(struct.pack('!q', time.perf_counter_ns()))
+            except (ConnectionResetError, aiohttp.ClientError):
+                return
+            await asyncio.sleep(self.rtt_interval)
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    def _handle(self, text):
+        self.last_frame_at = time.monotonic()
+        if self.first_frame is None:
+            self.first_frame = self.last_frame_at - self.started_at
+            self.log.info("起動から%.2f秒で最初のデータを受信しました。", self.first_frame)
+        started_at = time.perf_counter()
+        try:
+            data = self.decode(text)
+        except ValueError as e:
+            self.log.warning("JSONの解析に失敗しました: %s", e)
+            return
+        finally:
+            self.decode_seconds.observe(time.perf_counter() - started_at, feed=self.name)
+        if data is not None:
+            self._deliver(data, self.last_frame_at)
+
+    def _deliver(self, data, received_at=None):
+        key = self.identity(data) if self.identity else None
+        if key is not None:
+            if key in self.recent:
+                self.duplicates += 1
+                return
+            self.recent[key] = None
+            if len(self.recent) > self.recent_size:
+                self.recent.popitem(last=False)
+        if self.backfill is not None:
+            self.backfill.observe(data)
+        # 受信したフレームごとにトレースIDを付け、配信キューを経てDiscordへの送信まで引き継ぐ
+        trace = new_trace(self.name, received_at)
+        token = current_trace.set(trace)
+        try:
+            if key is not None:
+                self.log.info("%sを受信しました。", key)
+            self.on_message(data)
+        finally:
+            current_trace.reset(token)
+
+    def warm(self, frames):
+        # 保存済みの情報を受信済みとして扱い、再起動後に同じ情報を再送しないようにする
+        for data in frames:
+            key = self.identity(data) if self.identity else None
+            if key is not None:
+                self.recent[key] = None
+            if self.backfill is not None:
+                self.backfill.observe(data)
+        while len(self.recent) > self.recent_size:
+            self.recent.popitem(last=False)
+
+    def _on_connected(self):
+        now = time.monotonic()
+        self.active += 1
+        if self.active == 1:
+            if self._ever_connected:
+                self.reconnects += 1
+                self.last_gap = now - self.down_since
+                self.max_gap = max(self.max_gap, self.last_gap)
+                if self.backfill is not None:
+                    self._backfill_task = asyncio.create_task(self._run_backfill())
+            self._ever_connected = True
+            self.up_since = now
+            self.down_since = None
+
+    def _on_disconnected(self):
+        now = time.monotonic()
+        self.active -= 1
+        if self.active == 0:
+            self.uptime_total += now - self.up_since
+            self.up_since = None
+            self.down_since = now
+
+    async def _run_backfill(self):
+        try:
+            missed = await self.backfill.fetch(self._session)
+        except Exception as e:
+            self.log.warning("履歴の取得に失敗しました: %s", e)
+            return
+        count = 0
+        for data in missed:
+            before = self.duplicates
+            self._deliver(data)
+            if self.duplicates == before:
+                count += 1
+        self.backfilled += count
+        if count:
+            self.log.info("切断中の情報を%d件取得しました。", count)
+
+    def stats(self):
+        now = time.monotonic()
+        uptime = self.uptime_total + (now - self.up_since if self.up_since is not None else 0)
+        elapsed = now - self.started_at if self.started_at is not None else 0
+        return {
+            "active": self.active,
+            "uptime": uptime / elapsed if elapsed else None,
+            "reconnects": self.reconnects,
+            "last_gap": self.last_gap,
+            "max_gap": self.max_gap,
+            "duplicates": self.duplicates,
+            "skipped": getattr(self.decode, 'skipped', 0),
+            "backfilled": self.backfilled,
+            "first_frame": self.first_frame,
+            "rtt": self.rtt,
+            "last_frame_age": now - self.last_frame_at if self.last_frame_at is not None else None,
+        }
@@ -0,0 +1,48 @@
+import collections
+import json
+import re
+
+# orjsonがインストールされていれば使い、なければ標準ライブラリを使う
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+loads = orjson.loads if orjson is not None else json.loads
+BACKEND = "orjson" if orjson is not None else "json"
+
+# 種類を示すキーはフレームの先頭付近にあるため、先頭だけを見る
+PEEK_LENGTH = 256
+_P2PQUAKE_CODE = re.compile(r'"code"\s*:\s*(\d+)')
+_WOLFX_TYPE = re.compile(r'"type"\s*:\s*"([^"]*)"')
+
+
+class FrameDecoder:
+    # 全体を解析する前に種類だけを調べ、不要なフレームは解析せずに捨てる
+    # 種類が見つからない場合は念のため全体を解析する
+    def __init__(self, pattern, wanted, convert=str, loads=loads):
+        self.pattern = pattern
+        self.wanted = frozenset(wanted)
+        self.convert = convert
+        self.loads = loads
+        self.decoded = 0
+        self.skipped = 0
+        self.received = collections.Counter()
+
+    def __call__(self, text):
+        match = self.pattern.search(text, 0, PEEK_LENGTH)
+        kind = self.convert(match.group(1)) if match is not None else None
+        self.received[kind if kind is not None else "unknown"] += 1
+        if kind is not None and kind not in self.wanted:
+            self.skipped += 1
+            return None
+        self.decoded += 1
+        return self.loads(text)
+
+
+def p2pquake_decoder(codes=(551, 552, 556), loads=loads):
+    return FrameDecoder(_P2PQUAKE_CODE, codes, int, loads)
+
+
+def wolfx_decoder(types=("jma_eew",), loads=loads):
+    return FrameDecoder(_WOLFX_TYPE, types, str, loads)
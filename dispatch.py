@@ -0,0 +1,115 @@
+import asyncio
+import collections
+import contextvars
+import itertools
+import logging
+import time
+
+from metrics import Histogram, current_trace
+
+logger = logging.getLogger(__name__)
+
+# 数値が小さいほど優先
+PRIORITY_EEW = 0
+PRIORITY_TSUNAMI = 1
+PRIORITY_INFO = 2
+
+# 処理中の情報（送信が終わった時点で配信済みとして記録するために使う）
+current_item = contextvars.ContextVar("current_item", default=None)
+
+
+class Dispatcher:
+    def __init__(self, workers=4, maxsize=1000, latency_window=1000):
+        self.workers = workers
+        self.queue = asyncio.PriorityQueue(maxsize)
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.wait_seconds = Histogram()
+        self.handler_seconds = Histogram()
+        # 処理する直前に呼び、Falseを返した情報は処理しない（冗長化している場合に、リーダーでなくなった後の情報を待機中のバッファに戻す）
+        self.gate = None
+        self.deferred = 0
+        self._seq = itertools.count()
+        self._locks = {}
+        self._tasks = []
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, priority, handler, data, key=None, received_at=None):
+        # keyが同じものは受信順に1つずつ処理する
+        item = (priority, next(self._seq), received_at or time.monotonic(), key, handler, data, current_trace.get())
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("配信キューが満杯のため破棄しました: %s", getattr(handler, '__name__', handler), extra={"dropped": self.dropped})
+            return False
+        return True
+
+    async def _worker(self, index):
+        while True:
+            priority, _, received_at, key, handler, data, trace = await self.queue.get()
+            dequeued_at = time.monotonic()
+            name = getattr(handler, '__name__', str(handler))
+            token = current_trace.set(trace)
+            item_token = current_item.set(data)
+            try:
+                if key is None:
+                    await self._handle(priority, handler, data, key, received_at)
+                else:
+                    lock = self._locks.setdefault(key, asyncio.Lock())
+                    async with lock:
+                        await self._handle(priority, handler, data, key, received_at)
+            except Exception as e:
+                self.failed += 1
+                logger.exception("配信ワーカー%d: 処理中にエラーが発生しました: %s", index, e)
+            finally:
+                current_item.reset(item_token)
+                current_trace.reset(token)
+                self.queue.task_done()
+            total = time.monotonic() - received_at
+            self.latencies.append(total)
+            self.wait_seconds.observe(dequeued_at - received_at, handler=name)
+            self.handler_seconds.observe(total - (dequeued_at - received_at), handler=name)
+            logger.debug(
+                "配信ワーカー%d: %s (待機 %.0fms, 合計 %.0fms, キュー %d)",
+                index, name, (dequeued_at - received_at) * 1000, total * 1000, self.queue.qsize(),
+                extra={"trace": trace.id if trace else None}
+            )
+
+    async def _handle(self, priority, handler, data, key, received_at):
+        # 同じkeyの処理を待っている間に状況が変わることがあるため、ロックを取ってから判定する
+        if self.gate is not None and not self.gate(priority, handler, data, key, received_at):
+            self.deferred += 1
+            return
+        await handler(data)
+        self.processed += 1
+
+    def latency_percentile(self, percentile):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+    def stats(self):
+        return {
+            "queue": self.queue.qsize(),
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "deferred": self.deferred,
+            "p50": self.latency_percentile(50),
+            "p99": self.latency_percentile(99),
+        }
@@ -0,0 +1,198 @@
+import collections
+import math
+import time
+
+
+class EEWTracker:
+    # EventIDごとに最新の報数だけを覚えておき、重複・古い報・順序の入れ替わった報を捨てる
+    def __init__(self, ttl=600, idle_ttl=3600, clock=time.monotonic):
+        self.ttl = ttl
+        # 期限切れの判定に使う時計（試験では再生中の時刻に差し替える）
+        self.clock = clock
+        self.idle_ttl = idle_ttl
+        self.events = {}
+        self.accepted = 0
+        self.dropped_duplicate = 0
+        self.dropped_stale = 0
+
+    def accept(self, event_id, serial, closed=False, now=None):
+        now = self.clock() if now is None else now
+        self.evict(now)
+        if event_id is None or not isinstance(serial, int):
+            self.accepted += 1
+            return True
+
+        state = self.events.get(event_id)
+        if state is not None:
+            latest, _, closed_at = state
+            # 同じ報数で取消・最終報が発表されることがあるため、まだ終わっていなければ受け付ける
+            if serial == latest and not (closed and closed_at is None):
+                self.dropped_duplicate += 1
+                return False
+            if serial < latest:
+                self.dropped_stale += 1
+                return False
+            if closed_at is not None and not closed:
+                closed = True
+        self.events[event_id] = (serial, now, now if closed else None)
+        self.accepted += 1
+        return True
+
+    def accept_event(self, event, now=None):
+        return self.accept(event.event_id, event.serial, event.closed, now)
+
+    def warm(self, event_id, serial, closed=False, now=None):
+        # 保存済みの報数を読み込み、再起動後に同じ報を再送しないようにする
+        now = self.clock() if now is None else now
+        state = self.events.get(event_id)
+        if state is None or serial > state[0] or (serial == state[0] and closed and state[2] is None):
+            self.events[event_id] = (serial, now, now if closed else None)
+
+    def latest_serial(self, event_id):
+        state = self.events.get(event_id)
+        return state[0] if state else None
+
+    def evict(self, now=None):
+        now = self.clock() if now is None else now
+        expired = [
+            event_id for event_id, (_, last_seen, closed_at) in self.events.items()
+            if (closed_at is not None and now - closed_at > self.ttl) or now - last_seen > self.idle_ttl
+        ]
+        for event_id in expired:
+            del self.events[event_id]
+
+    def stats(self):
+        return {
+            "events": len(self.events),
+            "accepted": self.accepted,
+            "duplicate": self.dropped_duplicate,
+            "stale": self.dropped_stale,
+        }
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371 * 2 * math.asin(math.sqrt(a))
+
+
+class _Cluster:
+    __slots__ = ("event_ids", "serial", "origin_time", "latitude", "longitude", "magnitude", "first_source", "last_seen", "arrivals")
+
+    def __init__(self, now):
+        self.event_ids = set()
+        self.serial = None
+        self.origin_time = None
+        self.latitude = None
+        self.longitude = None
+        self.magnitude = None
+        self.first_source = None
+        self.last_seen = now
+        # 報数ごとに最初に届いたソースと時刻
+        self.arrivals = {}
+
+
+class EEWCorrelator:
+    # WolfxとP2PQuake(556)の緊急地震速報を同じ地震として突き合わせ、先に届いた方だけを配信する
+    def __init__(self, window=600, time_tolerance=5, distance_tolerance=100, magnitude_tolerance=1.0, lag_window=200, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.time_tolerance = time_tolerance
+        self.distance_tolerance = distance_tolerance
+        self.magnitude_tolerance = magnitude_tolerance
+        self.clusters = []
+        self.published = collections.Counter()
+        self.first = collections.Counter()
+        self.merged = collections.Counter()
+        self.lags = collections.defaultdict(lambda: collections.deque(maxlen=lag_window))
+
+    def accept(self, source, event_id=None, serial=None, origin_time=None, latitude=None, longitude=None, magnitude=None, now=None):
+        now = self.clock() if now is None else now
+        self.clusters = [c for c in self.clusters if now - c.last_seen <= self.window]
+
+        cluster = self._find(event_id, origin_time, latitude, longitude, magnitude)
+        if cluster is None:
+            cluster = _Cluster(now)
+            self.clusters.append(cluster)
+        cluster.last_seen = now
+        if event_id is not None:
+            cluster.event_ids.add(event_id)
+        if origin_time is not None:
+            cluster.origin_time = origin_time
+        if latitude is not None and longitude is not None:
+            cluster.latitude, cluster.longitude = latitude, longitude
+        if magnitude is not None:
+            cluster.magnitude = magnitude
+
+        # 報数が分からない場合は、ソースごとに最初の1件を同じ報として扱う
+        key = serial if isinstance(serial, int) else None
+        first = cluster.arrivals.get(key)
+        if first is not None:
+            first_source, first_time = first
+            if first_source != source:
+                self.merged[source] += 1
+                self.lags[source].append(now - first_time)
+                return False
+            if key is None:
+                return False
+        if key is not None and cluster.serial is not None and key < cluster.serial:
+            self.merged[source] += 1
+            return False
+
+        cluster.arrivals[key] = (source, now)
+        if key is not None:
+            cluster.serial = key
+        if cluster.first_source is None:
+            cluster.first_source = source
+            self.first[source] += 1
+        self.published[source] += 1
+        return True
+
+    def accept_event(self, event, now=None):
+        # 不明な値は正規化の段階でNoneになっている
+        return self.accept(
+            event.source,
+            event_id=event.event_id,
+            serial=event.serial,
+            origin_time=event.origin_time,
+            latitude=event.latitude,
+            longitude=event.longitude,
+            magnitude=event.magnitude,
+            now=now
+        )
+
+    def _find(self, event_id, origin_time, latitude, longitude, magnitude):
+        for cluster in self.clusters:
+            if event_id is not None and event_id in cluster.event_ids:
+                return cluster
+        if origin_time is None:
+            return None
+        for cluster in self.clusters:
+            if cluster.origin_time is None:
+                continue
+            # 両方にイベントIDがあって一致しない場合は別の地震
+            if event_id is not None and cluster.event_ids and event_id not in cluster.event_ids:
+                continue
+            if abs((cluster.origin_time - origin_time).total_seconds()) > self.time_tolerance:
+                continue
+            if None not in (latitude, longitude, cluster.latitude, cluster.longitude):
+                if distance_km(latitude, longitude, cluster.latitude, cluster.longitude) > self.distance_tolerance:
+                    continue
+            if magnitude is not None and cluster.magnitude is not None:
+                if abs(magnitude - cluster.magnitude) > self.magnitude_tolerance:
+                    continue
+            return cluster
+        return None
+
+    def stats(self):
+        result = {}
+        for source in set(self.published) | set(self.merged):
+            lags = sorted(self.lags[source])
+            result[source] = {
+                "first": self.first[source],
+                "published": self.published[source],
+                "merged": self.merged[source],
+                "median_lag": lags[len(lags) // 2] if lags else None,
+            }
+        return result
+
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+
+import discord
+
+from metrics import current_trace, record_delivery
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("message", "filename", "pending", "task", "updated_at")
+
+    def __init__(self):
+        self.message = None
+        self.filename = None
+        self.pending = None
+        self.task = None
+        self.updated_at = 0
+
+
+class EEWMessageUpdater:
+    # 1つの地震につき最初の報だけを送信し、以降の報はそのメッセージを編集する
+    # 編集中に新しい報が届いた場合は、最新の内容だけを反映する
+    def __init__(self, ttl=600, label="緊急地震速報", clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.label = label
+        self.entries = {}
+        self.sent = 0
+        self.edited = 0
+        self.coalesced = 0
+        self._deleting = set()
+
+    def update(self, key, send, embeds, file=None, silent=False, on_sent=None):
+        # on_sentは送信・編集が成功した後に呼ぶ（最新の報にまとめられた報は、その報が成功した時点で呼ぶ）
+        now = self.clock()
+        self._evict(now)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = _Entry()
+        entry.updated_at = now
+        callbacks = [on_sent] if on_sent is not None else []
+        if entry.pending is not None:
+            self.coalesced += 1
+            _close(entry.pending[2])
+            callbacks = entry.pending[5] + callbacks
+        entry.pending = (send, embeds, file, silent, current_trace.get(), callbacks)
+        if entry.task is None or entry.task.done():
+            entry.task = asyncio.create_task(self._drain(entry))
+        return entry.task
+
+    def discard(self, key):
+        # 不要になったメッセージ（減った続きのメッセージなど）は、送信・編集が終わってから削除する
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        if entry.pending is not None:
+            _close(entry.pending[2])
+            entry.pending = None
+        task = asyncio.create_task(self._delete(entry))
+        self._deleting.add(task)
+        task.add_done_callback(self._deleting.discard)
+        return True
+
+    async def _delete(self, entry):
+        if entry.task is not None:
+            await asyncio.wait([entry.task])
+        if entry.message is None:
+            return
+        try:
+            await entry.message.delete()
+        except discord.HTTPException as e:
+            logger.warning("%sのメッセージの削除に失敗しました: %s", self.label, e)
+
+    async def _drain(self, entry):
+        while entry.pending is not None:
+            send, embeds, file, silent, trace, callbacks = entry.pending
+            entry.pending = None
+            # まとめられた場合は最新の報のトレースIDで記録する
+            current_trace.set(trace)
+            try:
+                if entry.message is not None:
+                    try:
+                        await self._edit(entry, embeds, file)
+                        record_delivery(entry.message, "編集")
+                        _notify(callbacks)
+                        continue
+                    except discord.NotFound:
+                        entry.message = None
+                entry.message = await send(embeds=embeds, file=file, silent=silent)
+                entry.filename = file.filename if file else None
+                self.sent += 1
+                _notify(callbacks)
+            except Exception as e:
+                logger.exception("%sの送信・編集に失敗しました: %s", self.label, e)
+
+    async def _edit(self, entry, embeds, file):
+        if file is None:
+            await entry.message.edit(embeds=embeds, attachments=[])
+            entry.filename = None
+        elif file.filename == entry.filename:
+            # 同じ画像であれば再アップロードしない
+            await entry.message.edit(embeds=embeds)
+            _close(file)
+        else:
+            await entry.message.edit(embeds=embeds, attachments=[file])
+            entry.filename = file.filename
+        self.edited += 1
+
+    def _evict(self, now):
+        expired = [
+            key for key, entry in self.entries.items()
+            if now - entry.updated_at > self.ttl and (entry.task is None or entry.task.done())
+        ]
+        for key in expired:
+            del self.entries[key]
+
+    def stats(self):
+        return {
+            "events": len(self.entries),
+            "sent": self.sent,
+            "edited": self.edited,
+            "coalesced": self.coalesced,
+        }
+
+
+def _close(file):
+    if file is not None:
+        file.close()
+
+
+def _notify(callbacks):
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.exception("送信後の処理に失敗しました: %s", e)
@@ -0,0 +1,106 @@
+import csv
+import os
+from typing import NamedTuple
+
+import numpy as np
+
+import intensity
+
+AREA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "eew_areas.csv")
+
+EARTH_RADIUS = 6371.0
+# 到達時間は簡易的に平均の速度（km/秒）で計算する
+P_VELOCITY = 7.0
+S_VELOCITY = 4.0
+# 工学的基盤（Vs=600m/s）から地表への増幅率（AVS30=400m/sとした場合）
+SITE_AMPLIFICATION = 10 ** (1.83 - 0.66 * np.log10(400))
+# 計測震度から震度階級への境界（0.5未満は震度0）
+_INTENSITY_BOUNDS = np.array([0.5, 1.5, 2.5, 3.5, 4.5, 5.0, 5.5, 6.0, 6.5])
+
+
+class AreaEstimate(NamedTuple):
+    name: str
+    pref: str
+    level: intensity.Intensity
+    value: float
+    p_seconds: float
+    s_seconds: float
+
+    @property
+    def search_name(self):
+        # 地域名に都道府県名が含まれない地域（北海道、東京都の島しょ部）も都道府県名で絞り込めるようにする
+        return self.name if self.name.startswith(self.pref) else f"{self.pref}{self.name}"
+
+
+class Estimate:
+    def __init__(self, names, prefs, values, ranks, p_seconds, s_seconds):
+        self.names = names
+        self.prefs = prefs
+        self.values = values
+        self.ranks = ranks
+        self.p_seconds = p_seconds
+        self.s_seconds = s_seconds
+
+    @property
+    def max_level(self):
+        rank = int(self.ranks.max()) if len(self.ranks) else 0
+        return intensity.SCALES[rank - 1] if rank else intensity.UNKNOWN
+
+    def areas(self, min_rank=1, limit=None):
+        # 推定震度の大きい順（同じ場合は主要動の到達が早い順）に返す
+        indexes = np.flatnonzero(self.ranks >= min_rank)
+        indexes = indexes[np.lexsort((self.s_seconds[indexes], -self.values[indexes]))]
+        if limit is not None:
+            indexes = indexes[:limit]
+        return [
+            AreaEstimate(
+                self.names[i], self.prefs[i], intensity.SCALES[self.ranks[i] - 1],
+                float(self.values[i]), float(self.p_seconds[i]), float(self.s_seconds[i])
+            )
+            for i in indexes.tolist()
+        ]
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class AreaEstimator:
+    # 震源とマグニチュードから、全ての地域の推定震度と到達時間をまとめて計算する
+    # 距離減衰式は司・翠川(1999)、計測震度への換算は藤本・翠川(2005)による
+    def __init__(self, path=AREA_FILE):
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.names = [row['name'] for row in rows]
+        self.prefs = [row['pref'] for row in rows]
+        self.latitudes = np.radians([float(row['latitude']) for row in rows])
+        self.longitudes = np.radians([float(row['longitude']) for row in rows])
+        self._cos_latitudes = np.cos(self.latitudes)
+
+    def __len__(self):
+        return len(self.names)
+
+    def estimate(self, latitude, longitude, depth, magnitude):
+        latitude, longitude, depth, magnitude = map(_number, (latitude, longitude, depth, magnitude))
+        if None in (latitude, longitude, depth, magnitude):
+            return None
+        latitude, longitude = np.radians(latitude), np.radians(longitude)
+        # 震央距離（ハバーサイン公式）と震源距離
+        a = (np.sin((self.latitudes - latitude) / 2) ** 2
+             + np.cos(latitude) * self._cos_latitudes * np.sin((self.longitudes - longitude) / 2) ** 2)
+        epicentral = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+        hypocentral = np.hypot(epicentral, depth)
+
+        # 気象庁マグニチュードをモーメントマグニチュードに換算し、式の適用範囲に収める
+        mw = min(magnitude - 0.171, 8.3)
+        # 断層面からの最短距離は、震源距離から断層の長さの半分を引いて近似する
+        fault_half_length = 10 ** (0.5 * mw - 1.85) / 2
+        distance = np.maximum(hypocentral - fault_half_length, 3.0)
+        log_pgv = (0.58 * mw + 0.0038 * min(depth, 300.0) - 1.29
+                   - np.log10(distance + 0.0028 * 10 ** (0.5 * mw)) - 0.002 * distance)
+        values = 2.165 + 2.262 * (log_pgv + np.log10(SITE_AMPLIFICATION))
+        ranks = np.searchsorted(_INTENSITY_BOUNDS, values, side='right')
+        return Estimate(self.names, self.prefs, values, ranks, hypocentral / P_VELOCITY, hypocentral / S_VELOCITY)
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    frame_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    event_id TEXT,
+    serial INTEGER,
+    closed INTEGER NOT NULL DEFAULT 0,
+    origin_time TEXT,
+    hypocenter TEXT,
+    magnitude REAL,
+    max_intensity INTEGER,
+    received_at REAL NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (source, frame_id)
+);
+CREATE INDEX IF NOT EXISTS events_event ON events (source, event_id, serial);
+CREATE INDEX IF NOT EXISTS events_origin_time ON events (origin_time);
+CREATE INDEX IF NOT EXISTS events_hypocenter ON events (hypocenter);
+CREATE INDEX IF NOT EXISTS events_max_intensity ON events (max_intensity);
+CREATE INDEX IF NOT EXISTS events_received_at ON events (received_at);
+"""
+
+_COLUMNS = ("source", "frame_id", "kind", "event_id", "serial", "closed", "origin_time", "hypocenter", "magnitude", "max_intensity", "received_at", "data")
+
+
+def _row(event, received_at):
+    level = event.max_intensity
+    return (
+        event.source, event.frame_id or f"{event.kind}:{received_at}", event.kind, event.event_id, event.serial, int(event.closed),
+        event.origin_time.isoformat(' ') if event.origin_time is not None else None,
+        event.hypocenter, event.magnitude, level.scale if level.rank else None, received_at,
+    )
+
+
+class EventStore:
+    # 受信した情報をSQLite（WALモード）に保存する
+    # 書き込みはまとめて専用のスレッドで行い、イベントループを止めない
+    def __init__(self, path, retention_days=30, max_rows=100000, batch_size=200, flush_interval=1.0):
+        self.path = path
+        self.retention = retention_days * 24 * 60 * 60
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.written = 0
+        self.failed = 0
+        self.pruned = 0
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="event_store")
+        self._wake = None
+
+    def open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        return self
+
+    def record(self, event, received_at=None):
+        # 受信処理からは正規化済みのイベントを積むだけにして、JSONへの変換と書き込みはrun()に任せる
+        received_at = time.time() if received_at is None else received_at
+        self.pending.append((_row(event, received_at), event.raw))
+        if self._wake is not None and len(self.pending) >= self.batch_size:
+            self._wake.set()
+
+    async def run(self, prune_interval=60 * 60):
+        self._wake = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        last_pruned = 0
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                await self.flush()
+                if time.monotonic() - last_pruned > prune_interval:
+                    last_pruned = time.monotonic()
+                    self.pruned += await loop.run_in_executor(self._executor, self._prune, time.time())
+        finally:
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write, rows)
+            self.written += len(rows)
+        except sqlite3.Error as e:
+            self.failed += len(rows)
+            logger.error("受信履歴の保存に失敗しました: %s", e)
+
+    def _write(self, entries):
+        rows = [row + (json.dumps(raw, ensure_ascii=False),) for row, raw in entries]
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT OR IGNORE INTO events ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                rows
+            )
+
+    def _prune(self, now):
+        with self._conn:
+            removed = self._conn.execute("DELETE FROM events WHERE received_at < ?", (now - self.retention,)).rowcount
+            removed += self._conn.execute(
+                "DELETE FROM events WHERE id <= (SELECT id FROM events ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (self.max_rows,)
+            ).rowcount
+        return removed
+
+    async def history(self, kind=None, limit=10, offset=0):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._history, kind, limit, offset)
+
+    def _history(self, kind, limit, offset):
+        # 緊急地震速報は地震ごとに最新の報だけを返す
+        rows = self._conn.execute(
+            """
+            SELECT kind, event_id, serial, closed, origin_time, hypocenter, magnitude, max_intensity, received_at
+            FROM events AS e
+            WHERE (:kind IS NULL OR kind = :kind)
+              AND (event_id IS NULL OR serial IS NULL OR serial = (
+                  SELECT MAX(serial) FROM events WHERE source = e.source AND event_id = e.event_id
+              ))
+            ORDER BY COALESCE(origin_time, datetime(received_at, 'unixepoch', 'localtime')) DESC, id DESC
+            LIMIT :limit OFFSET :offset
+            """,
+            {"kind": kind, "limit": limit, "offset": offset}
+        ).fetchall()
+        keys = ("kind", "event_id", "serial", "closed", "origin_time", "hypocenter", "magnitude", "max_intensity", "received_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    # 以下は起動時（イベントループの開始前）に受信済みの状態を復元するためのもの
+    def latest_serials(self, since):
+        rows = self._conn.execute(
+            "SELECT event_id, MAX(serial), MAX(closed) FROM events WHERE source = 'wolfx' AND received_at >= ? AND event_id IS NOT NULL GROUP BY event_id",
+            (since,)
+        ).fetchall()
+        return [(event_id, serial, bool(closed)) for event_id, serial, closed in rows]
+
+    def recent_frames(self, source, limit):
+        rows = self._conn.execute(
+            "SELECT data FROM events WHERE source = ? ORDER BY id DESC LIMIT ?",
+            (source, limit)
+        ).fetchall()
+        return [json.loads(data) for data, in reversed(rows)]
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "written": self.written,
+            "failed": self.failed,
+            "pruned": self.pruned,
+        }
@@ -0,0 +1,420 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import NamedTuple
+
+import intensity
+
+KIND_EEW = "eew"            # Wolfxの緊急地震速報
+KIND_QUAKE = "quake"        # P2PQuake 551 地震情報
+KIND_TSUNAMI = "tsunami"    # P2PQuake 552 津波予報
+KIND_P2P_EEW = "p2p_eew"    # P2PQuake 556 緊急地震速報（警報）
+
+TIME_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+
+def parse_time(value, fmt=TIME_FORMAT):
+    # 「2024/01/01 16:10:00」の形式はfromisoformatで読めるため、strptimeより速く解析できる
+    if not isinstance(value, str):
+        return None
+    if fmt == TIME_FORMAT and len(value) == 19:
+        try:
+            return datetime.fromisoformat(value.replace('/', '-'))
+        except ValueError:
+            pass
+    try:
+        return datetime.strptime(value, fmt)
+    except ValueError:
+        return None
+
+
+def format_time(value, fmt):
+    return value.strftime(fmt) if value is not None else '不明'
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class cached:
+    # __slots__のあるクラスではfunctools.cached_propertyが使えないため、結果は_cacheに保存する
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            return instance._cache[self.name]
+        except KeyError:
+            value = instance._cache[self.name] = self.func(instance)
+            return value
+
+
+def _cache():
+    return field(default_factory=dict, init=False, repr=False, compare=False)
+
+
+def _raw():
+    # 保存用に受信したデータをそのまま持っておく
+    return field(default=None, repr=False, compare=False)
+
+
+# 地域や観測点は1つのフレームに数百件含まれることがあるため、作成の速いNamedTupleにする
+class WarnArea(NamedTuple):
+    name: str
+    level: intensity.Intensity
+    arrival_time: datetime
+    arrive: str
+
+
+@dataclass(frozen=True, slots=True)
+class WolfxEEW:
+    event_id: str
+    serial: int
+    is_warn: bool
+    is_final: bool
+    is_cancel: bool
+    is_assumption: bool
+    origin_time: datetime
+    hypocenter: str
+    latitude: float
+    longitude: float
+    depth: int
+    magnitude: float
+    max_intensity: intensity.Intensity
+    intensity_label: str
+    accuracy: tuple
+    warn_areas: tuple
+    raw: dict = _raw()
+    _cache: dict = _cache()
+
+    source = "wolfx"
+    kind = KIND_EEW
+
+    @property
+    def closed(self):
+        return self.is_final or self.is_cancel
+
+    @property
+    def frame_id(self):
+        return f"{self.event_id}:{self.serial}:{int(self.is_cancel)}"
+
+    @cached
+    def magnitude_text(self):
+        return f"{self.magnitude:.1f}" if self.magnitude is not None else '不明'
+
+    @cached
+    def origin_time_text(self):
+        return format_time(self.origin_time, "%d日%H時%M分")
+
+    @cached
+    def warn_area_lines(self):
+        return [
+            f"地域: {area.name}\n予想震度: {area.level.label}\n到達時間: {format_time(area.arrival_time, '%H時%M分%S秒')}\n状況: {area.arrive}"
+            for area in self.warn_areas
+        ]
+
+    @cached
+    def areas(self):
+        # 配信先の地域で絞り込むための名前
+        return (self.hypocenter, *(area.name for area in self.warn_areas))
+
+
+class EEWArea(NamedTuple):
+    name: str
+    arrival_time: datetime
+
+
+@dataclass(frozen=True, slots=True)
+class P2PQuakeEEW:
+    frame_id: str
+    event_id: str
+    serial: int
+    cancelled: bool
+    origin_time: datetime
+    hypocenter: str
+    latitude: float
+    longitude: float
+    depth: int
+    magnitude: float
+    condition: str
+    max_intensity: intensity.Intensity
+    warn_areas: tuple
+    raw: dict = _raw()
+    _cache: dict = _cache()
+
+    source = "p2pquake"
+    kind = KIND_P2P_EEW
+
+    @property
+    def closed(self):
+        return self.cancelled
+
+    @cached
+    def magnitude_text(self):
+        return f"{self.magnitude:.1f}" if self.magnitude is not None else '不明'
+
+    @cached
+    def origin_time_text(self):
+        return format_time(self.origin_time, "%d日%H時%M分%S秒")
+
+    @cached
+    def warn_area_lines(self):
+        return [f"{area.name}（{format_time(area.arrival_time, '%H時%M分%S秒')}）" for area in self.warn_areas]
+
+    @cached
+    def areas(self):
+        return (self.hypocenter, *(area.name for area in self.warn_areas))
+
+
+class Point(NamedTuple):
+    pref: str
+    addr: str
+    level: intensity.Intensity
+
+
+@dataclass(frozen=True, slots=True)
+class QuakeInfo:
+    frame_id: str
+    event_id: str
+    issue_type: str
+    issue_source: str
+    origin_time: datetime
+    hypocenter: str
+    latitude: float
+    longitude: float
+    magnitude: float
+    depth: int
+    max_intensity: intensity.Intensity
+    domestic_tsunami: str
+    comments: str
+    points: tuple
+    raw: dict = _raw()
+    _cache: dict = _cache()
+
+    source = "p2pquake"
+    kind = KIND_QUAKE
+    serial = None
+    closed = False
+
+    @cached
+    def magnitude_text(self):
+        return f"{self.magnitude:.1f}" if self.magnitude is not None else '不明'
+
+    @cached
+    def depth_text(self):
+        if self.depth is None:
+            return '不明'
+        return "ごく浅い" if self.depth == 0 else f"{self.depth}km"
+
+    @cached
+    def origin_time_text(self):
+        return format_time(self.origin_time, "%d日%H時%M分")
+
+    @cached
+    def areas(self):
+        return (self.hypocenter, *{name for point in self.points for name in (point.pref, point.addr)})
+
+
+class TsunamiArea(NamedTuple):
+    name: str
+    grade: str
+    immediate: bool
+    arrival_time: datetime
+    condition: str
+    height: str
+    height_value: float
+
+
+@dataclass(frozen=True, slots=True)
+class TsunamiInfo:
+    frame_id: str
+    issue_type: str
+    issue_source: str
+    issue_time: datetime
+    cancelled: bool
+    tsunami_areas: tuple
+    raw: dict = _raw()
+    _cache: dict = _cache()
+
+    source = "p2pquake"
+    kind = KIND_TSUNAMI
+    event_id = None
+    serial = None
+    hypocenter = None
+    magnitude = None
+    max_intensity = intensity.UNKNOWN
+
+    @property
+    def origin_time(self):
+        return self.issue_time
+
+    @property
+    def closed(self):
+        return self.cancelled
+
+    @cached
+    def issue_time_text(self):
+        return format_time(self.issue_time, "%d日%H時%M分")
+
+    @cached
+    def areas(self):
+        return tuple(area.name for area in self.tsunami_areas)
+
+
+def normalize_wolfx(data):
+    # Wolfxの緊急地震速報を1回だけ解析し、以降の処理は全てこのモデルを使う
+    if data.get('type') != 'jma_eew':
+        return None
+    accuracy = data.get('Accuracy') or {}
+    return WolfxEEW(
+        event_id=data.get('EventID'),
+        serial=_integer(data.get('Serial')),
+        is_warn=bool(data.get('isWarn', False)),
+        is_final=bool(data.get('isFinal', False)),
+        is_cancel=bool(data.get('isCancel', False)),
+        is_assumption=bool(data.get('isAssumption', False)),
+        origin_time=parse_time(data.get('OriginTime')),
+        hypocenter=data.get('Hypocenter', '不明'),
+        latitude=_number(data.get('Latitude')),
+        longitude=_number(data.get('Longitude')),
+        depth=_integer(data.get('Depth')),
+        magnitude=_number(data.get('Magunitude')),
+        max_intensity=intensity.from_label(data.get('MaxIntensity')),
+        intensity_label=data.get('MaxIntensity', '不明'),
+        accuracy=(accuracy.get('Epicenter', '不明'), accuracy.get('Depth', '不明'), accuracy.get('Magnitude', '不明')),
+        warn_areas=tuple(
+            WarnArea(
+                area.get('Chiiki', '不明'),
+                intensity.from_label(area.get('Shindo1')),
+                # 到達時刻が不明な地域は「//////」で届く
+                parse_time(area['Time'], "%H%M%S") if isinstance(area.get('Time'), str) and area['Time'].isdigit() else None,
+                area.get('Arrive', '不明'),
+            )
+            for area in data.get('WarnArea') or ()
+        ),
+        raw=data,
+    )
+
+
+def normalize_p2pquake(data):
+    code = data.get('code')
+    if code == 551:
+        return _quake_info(data)
+    if code == 552:
+        return _tsunami_info(data)
+    if code == 556:
+        return _p2pquake_eew(data)
+    return None
+
+
+def _frame_id(data):
+    frame_id = data.get('id') or data.get('_id')
+    return str(frame_id) if frame_id is not None else None
+
+
+def _location(hypocenter):
+    # P2PQuakeでは不明な緯度・経度が-200で届く
+    latitude = _number(hypocenter.get('latitude'))
+    longitude = _number(hypocenter.get('longitude'))
+    if latitude is None or longitude is None or latitude <= -200 or longitude <= -200:
+        return None, None
+    return latitude, longitude
+
+
+def _quake_info(data):
+    issue = data.get('issue') or {}
+    earthquake = data.get('earthquake') or {}
+    hypocenter = earthquake.get('hypocenter') or {}
+    magnitude = hypocenter.get('magnitude')
+    depth = _integer(hypocenter.get('depth'))
+    latitude, longitude = _location(hypocenter)
+    return QuakeInfo(
+        frame_id=_frame_id(data),
+        event_id=issue.get('eventId'),
+        issue_type=issue.get('type', '不明'),
+        issue_source=issue.get('source', '不明'),
+        origin_time=parse_time(earthquake.get('time')),
+        hypocenter=hypocenter.get('name', '不明'),
+        latitude=latitude,
+        longitude=longitude,
+        magnitude=float(magnitude) if isinstance(magnitude, (int, float)) else None,
+        depth=depth if depth is not None and depth >= 0 else None,
+        max_intensity=intensity.from_scale(earthquake.get('maxScale')),
+        domestic_tsunami=earthquake.get('domesticTsunami', '情報なし'),
+        comments=(data.get('comments') or {}).get('freeFormComment', ''),
+        points=tuple(
+            Point(point.get('pref', '不明'), point.get('addr', '不明'), intensity.from_scale(point.get('scale')))
+            for point in data.get('points') or ()
+        ),
+        raw=data,
+    )
+
+
+def _tsunami_info(data):
+    issue = data.get('issue') or {}
+    areas = []
+    for area in data.get('areas') or ():
+        first_height = area.get('firstHeight') or {}
+        max_height = area.get('maxHeight') or {}
+        areas.append(TsunamiArea(
+            area.get('name', '不明'),
+            area.get('grade', '不明'),
+            bool(area.get('immediate', False)),
+            parse_time(first_height.get('arrivalTime')),
+            first_height.get('condition', '不明'),
+            max_height.get('description', '不明'),
+            _number(max_height.get('value')),
+        ))
+    return TsunamiInfo(
+        frame_id=_frame_id(data),
+        issue_type=issue.get('type', '不明'),
+        issue_source=issue.get('source', '不明'),
+        issue_time=parse_time(issue.get('time')),
+        cancelled=bool(data.get('cancelled', False)),
+        tsunami_areas=tuple(areas),
+        raw=data,
+    )
+
+
+def _p2pquake_eew(data):
+    issue = data.get('issue') or {}
+    earthquake = data.get('earthquake') or {}
+    hypocenter = earthquake.get('hypocenter') or {}
+    areas = data.get('areas') or ()
+    latitude, longitude = _location(hypocenter)
+    # P2PQuakeでは不明な値が-1で届く
+    magnitude = _number(hypocenter.get('magnitude'))
+    if magnitude is not None and magnitude < 0:
+        magnitude = None
+    depth = _integer(hypocenter.get('depth'))
+    if depth is not None and depth < 0:
+        depth = None
+    return P2PQuakeEEW(
+        frame_id=_frame_id(data),
+        event_id=issue.get('eventId'),
+        serial=_integer(issue.get('serial')),
+        cancelled=bool(data.get('cancelled', False)),
+        origin_time=parse_time(earthquake.get('originTime')),
+        hypocenter=hypocenter.get('name', '不明'),
+        latitude=latitude,
+        longitude=longitude,
+        depth=depth,
+        magnitude=magnitude,
+        condition=earthquake.get('condition', ''),
+        # 予想震度は地域ごとの下限の最大値とする
+        max_intensity=intensity.from_scale(max((area.get('scaleFrom', -1) for area in areas), default=None)),
+        warn_areas=tuple(EEWArea(area.get('name', '不明'), parse_time(area.get('arrivalTime'))) for area in areas),
+        raw=data,
+    )
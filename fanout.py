@@ -0,0 +1,97 @@
+import asyncio
+import collections
+import logging
+import time
+
+from metrics import Histogram, record_delivery
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        waited = False
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                waited = True
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class FanOut:
+    # 全ての配信先へ同時に送信する
+    # チャンネルごとと全体のレート制限を分けて管理し、1つのチャンネルの遅れが他に影響しないようにする
+    def __init__(self, channel_rate=1.0, channel_burst=5, global_rate=50.0, global_burst=50, latency_window=100):
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.channel_buckets = {}
+        self.latency_window = latency_window
+        self.latencies = {}
+        self.send_seconds = Histogram()
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    async def send_to(self, channel, **kwargs):
+        started_at = time.monotonic()
+        bucket = self.channel_buckets.get(channel.id)
+        if bucket is None:
+            bucket = self.channel_buckets[channel.id] = TokenBucket(self.channel_rate, self.channel_burst)
+        if await bucket.acquire():
+            self.rate_limited += 1
+        if await self.global_bucket.acquire():
+            self.rate_limited += 1
+        sending_at = time.monotonic()
+        message = await channel.send(**kwargs)
+        self.send_seconds.observe(time.monotonic() - sending_at)
+        record_delivery(message)
+        self.sent += 1
+        latencies = self.latencies.get(channel.id)
+        if latencies is None:
+            latencies = self.latencies[channel.id] = collections.deque(maxlen=self.latency_window)
+        latencies.append(time.monotonic() - started_at)
+        return message
+
+    async def send_all(self, channel, messages):
+        return [await self.send_to(channel, **kwargs) for kwargs in messages]
+
+    async def send(self, channels, make_messages):
+        # discord.Fileは1回しか送信できないため、チャンネルごとに引数を作り直す
+        # 同じチャンネルへの複数のメッセージは順番に送信する
+        results = await asyncio.gather(
+            *(self.send_all(channel, make_messages()) for channel in channels),
+            return_exceptions=True
+        )
+        for channel, result in zip(channels, results):
+            if isinstance(result, BaseException):
+                self.failed += 1
+                logger.error("チャンネル%dへの送信に失敗しました: %s", channel.id, result, exc_info=result)
+        return results
+
+    def stats(self):
+        slowest = None
+        for channel_id, latencies in self.latencies.items():
+            ordered = sorted(latencies)
+            p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+            if slowest is None or p99 > slowest[1]:
+                slowest = (channel_id, p99)
+        return {
+            "channels": len(self.latencies),
+            "sent": self.sent,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+            "slowest": slowest,
+        }
@@ -0,0 +1,46 @@
+from typing import NamedTuple
+
+
+class Intensity(NamedTuple):
+    scale: int
+    label: str
+    color: int
+    image: str
+    rank: int
+
+
+UNKNOWN = Intensity(-1, '不明', 0x95A5A6, 'unknown.png', 0)
+
+# P2PQuakeの震度コード（scale）の昇順
+SCALES = (
+    Intensity(10, '1', 0x3498DB, 'shindo1.png', 1),
+    Intensity(20, '2', 0x2ECC71, 'shindo2.png', 2),
+    Intensity(30, '3', 0xF1C40F, 'shindo3.png', 3),
+    Intensity(40, '4', 0xE67E22, 'shindo4.png', 4),
+    Intensity(45, '5弱', 0xE74C3C, 'shindo5w.png', 5),
+    Intensity(50, '5強', 0xC0392B, 'shindo5s.png', 6),
+    Intensity(55, '6弱', 0xFD6767, 'shindo6w.png', 7),
+    Intensity(60, '6強', 0xFE3B3B, 'shindo6s.png', 8),
+    Intensity(70, '7', 0x9D00DE, 'shindo7.png', 9),
+)
+
+# 46は「震度5弱以上と推定されるが震度情報を入手していない」
+_LOWER_5_OR_MORE = SCALES[4]._replace(scale=46, label='5弱以上')
+
+
+_BY_SCALE = {entry.scale: entry for entry in SCALES}
+_BY_SCALE[46] = _LOWER_5_OR_MORE
+_BY_LABEL = {entry.label: entry for entry in SCALES}
+_BY_LABEL['5弱以上'] = _LOWER_5_OR_MORE
+# 気象庁の電文では5-、5+のように表記されることがある
+_BY_LABEL.update({'5-': SCALES[4], '5+': SCALES[5], '6-': SCALES[6], '6+': SCALES[7]})
+
+
+def from_scale(scale):
+    # P2PQuakeの震度コードから引く（-1など震度コード以外は不明）
+    return _BY_SCALE.get(scale, UNKNOWN)
+
+
+def from_label(label):
+    # 「5弱」などの震度の文字列から引く
+    return _BY_LABEL.get(label, UNKNOWN)
@@ -0,0 +1,110 @@
+import functools
+
+import discord
+
+from events import format_time
+from tsunami_state import GRADE_LABELS, grade_rank
+
+# Discordの埋め込みの制限
+FIELD_NAME_LIMIT = 256
+FIELD_VALUE_LIMIT = 1024
+FIELDS_PER_EMBED = 25
+EMBED_TOTAL_LIMIT = 6000
+EMBEDS_PER_MESSAGE = 10
+
+
+def split_lines(lines, limit=FIELD_VALUE_LIMIT, separator="\n"):
+    # 行の途中で切らないように、制限に収まるだけ行をまとめる（1行で制限を超える場合のみ途中で切る）
+    chunks = []
+    current = []
+    size = 0
+    for line in lines:
+        while len(line) > limit:
+            if current:
+                chunks.append(separator.join(current))
+                current, size = [], 0
+            chunks.append(line[:limit])
+            line = line[limit:]
+        added = len(line) + (len(separator) if current else 0)
+        if current and size + added > limit:
+            chunks.append(separator.join(current))
+            current, size = [], 0
+            added = len(line)
+        current.append(line)
+        size += added
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def make_fields(name, lines, separator="\n", inline=False):
+    chunks = split_lines(lines, separator=separator)
+    return [
+        ((name if index == 0 else f"{name}（続き）")[:FIELD_NAME_LIMIT], chunk, inline)
+        for index, chunk in enumerate(chunks)
+    ]
+
+
+def point_fields(points):
+    # 観測点を震度の大きい順、都道府県ごとにまとめる
+    groups = {}
+    for point in points:
+        groups.setdefault(point.level, {}).setdefault(point.pref, []).append(point.addr)
+
+    fields = []
+    for level in sorted(groups, key=lambda entry: (entry.rank, entry.scale), reverse=True):
+        lines = []
+        for pref, addrs in groups[level].items():
+            prefix = f"**{pref}** "
+            line = prefix
+            for addr in addrs:
+                if len(line) + len(addr) + 1 > FIELD_VALUE_LIMIT:
+                    lines.append(line)
+                    line = prefix
+                line += addr if line == prefix else f"、{addr}"
+            lines.append(line)
+        fields.extend(make_fields(f"震度{level.label}", lines))
+    return fields
+
+
+@functools.lru_cache(maxsize=1024)
+def tsunami_area_line(area):
+    # 同じ内容の地域は続報でも同じ行になるため、作成した行を使い回す
+    # 第1波の到達予想時刻が発表されない地域は状況（到達を確認など）を表示する
+    if area.immediate:
+        arrival = "直ちに津波来襲"
+    elif area.arrival_time is not None:
+        arrival = f"第1波 {format_time(area.arrival_time, '%d日%H時%M分')}"
+    else:
+        arrival = area.condition
+    return f"**{area.name}** {arrival}（予想高さ {area.height}）"
+
+
+def tsunami_fields(areas):
+    # 津波予報の種類の強い順にまとめる
+    groups = {}
+    for area in areas:
+        groups.setdefault(area.grade, []).append(tsunami_area_line(area))
+    return [
+        field
+        for grade in sorted(groups, key=grade_rank, reverse=True)
+        for field in make_fields(f"{GRADE_LABELS.get(grade, grade)}（{len(groups[grade])}地域）", groups[grade])
+    ]
+
+
+def paginate(embed, fields):
+    # 先頭の埋め込みに収まらないフィールドは続きの埋め込みへ、1メッセージに収まらなければ次のメッセージへ分ける
+    messages = [[embed]]
+    current = embed
+    message_total = len(embed)
+    for name, value, inline in fields:
+        size = len(name) + len(value)
+        if len(current.fields) >= FIELDS_PER_EMBED or message_total + size > EMBED_TOTAL_LIMIT:
+            current = discord.Embed(color=embed.color)
+            if len(messages[-1]) >= EMBEDS_PER_MESSAGE or message_total + size > EMBED_TOTAL_LIMIT:
+                messages.append([])
+                message_total = 0
+            messages[-1].append(current)
+        current.add_field(name=name, value=value, inline=inline)
+        message_total += size
+    return messages
@@ -0,0 +1,227 @@
+import asyncio
+import collections
+import functools
+import logging
+import os
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lease (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS delivered (
+    key TEXT PRIMARY KEY,
+    delivered_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS delivered_at ON delivered (delivered_at);
+"""
+
+
+class LeaderLease:
+    # 同じマシンで動く複数のインスタンスのうち、SQLiteのリースを持つ1つ（リーダー）だけが配信する
+    # リーダーはrenew_intervalごとにリースを延長し、延長が止まると待機中のインスタンスがpoll_interval以内に引き継ぐ
+    # 配信した情報のキーも同じデータベースに記録し、引き継いだインスタンスが同じ情報を再送しないようにする
+    def __init__(self, path, instance_id=None, ttl=3.0, renew_interval=1.0, poll_interval=0.2, retention=60 * 60, on_change=None):
+        self.path = path
+        self.instance_id = instance_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.on_change = on_change
+        self.leader = False
+        self.expires_at = 0
+        self.holder = None
+        self.acquired_at = None
+        self.elections = 0
+        self.marked = 0
+        self.failed = 0
+        # 書き込みに失敗した配信済みの記録（次の周期と、リースを手放す前に書き直す）
+        self._retry = []
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="leader")
+
+    def open(self):
+        # 同時に書き込んだ場合は短く待ち、待ちきれなければ次の周期でやり直す
+        self._conn = sqlite3.connect(self.path, timeout=self.poll_interval, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        return self
+
+    @property
+    def is_leader(self):
+        # 延長できないまま期限が過ぎた場合は、次の周期を待たずに配信をやめる
+        return self.leader and time.time() < self.expires_at
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        last_pruned = 0
+        try:
+            while True:
+                now = time.time()
+                try:
+                    self.holder, expires_at = await loop.run_in_executor(self._executor, self._acquire, now)
+                    if self.holder == self.instance_id:
+                        self.expires_at = expires_at
+                except sqlite3.Error as e:
+                    self.failed += 1
+                    logger.warning("リースを更新できませんでした: %s", e)
+                await self._set_leader(self.holder == self.instance_id and time.time() < self.expires_at)
+                if self._retry:
+                    retry, self._retry = self._retry, []
+                    for key, marked_at in retry:
+                        self._submit_mark(key, marked_at)
+                if self.leader and now - last_pruned > self.retention / 10:
+                    last_pruned = now
+                    await loop.run_in_executor(self._executor, self._prune, now)
+                await asyncio.sleep(self.renew_interval if self.leader else self.poll_interval)
+        finally:
+            # 正常に終了する場合はすぐに引き継げるようにリースを手放す
+            # 手放す前に配信済みの記録を全て書き込み、引き継いだインスタンスが同じ情報を再送しないようにする
+            # （書き込みは同じスレッドで順番に行うため、先に積んだ記録が終わってから書き直す）
+            try:
+                self._executor.submit(self._flush, time.monotonic() + self.ttl).result(self.ttl * 2)
+            except Exception as e:
+                logger.warning("配信済みの記録を書き込めませんでした: %s", e)
+            if self.leader:
+                self._release()
+            self.leader = False
+
+    async def _set_leader(self, leader):
+        if leader == self.leader:
+            return
+        self.leader = leader
+        if leader:
+            self.elections += 1
+            self.acquired_at = time.time()
+            logger.warning("リーダーになりました。(%s)", self.instance_id)
+        else:
+            logger.warning("リーダーではなくなりました。配信を停止します。(現在のリーダー: %s)", self.holder)
+        if self.on_change is not None:
+            try:
+                await self.on_change(leader)
+            except Exception as e:
+                logger.exception("リーダーの切り替え時の処理に失敗しました: %s", e)
+
+    def _acquire(self, now):
+        # 期限が切れているか自分が持っているリースだけを取得・延長する
+        with self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO lease (name, holder, expires_at) VALUES ('leader', :holder, :expires_at)
+                ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                WHERE lease.holder = excluded.holder OR lease.expires_at < :now
+                """,
+                {"holder": self.instance_id, "expires_at": now + self.ttl, "now": now}
+            )
+            return self._conn.execute("SELECT holder, expires_at FROM lease WHERE name = 'leader'").fetchone()
+
+    def _release(self):
+        try:
+            with self._conn:
+                self._conn.execute("DELETE FROM lease WHERE name = 'leader' AND holder = ?", (self.instance_id,))
+        except sqlite3.Error as e:
+            logger.warning("リースを解放できませんでした: %s", e)
+
+    def mark(self, key):
+        # 配信した情報を記録する（書き込みは専用のスレッドで行い、完了を待たない）
+        if key is None:
+            return
+        self._submit_mark(key, time.time())
+
+    def _submit_mark(self, key, now):
+        future = self._executor.submit(self._mark, key, now)
+        future.add_done_callback(functools.partial(self._marked, key, now))
+
+    def _mark(self, key, now):
+        with self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO delivered (key, delivered_at) VALUES (?, ?)", (key, now))
+
+    def _marked(self, key, now, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.failed += 1
+            self._retry.append((key, now))
+            logger.warning("配信済みの記録に失敗しました。再試行します: %s", future.exception())
+        else:
+            self.marked += 1
+
+    def _flush(self, deadline):
+        # 失敗した記録を期限まで書き直す（専用のスレッドで実行する）
+        while self._retry and time.monotonic() < deadline:
+            key, now = self._retry[0]
+            try:
+                self._mark(key, now)
+            except sqlite3.Error:
+                time.sleep(0.05)
+                continue
+            self._retry.pop(0)
+            self.marked += 1
+        if self._retry:
+            logger.warning("配信済みの記録を%d件書き込めませんでした。", len(self._retry))
+
+    async def undelivered(self, keys):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._undelivered, list(keys))
+
+    def _undelivered(self, keys):
+        delivered = set()
+        # SQLiteの変数の上限を超えないように分けて問い合わせる
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            delivered.update(key for key, in self._conn.execute(
+                f"SELECT key FROM delivered WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+            ))
+        return {key for key in keys if key not in delivered}
+
+    def _prune(self, now):
+        with self._conn:
+            self._conn.execute("DELETE FROM delivered WHERE delivered_at < ?", (now - self.retention,))
+
+    def stats(self):
+        return {
+            "leader": self.is_leader,
+            "holder": self.holder,
+            "elections": self.elections,
+            "marked": self.marked,
+            "failed": self.failed,
+            "unmarked": len(self._retry),
+        }
+
+
+class StandbyBuffer:
+    # 待機中に受信した情報をwindow秒だけ保持し、リーダーが配信する前に停止した場合に引き継いで配信する
+    def __init__(self, window=15.0):
+        self.window = window
+        self.entries = collections.deque()
+        self.expired = 0
+
+    def add(self, key, item, now=None):
+        now = time.monotonic() if now is None else now
+        self.entries.append((now, key, item))
+        self._evict(now)
+
+    def drain(self, now=None):
+        # 保持している情報を(受信時刻, キー, 内容)のリストで返し、空にする
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+        entries = list(self.entries)
+        self.entries.clear()
+        return entries
+
+    def _evict(self, now):
+        while self.entries and now - self.entries[0][0] > self.window:
+            self.entries.popleft()
+            self.expired += 1
+
+    def __len__(self):
+        return len(self.entries)
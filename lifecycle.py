@@ -0,0 +1,90 @@
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TaskSupervisor:
+    # 名前ごとにタスクを1つだけ動かし、例外で終了した場合は待ち時間を延ばしながら再起動する
+    def __init__(self, restart_base=1.0, restart_max=60.0):
+        self.restart_base = restart_base
+        self.restart_max = restart_max
+        self.tasks = {}
+        self.restarts = collections.Counter()
+
+    def start(self, name, factory, restart=True):
+        # 既に動いている場合は何もしない（on_readyが再接続のたびに呼ばれても重複しない）
+        task = self.tasks.get(name)
+        if task is not None and not task.done():
+            return task
+        task = self.tasks[name] = asyncio.create_task(self._supervise(name, factory, restart), name=name)
+        return task
+
+    async def _supervise(self, name, factory, restart):
+        attempt = 0
+        while True:
+            started_at = time.monotonic()
+            try:
+                await factory()
+                if not restart:
+                    return
+                logger.warning("タスク%sが終了しました。再起動します。", name)
+            except Exception as e:
+                logger.exception("タスク%sでエラーが発生しました: %s", name, e)
+                if not restart:
+                    return
+            # 十分に長く動いていた場合は待ち時間を最初から数え直す
+            if time.monotonic() - started_at > self.restart_max:
+                attempt = 0
+            delay = min(self.restart_max, self.restart_base * 2 ** attempt)
+            attempt += 1
+            self.restarts[name] += 1
+            logger.info("タスク%sを%.1f秒後に再起動します。(再起動回数: %d)", name, delay, self.restarts[name])
+            await asyncio.sleep(delay)
+
+    async def stop(self):
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks = {}
+
+    def stats(self):
+        return {
+            name: {"running": not task.done(), "restarts": self.restarts[name]}
+            for name, task in self.tasks.items()
+        }
+
+
+def command_signature(tree):
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda entry: entry['name'])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+async def sync_commands(tree, application_id, path):
+    # 前回の同期からコマンドが変わっていない場合は同期しない
+    signature = command_signature(tree)
+    key = str(application_id)
+    synced = {}
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                synced = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("コマンドの同期記録を読み込めませんでした: %s", e)
+    if synced.get(key) == signature:
+        logger.info("スラッシュコマンドに変更がないため同期を省略しました。")
+        return False
+    started_at = time.monotonic()
+    await tree.sync()
+    synced[key] = signature
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(synced, f)
+    os.replace(tmp_path, path)
+    logger.info("スラッシュコマンドを同期しました。(%.2f秒)", time.monotonic() - started_at)
+    return True
@@ -0,0 +1,153 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from datetime import datetime
+
+from decode import orjson
+from metrics import current_trace
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+LOG_FORMATS = ("JSON", "Text")
+
+# LogRecordが最初から持っている属性（これ以外はextraで渡された値として出力する）
+_RESERVED = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def _extras(record):
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED and value is not None}
+
+
+class JsonFormatter(logging.Formatter):
+    # 1行に1つのJSONとして出力する
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_extras(record),
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if orjson is not None:
+            return orjson.dumps(entry, default=str).decode()
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        extras = _extras(record)
+        trace = extras.pop("trace", None)
+        line = f"{datetime.fromtimestamp(record.created):%Y-%m-%d %H:%M:%S} {record.levelname:<7} {f'[{trace}] ' if trace else ''}{record.getMessage()}"
+        if extras:
+            line += " " + " ".join(f"{key}={value}" for key, value in extras.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class RepeatFilter(logging.Filter):
+    # 同じ警告・エラーが続く場合は、interval秒に1回だけ出力して残りは件数だけを記録する
+    def __init__(self, interval=60.0, max_keys=1000):
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self.last = {}
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        entry = self.last.get(key)
+        if entry is not None and now - entry[0] < self.interval:
+            entry[1] += 1
+            self.suppressed += 1
+            return False
+        if entry is not None and entry[1]:
+            record.repeated = entry[1]
+        if len(self.last) >= self.max_keys:
+            self.last = {k: v for k, v in self.last.items() if now - v[0] < self.interval}
+        self.last[key] = [now, 0]
+        return True
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    # イベントループ側では記録をキューに積むだけにして、書き込みは別のスレッドで行う
+    # キューが満杯の場合は待たずに捨てる
+    def __init__(self, log_queue, maxsize=10000):
+        super().__init__(log_queue)
+        self.maxsize = maxsize
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 例外やトレースIDは呼び出したスレッド・コンテキストでしか取得できないため、ここで文字列にする
+        # ハンドラーはこれ1つだけなので、記録はコピーせずに書き換える
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if getattr(record, "trace", None) is None:
+            trace = current_trace.get()
+            record.trace = trace.id if trace is not None else None
+        return record
+
+    def enqueue(self, record):
+        # SimpleQueueはロックを使わないため、queue.Queueより積むのが速い
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+handler = None
+listener = None
+repeat_filter = None
+
+
+def setup(level="INFO", fmt="JSON", stream=None, maxsize=10000, repeat_interval=60.0):
+    global handler, listener, repeat_filter
+    # 使わない情報の収集（呼び出し元の行番号、スレッド名、プロセス名）を省いて記録を軽くする
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "JSON" else TextFormatter())
+    repeat_filter = RepeatFilter(repeat_interval)
+    output.addFilter(repeat_filter)
+
+    log_queue = queue.SimpleQueue()
+    handler = AsyncQueueHandler(log_queue, maxsize)
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    atexit.register(stop)
+    return listener
+
+
+def stop():
+    # 終了時にキューに残っている記録を書き出す
+    if listener is not None and listener._thread is not None:
+        listener.stop()
+
+
+def set_level(level):
+    logging.getLogger().setLevel(level)
+
+
+def stats():
+    return {
+        "dropped": handler.dropped if handler is not None else 0,
+        "suppressed": repeat_filter.suppressed if repeat_filter is not None else 0,
+        "queued": handler.queue.qsize() if handler is not None else 0,
+    }
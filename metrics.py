@@ -0,0 +1,138 @@
+import asyncio
+import contextvars
+import logging
+import secrets
+import time
+from typing import NamedTuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# 緊急地震速報は数秒以内の配信を目標にしているため、1秒前後を細かく区切る
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0)
+
+
+class Trace(NamedTuple):
+    id: str
+    feed: str
+    received_at: float
+
+
+# 受信したフレームから送信したメッセージまでを追跡するためのID
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+def new_trace(feed, received_at=None):
+    return Trace(secrets.token_hex(6), feed, time.monotonic() if received_at is None else received_at)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+
+# 受信からDiscordへの送信・編集が完了するまでの時間
+delivery_seconds = Histogram()
+
+
+def record_delivery(message, action="送信"):
+    trace = current_trace.get()
+    if trace is None:
+        return
+    elapsed = time.monotonic() - trace.received_at
+    delivery_seconds.observe(elapsed, feed=trace.feed)
+    # Webhook（wait=false）ではメッセージIDが分からない
+    logger.info("メッセージを%sしました (受信から%.0fms)", action, elapsed * 1000, extra={"message_id": message.id if message is not None else None})
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Exposition:
+    # Prometheusのテキスト形式で出力する
+    def __init__(self, prefix="earthsaid"):
+        self.prefix = prefix
+        self.lines = []
+
+    def _header(self, name, kind, help_text):
+        self.lines.append(f"# HELP {self.prefix}_{name} {help_text}")
+        self.lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+    def counter(self, name, help_text, samples):
+        self._header(name, "counter", help_text)
+        for labels, value in samples:
+            self.lines.append(f"{self.prefix}_{name}{_labels(labels)} {value}")
+
+    def gauge(self, name, help_text, samples):
+        self._header(name, "gauge", help_text)
+        for labels, value in samples:
+            if value is not None:
+                self.lines.append(f"{self.prefix}_{name}{_labels(labels)} {value}")
+
+    def histogram(self, name, help_text, *histograms):
+        # 同じ名前でラベルの異なる複数のHistogramをまとめて出力できる
+        self._header(name, "histogram", help_text)
+        for histogram in histograms:
+            for key, (counts, total, count) in histogram.series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, counts):
+                    cumulative += bucket_count
+                    self.lines.append(f"{self.prefix}_{name}_bucket{_labels(key + (('le', bound),))} {cumulative}")
+                self.lines.append(f"{self.prefix}_{name}_bucket{_labels(key + (('le', '+Inf'),))} {count}")
+                self.lines.append(f"{self.prefix}_{name}_sum{_labels(key)} {total}")
+                self.lines.append(f"{self.prefix}_{name}_count{_labels(key)} {count}")
+
+    def render(self):
+        return "\n".join(self.lines) + "\n"
+
+
+class MetricsServer:
+    # /metrics でcollectの結果を返す
+    def __init__(self, collect, host="127.0.0.1", port=9100):
+        self.collect = collect
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self._metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logger.info("メトリクスを http://%s:%d/metrics で公開しました。", self.host, self.port)
+
+    async def run(self):
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.runner.cleanup()
+
+    async def _metrics(self, request):
+        exposition = Exposition()
+        self.collect(exposition)
+        return web.Response(text=exposition.render(), content_type="text/plain", charset="utf-8")
+
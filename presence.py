@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+
+from fanout import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# 数値が小さいほど優先
+PRESENCE_ALERT = 0
+PRESENCE_EEW_FINAL = 1
+PRESENCE_SYSTEM = 2
+
+
+class _Request:
+    __slots__ = ("text", "expires_at", "shown")
+
+    def __init__(self, text, expires_at):
+        self.text = text
+        self.expires_at = expires_at
+        self.shown = False
+
+
+class PresenceManager:
+    # ステータスの変更要求を優先度ごとに最新の1件だけ保持し、その時点で最も優先度の高い表示だけを反映する
+    # 期限が切れた要求は取り除かれ、次に優先度の高い表示（通常はシステム情報）に戻る
+    def __init__(self, apply, rate=5 / 20, burst=5):
+        self.apply = apply
+        self.bucket = TokenBucket(rate, burst)
+        self.requests = {}
+        self.current = None
+        self.requested = 0
+        self.applied = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.failed = 0
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def request(self, text, priority=PRESENCE_SYSTEM, ttl=None):
+        # 呼び出し側は待たずに戻る。反映は管理タスクが行う
+        self.requested += 1
+        previous = self.requests.get(priority)
+        if previous is not None and not previous.shown:
+            self.coalesced += 1
+        self.requests[priority] = _Request(text, time.monotonic() + ttl if ttl else None)
+        self._wake.set()
+
+    def _winner(self, now):
+        for priority in sorted(self.requests):
+            entry = self.requests[priority]
+            if entry.expires_at is not None and entry.expires_at <= now:
+                if not entry.shown:
+                    self.coalesced += 1
+                del self.requests[priority]
+                continue
+            return entry
+        return None
+
+    def _next_expiry(self):
+        expiries = [entry.expires_at for entry in self.requests.values() if entry.expires_at is not None]
+        return min(expiries) if expiries else None
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            winner = self._winner(time.monotonic())
+            if winner is not None:
+                if winner.text == self.current:
+                    if not winner.shown:
+                        self.skipped += 1
+                        winner.shown = True
+                else:
+                    await self.bucket.acquire()
+                    # レート制限で待っている間に届いた要求があれば、その中の最新の表示を反映する
+                    winner = self._winner(time.monotonic())
+                    if winner is not None and winner.text != self.current:
+                        await self._apply(winner)
+                    continue
+
+            expiry = self._next_expiry()
+            timeout = max(0.0, expiry - time.monotonic()) if expiry is not None else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _apply(self, winner):
+        try:
+            await self.apply(winner.text)
+            self.current = winner.text
+            self.applied += 1
+            winner.shown = True
+        except Exception as e:
+            self.failed += 1
+            logger.exception("ステータスの更新に失敗しました: %s", e)
+            await asyncio.sleep(5)
+
+    def stats(self):
+        return {
+            "current": self.current,
+            "requested": self.requested,
+            "applied": self.applied,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+            "failed": self.failed,
+        }
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import speedtest
+
+logger = logging.getLogger(__name__)
+
+
+def _speedtest():
+    st = speedtest.Speedtest()
+    st.get_best_server()
+    download = st.download()
+    upload = st.upload()
+    return {
+        "server": st.results.server['name'],
+        "download": int(download / 10**6),
+        "upload": int(upload / 10**6),
+        "ping": st.results.ping,
+    }
+
+
+class NetworkProber:
+    # スピードテストは回線を占有するため、低い頻度でバックグラウンドで計測して結果を使い回す
+    # 同時に計測を求められた場合は、実行中の1回の結果を共有する
+    def __init__(self, interval=6 * 60 * 60, measure=_speedtest):
+        self.interval = interval
+        self.measure = measure
+        self.result = None
+        self.measured_at = None
+        self.error = None
+        self.runs = 0
+        self._inflight = None
+        # 既定のスレッドプールを使うと他の処理（asyncio.to_threadなど）を待たせるため専用のスレッドで実行する
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speedtest")
+
+    @property
+    def running(self):
+        return self._inflight is not None and not self._inflight.done()
+
+    async def refresh(self):
+        if not self.running:
+            self._inflight = asyncio.create_task(self._measure())
+        return await asyncio.shield(self._inflight)
+
+    async def _measure(self):
+        started_at = time.monotonic()
+        try:
+            self.result = await asyncio.get_running_loop().run_in_executor(self._executor, self.measure)
+            self.measured_at = time.time()
+            self.error = None
+            logger.info("スピードテストが完了しました。(%.0f秒)", time.monotonic() - started_at)
+        except Exception as e:
+            self.error = str(e)
+            logger.warning("スピードテストに失敗しました: %s", e)
+        finally:
+            self.runs += 1
+        return self.result
+
+    async def run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
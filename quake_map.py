@@ -0,0 +1,279 @@
+import asyncio
+import csv
+import functools
+import io
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import intensity
+from estimate import AREA_FILE
+from metrics import Histogram
+
+# Pillowがインストールされていなければ地図は描画しない
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# 日本周辺の陸地（GLOBEの1km格子、北緯22.5〜46.5度・東経122〜154度）
+BASEMAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "japan_land.npz")
+MAP_FILENAME = "map.png"
+MAP_SIZE = (720, 720)
+
+# 経度方向は日本の中央付近（北緯36度）の縮尺に合わせる
+_LONGITUDE_SCALE = math.cos(math.radians(36))
+# 拡大率ごとの1度あたりのピクセル数（タイルを使い回せるように固定の段階にする）
+ZOOMS = (24, 48, 96, 192)
+TILE_SIZE = 256
+TILE_CACHE_SIZE = 128
+_SEA = (27, 38, 59)
+_LAND = (88, 94, 102)
+_MARGIN = 0.5
+
+
+class AreaLocator:
+    # 地域名（緊急地震速報・震度速報の細分区域）から代表点を引く
+    # 市町村・観測点の位置は持っていないため、見つからない場合は都道府県の代表点にまとめる
+    def __init__(self, path=AREA_FILE):
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.areas = {}
+        prefs = {}
+        for row in rows:
+            location = (float(row['latitude']), float(row['longitude']))
+            self.areas[row['name']] = location
+            self.areas.setdefault(f"{row['pref']}{row['name']}", location)
+            prefs.setdefault(row['pref'], []).append(location)
+        self.prefs = {
+            pref: (sum(lat for lat, _ in locations) / len(locations), sum(lon for _, lon in locations) / len(locations))
+            for pref, locations in prefs.items()
+        }
+
+    def locate(self, name, pref=None):
+        return self.areas.get(name) or self.prefs.get(pref)
+
+    def points(self, entries):
+        # (地域名, 都道府県名, 震度の段階)から、同じ位置の中で最も大きい震度の点だけを残す
+        ranks = {}
+        for name, pref, rank in entries:
+            location = self.locate(name, pref)
+            if location is not None and rank > ranks.get(location, 0):
+                ranks[location] = rank
+        return [(lat, lon, rank) for (lat, lon), rank in ranks.items()]
+
+
+# 以下は描画用のプロセスで実行する
+_basemap = None
+
+
+def _load_basemap():
+    global _basemap
+    if _basemap is None:
+        with np.load(BASEMAP_FILE) as data:
+            width = int(data['width'])
+            land = np.unpackbits(data['land'], axis=1, count=width).astype(bool)
+            _basemap = (land, float(data['north']), float(data['west']), int(data['resolution']))
+    return _basemap
+
+
+def _to_pixel(lat, lon, ppd):
+    _, north, west, _ = _load_basemap()
+    return (lon - west) * ppd * _LONGITUDE_SCALE, (north - lat) * ppd
+
+
+@functools.lru_cache(maxsize=TILE_CACHE_SIZE)
+def _tile(ppd, tx, ty):
+    # 拡大率とタイルの位置ごとに陸地と海を塗り分けた画像を作り、次の描画で使い回す
+    land, north, west, resolution = _load_basemap()
+    xs = (np.arange(tx * TILE_SIZE, (tx + 1) * TILE_SIZE) + 0.5) / (ppd * _LONGITUDE_SCALE)
+    ys = (np.arange(ty * TILE_SIZE, (ty + 1) * TILE_SIZE) + 0.5) / ppd
+    columns = (xs * resolution).astype(np.int64)
+    rows = (ys * resolution).astype(np.int64)
+    inside_columns = (columns >= 0) & (columns < land.shape[1])
+    inside_rows = (rows >= 0) & (rows < land.shape[0])
+    mask = land[np.clip(rows, 0, land.shape[0] - 1)][:, np.clip(columns, 0, land.shape[1] - 1)]
+    mask &= inside_rows[:, None] & inside_columns[None, :]
+    pixels = np.empty((TILE_SIZE, TILE_SIZE, 3), dtype=np.uint8)
+    pixels[:] = _SEA
+    pixels[mask] = _LAND
+    return Image.fromarray(pixels, 'RGB')
+
+
+def _choose_zoom(points, size):
+    lats = [lat for lat, _ in points]
+    lons = [lon for _, lon in points]
+    south, north = min(lats) - _MARGIN, max(lats) + _MARGIN
+    west, east = min(lons) - _MARGIN, max(lons) + _MARGIN
+    center = ((south + north) / 2, (west + east) / 2)
+    for ppd in reversed(ZOOMS):
+        if (east - west) * ppd * _LONGITUDE_SCALE <= size[0] and (north - south) * ppd <= size[1]:
+            return ppd, center
+    return ZOOMS[0], center
+
+
+def warm(zooms=ZOOMS[:2]):
+    # 起動時に日本全体が入る拡大率のタイルを作っておく
+    land, _, _, resolution = _load_basemap()
+    count = 0
+    for ppd in zooms:
+        columns = math.ceil(land.shape[1] / resolution * ppd * _LONGITUDE_SCALE / TILE_SIZE)
+        rows = math.ceil(land.shape[0] / resolution * ppd / TILE_SIZE)
+        for ty in range(rows):
+            for tx in range(columns):
+                _tile(ppd, tx, ty)
+                count += 1
+    return count
+
+
+def render_map(points, epicenter=None, size=MAP_SIZE):
+    # points: (緯度, 経度, 震度の段階)のリスト, epicenter: (緯度, 経度)
+    locations = [(lat, lon) for lat, lon, _ in points]
+    if epicenter is not None:
+        locations.append(epicenter)
+    ppd, (center_lat, center_lon) = _choose_zoom(locations, size)
+    center_x, center_y = _to_pixel(center_lat, center_lon, ppd)
+    left, top = int(center_x - size[0] / 2), int(center_y - size[1] / 2)
+
+    image = Image.new('RGB', size, _SEA)
+    for ty in range(math.floor(top / TILE_SIZE), math.floor((top + size[1] - 1) / TILE_SIZE) + 1):
+        for tx in range(math.floor(left / TILE_SIZE), math.floor((left + size[0] - 1) / TILE_SIZE) + 1):
+            image.paste(_tile(ppd, tx, ty), (tx * TILE_SIZE - left, ty * TILE_SIZE - top))
+
+    draw = ImageDraw.Draw(image)
+    radius = max(5, min(10, ppd // 12))
+    # 震度の大きい点が上に描かれるようにする
+    for lat, lon, rank in sorted(points, key=lambda point: point[2]):
+        x, y = _to_pixel(lat, lon, ppd)
+        x, y = x - left, y - top
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=_rgb(intensity.SCALES[rank - 1].color), outline=(0, 0, 0))
+    if epicenter is not None:
+        x, y = _to_pixel(*epicenter, ppd)
+        x, y = x - left, y - top
+        for dx in (-1, 1):
+            draw.line((x - 10, y - 10 * dx, x + 10, y + 10 * dx), fill=(255, 255, 255), width=7)
+            draw.line((x - 10, y - 10 * dx, x + 10, y + 10 * dx), fill=(230, 0, 18), width=4)
+    _draw_legend(draw, sorted({rank for _, _, rank in points}), size)
+
+    output = io.BytesIO()
+    # 送信を急ぐため圧縮は軽めにする
+    image.save(output, 'PNG', compress_level=1)
+    return output.getvalue()
+
+
+def _draw_legend(draw, ranks, size):
+    if not ranks:
+        return
+    # 標準のフォントには日本語がないため「5-」「5+」の表記にする
+    labels = {5: "5-", 6: "5+", 7: "6-", 8: "6+"}
+    x, y = size[0] - 56, size[1] - 8 - 20 * len(ranks)
+    draw.rectangle((x - 8, y - 8, size[0] - 8, size[1] - 8), fill=(0, 0, 0))
+    for rank in reversed(ranks):
+        draw.rectangle((x, y, x + 14, y + 14), fill=_rgb(intensity.SCALES[rank - 1].color))
+        draw.text((x + 20, y + 1), labels.get(rank, str(rank)), fill=(255, 255, 255))
+        y += 20
+
+
+def _rgb(color):
+    return (color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF
+
+
+def tile_cache_info():
+    return _tile.cache_info()
+
+
+class MapRenderer:
+    # 震度分布図の描画を別のプロセスで行い、イベントループを止めない
+    # 描画待ちの件数を制限し、余震が続いても描画が溜まらないようにする
+    def __init__(self, workers=1, max_pending=2, timeout=15.0, size=MAP_SIZE):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.size = size
+        self.pending = 0
+        self.generations = {}
+        self.render_seconds = Histogram()
+        self.rendered = 0
+        self.dropped = 0
+        self.superseded = 0
+        self.timeouts = 0
+        self.failed = 0
+        self._executor = None
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def start(self):
+        if not self.available:
+            logger.warning("Pillowがインストールされていないため、震度分布図は描画しません。")
+            return
+        # forkで作るため、スレッドやデータベースの接続などを作る前（起動直後）に呼ぶ
+        # forkの場合は最初のsubmitで全てのプロセスが作られるため、以降に作ったスレッドやファイルは引き継がない
+        # 作成したプロセスは使い回し、地図のタイルはプロセスの中にキャッシュする
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'))
+        for _ in range(self.workers):
+            self._executor.submit(warm)
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def render(self, key, points, epicenter=None):
+        # 描画できない・待ちきれない・同じkeyの新しい描画が始まった場合はNoneを返す
+        if self._executor is None:
+            return None
+        if self.pending >= self.max_pending:
+            self.dropped += 1
+            logger.warning("描画待ちの震度分布図が多いため、描画を省略しました。")
+            return None
+        generation = self.generations[key] = self.generations.get(key, 0) + 1
+        loop = asyncio.get_running_loop()
+        started_at = time.monotonic()
+        future = self._executor.submit(render_map, points, epicenter, self.size)
+        self.pending += 1
+        # 描画が終わるまで件数に数え、時間切れで待つのをやめた描画もCPUを使っている間は数える
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._done))
+        try:
+            data = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            future.cancel()
+            logger.warning("震度分布図の描画が%.0f秒以内に終わりませんでした。", self.timeout)
+            return None
+        except Exception as e:
+            self.failed += 1
+            logger.error("震度分布図の描画に失敗しました: %s", e, exc_info=e)
+            return None
+        finally:
+            self._forget(key, generation)
+        self.render_seconds.observe(time.monotonic() - started_at)
+        self.rendered += 1
+        if self.generations.get(key, generation) != generation:
+            self.superseded += 1
+            return None
+        return data
+
+    def _done(self):
+        self.pending -= 1
+
+    def _forget(self, key, generation):
+        if self.generations.get(key) == generation:
+            del self.generations[key]
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "rendered": self.rendered,
+            "dropped": self.dropped,
+            "superseded": self.superseded,
+            "timeouts": self.timeouts,
+            "failed": self.failed,
+        }
@@ -0,0 +1,124 @@
+import os
+from dataclasses import dataclass, field, fields
+
+from dotenv import dotenv_values
+
+from log import LOG_LEVELS, LOG_FORMATS
+from subscriptions import FORECAST_WARNING_CHOICES
+
+THUMBNAIL_MODES = ("Attachment", "URL")
+DELIVERY_MODES = ("Bot", "Webhook")
+
+# 変更しても再起動するまで反映されない設定
+RESTART_REQUIRED = (
+    "token", "dispatch_workers", "dispatch_queue_size", "feed_connections",
+    "subscription_file", "thumbnail_mode", "asset_channel_id", "asset_cache_file", "command_sync_file",
+    "event_store_file", "event_store_retention_days", "metrics_host", "metrics_port",
+    "speedtest_interval", "log_format", "quake_map", "map_workers",
+    "leader_lease_file", "leader_lease_ttl",
+)
+
+
+class SettingsError(ValueError):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    token: str = field(default=None, repr=False)
+    channel_id: int = None
+    forecast_warning: str = "All"
+    accuracy: bool = False
+    eew_edit_message: bool = False
+    eew_estimate: bool = False
+    thumbnail_mode: str = "Attachment"
+    asset_channel_id: int = None
+    asset_cache_file: str = ".asset_cache.json"
+    subscription_file: str = "subscriptions.json"
+    dispatch_workers: int = 4
+    dispatch_queue_size: int = 1000
+    feed_connections: int = 1
+    command_sync_file: str = ".command_sync.json"
+    event_store_file: str = "events.db"
+    event_store_retention_days: int = 30
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = None
+    speedtest_interval: int = 360
+    delivery_mode: str = "Bot"
+    webhook_url: str = field(default=None, repr=False)
+    log_level: str = "INFO"
+    log_format: str = "JSON"
+    quake_map: bool = False
+    map_workers: int = 1
+    leader_lease_file: str = None
+    leader_lease_ttl: int = 3
+
+    @classmethod
+    def from_mapping(cls, env):
+        def text(name, default=None):
+            value = env.get(name)
+            return value.strip() if value and value.strip() else default
+
+        def integer(name, default=None, minimum=None):
+            value = text(name)
+            if value is None:
+                return default
+            try:
+                number = int(value)
+            except ValueError:
+                raise SettingsError(f"{name}は整数で指定してください: {value}") from None
+            if minimum is not None and number < minimum:
+                raise SettingsError(f"{name}は{minimum}以上で指定してください: {value}")
+            return number
+
+        def boolean(name):
+            value = text(name, 'False')
+            if value.lower() not in ('true', 'false'):
+                raise SettingsError(f"{name}はTrueまたはFalseで指定してください: {value}")
+            return value.lower() == 'true'
+
+        def choice(name, choices, default):
+            value = text(name, default)
+            if value not in choices:
+                raise SettingsError(f"{name}は{', '.join(choices)}のいずれかで指定してください: {value}")
+            return value
+
+        channel_id = integer('ChannelID')
+        return cls(
+            token=text('TOKEN'),
+            channel_id=channel_id,
+            forecast_warning=choice('ForecastWarning', FORECAST_WARNING_CHOICES, "All"),
+            accuracy=boolean('AccuracyBoolean'),
+            eew_edit_message=boolean('EEWEditMessage'),
+            eew_estimate=boolean('EEWEstimate'),
+            thumbnail_mode=choice('ThumbnailMode', THUMBNAIL_MODES, "Attachment"),
+            asset_channel_id=integer('AssetChannelID'),
+            asset_cache_file=text('AssetCacheFile', ".asset_cache.json"),
+            subscription_file=text('SubscriptionFile', "subscriptions.json"),
+            dispatch_workers=integer('DispatchWorkers', 4, minimum=1),
+            dispatch_queue_size=integer('DispatchQueueSize', 1000, minimum=0),
+            feed_connections=integer('FeedConnections', 1, minimum=1),
+            command_sync_file=text('CommandSyncFile', ".command_sync.json"),
+            event_store_file=text('EventStoreFile', "events.db"),
+            event_store_retention_days=integer('EventStoreRetentionDays', 30, minimum=1),
+            metrics_host=text('MetricsHost', "127.0.0.1"),
+            metrics_port=integer('MetricsPort', minimum=1),
+            speedtest_interval=integer('SpeedtestInterval', 360, minimum=0),
+            delivery_mode=choice('DeliveryMode', DELIVERY_MODES, "Bot"),
+            webhook_url=text('WebhookURL'),
+            log_level=choice('LogLevel', LOG_LEVELS, "INFO"),
+            log_format=choice('LogFormat', LOG_FORMATS, "JSON"),
+            quake_map=boolean('QuakeMap'),
+            map_workers=integer('MapWorkers', 1, minimum=1),
+            leader_lease_file=text('LeaderLeaseFile'),
+            leader_lease_ttl=integer('LeaderLeaseTTL', 3, minimum=1),
+        )
+
+    def changes(self, other):
+        return [entry.name for entry in fields(self) if getattr(self, entry.name) != getattr(other, entry.name)]
+
+
+def load_settings(path='.env'):
+    # 環境変数が設定されている場合は.envより優先する（python-dotenvのload_dotenvと同じ）
+    env = {**dotenv_values(path), **os.environ} if os.path.exists(path) else dict(os.environ)
+    return Settings.from_mapping(env)
@@ -0,0 +1,100 @@
+import json
+import os
+from dataclasses import dataclass, field, asdict
+
+import intensity
+
+FORECAST_WARNING_CHOICES = ("All", "Forecast", "Warning", "None")
+
+
+@dataclass
+class Subscription:
+    channel_id: int
+    forecast_warning: str = "All"
+    min_intensity: int = 0
+    regions: list = field(default_factory=list)
+    webhook_url: str = field(default=None, repr=False)
+
+    def accepts_eew(self, is_warn):
+        if self.forecast_warning == "None":
+            return False
+        if self.forecast_warning == "Warning":
+            return is_warn
+        if self.forecast_warning == "Forecast":
+            return not is_warn
+        return True
+
+    def matches(self, kind, is_warn=None, observed=None, areas=(), estimated=()):
+        if kind == "eew" and is_warn is not None and not self.accepts_eew(is_warn):
+            return False
+        # 震度や地域が分からない情報は取りこぼさないように送信する
+        min_rank = intensity.from_scale(self.min_intensity).rank if self.min_intensity else 0
+        if min_rank and observed is not None and observed.rank:
+            if observed.rank < min_rank:
+                return False
+        if self.regions and (areas or estimated):
+            # 推定震度が分かる地域は、最小震度（指定がなければ震度1）以上と推定される場合だけ対象にする
+            candidates = [*areas, *(area for area, rank in estimated if rank >= max(min_rank, 1))]
+            if not any(region in area for area in candidates for region in self.regions):
+                return False
+        return True
+
+
+class SubscriptionRegistry:
+    def __init__(self, path, default=None):
+        self.path = path
+        self.default = default
+        self.subscriptions = {}
+        self._all = []
+        self._eew_kinds = frozenset()
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            self.subscriptions = {entry['channel_id']: Subscription(**entry) for entry in entries}
+        self._compile()
+
+    def _compile(self):
+        # 配信先が変わったときに、受信ごとの判定に使う値を作り直す
+        if self.default is not None and self.default.channel_id not in self.subscriptions:
+            self._all = [self.default, *self.subscriptions.values()]
+        else:
+            self._all = list(self.subscriptions.values())
+        self._eew_kinds = frozenset(is_warn for is_warn in (False, True) if any(sub.accepts_eew(is_warn) for sub in self._all))
+
+    def set_default(self, default):
+        self.default = default
+        self._compile()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([asdict(sub) for sub in self.subscriptions.values()], f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def add(self, subscription):
+        self.subscriptions[subscription.channel_id] = subscription
+        self._compile()
+        self.save()
+
+    def remove(self, channel_id):
+        removed = self.subscriptions.pop(channel_id, None)
+        if removed is not None:
+            self._compile()
+            self.save()
+        return removed
+
+    def get(self, channel_id):
+        return self.subscriptions.get(channel_id)
+
+    def all(self):
+        # .envのChannelIDは常に配信先に含める（同じチャンネルが登録されていれば登録内容を優先）
+        return list(self._all)
+
+    def match(self, kind, is_warn=None, observed=None, areas=(), estimated=()):
+        return [sub for sub in self._all if sub.matches(kind, is_warn, observed, areas, estimated)]
+
+    def wants_eew(self, is_warn):
+        return bool(is_warn) in self._eew_kinds
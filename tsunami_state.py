@@ -0,0 +1,103 @@
+import time
+from typing import NamedTuple
+
+# 津波予報の種類の強さ（不明は最も弱く扱う）
+GRADE_RANKS = {"Unknown": 0, "Watch": 1, "Warning": 2, "MajorWarning": 3}
+GRADE_LABELS = {"MajorWarning": "大津波警報", "Warning": "津波警報", "Watch": "津波注意報", "Unknown": "津波予報（種類不明）"}
+GRADE_COLORS = {"MajorWarning": 0xC800FF, "Warning": 0xFF2800, "Watch": 0xFAF500, "Unknown": 0x00BFFF}
+
+
+def grade_rank(grade):
+    return GRADE_RANKS.get(grade, 0)
+
+
+class TsunamiChanges(NamedTuple):
+    # key: 一連の津波情報の識別子（最初に受信した報の発表時刻）
+    # upgraded・downgraded・updatedは(前回の地域, 今回の地域)の組
+    key: str
+    first: bool
+    closed: bool
+    areas: tuple
+    added: tuple
+    upgraded: tuple
+    downgraded: tuple
+    cleared: tuple
+    updated: tuple
+
+    @property
+    def escalated(self):
+        # 2報目以降で新たに発表・引き上げられた地域がある
+        return not self.first and bool(self.added or self.upgraded)
+
+
+class TsunamiTracker:
+    # 津波情報は1報ごとに発表中の全ての地域が届くため、前回の報と比べて変わった地域だけを取り出す
+    # 全て解除されるか、idle_ttlの間更新がなければ一連の情報を終える
+    def __init__(self, idle_ttl=86400, clock=time.monotonic):
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self.key = None
+        self.areas = {}
+        self.issue_time = None
+        self.updated_at = 0
+        self.sequences = 0
+        self.bulletins = 0
+        self.unchanged = 0
+        self.stale = 0
+
+    def update(self, event, now=None):
+        # 変化がない報・古い報はNoneを返す
+        now = self.clock() if now is None else now
+        if self.key is not None and now - self.updated_at > self.idle_ttl:
+            self._reset()
+        if self.key is not None and event.issue_time is not None and self.issue_time is not None and event.issue_time < self.issue_time:
+            self.stale += 1
+            return None
+
+        areas = {} if event.cancelled else {area.name: area for area in event.tsunami_areas}
+        first = self.key is None
+        if first:
+            self.key = event.issue_time.strftime("%Y%m%d%H%M%S") if event.issue_time else str(event.frame_id)
+            self.sequences += 1
+        previous = self.areas
+        self.areas = areas
+        self.issue_time = event.issue_time or self.issue_time
+        self.updated_at = now
+
+        added, upgraded, downgraded, updated = [], [], [], []
+        for name, area in areas.items():
+            old = previous.get(name)
+            if old is None:
+                added.append(area)
+            elif old != area:
+                rank, old_rank = grade_rank(area.grade), grade_rank(old.grade)
+                if rank > old_rank:
+                    upgraded.append((old, area))
+                elif rank < old_rank:
+                    downgraded.append((old, area))
+                else:
+                    updated.append((old, area))
+        cleared = [area for name, area in previous.items() if name not in areas]
+        closed = not areas
+        changes = TsunamiChanges(self.key, first, closed, tuple(areas.values()), tuple(added), tuple(upgraded), tuple(downgraded), tuple(cleared), tuple(updated))
+        if closed:
+            self._reset()
+        if not first and not closed and not (added or upgraded or downgraded or cleared or updated):
+            self.unchanged += 1
+            return None
+        self.bulletins += 1
+        return changes
+
+    def _reset(self):
+        self.key = None
+        self.areas = {}
+        self.issue_time = None
+
+    def stats(self):
+        return {
+            "active": len(self.areas),
+            "sequences": self.sequences,
+            "bulletins": self.bulletins,
+            "unchanged": self.unchanged,
+            "stale": self.stale,
+        }
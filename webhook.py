@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+import discord
+from discord.http import handle_message_parameters
+
+from fanout import TokenBucket
+from metrics import Histogram, record_delivery
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookError(Exception):
+    def __init__(self, status, text):
+        super().__init__(f"{status} {text[:200]}")
+        self.status = status
+
+
+class WebhookDelivery:
+    # チャンネルのWebhookへ直接投稿する
+    # 1つのセッションを使い回して接続を維持し、wait=falseで投稿の完了を待たずに応答を受け取る
+    def __init__(self, limit=100, timeout=10, webhook_rate=1.0, webhook_burst=5):
+        self.limit = limit
+        self.timeout = timeout
+        self.webhook_rate = webhook_rate
+        self.webhook_burst = webhook_burst
+        self.buckets = {}
+        self.send_seconds = Histogram()
+        self.sent = 0
+        self.failed = 0
+        self.fallback = 0
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            # aiohttpのセッションはイベントループの中で作る必要があるため、最初の送信時に作る
+            connector = aiohttp.TCPConnector(limit=self.limit, ttl_dns_cache=300, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def post(self, url, embeds=(), file=None, silent=False):
+        flags = discord.MessageFlags()
+        flags.suppress_notifications = silent
+        params = handle_message_parameters(embeds=list(embeds), file=file if file is not None else discord.utils.MISSING, flags=flags)
+        try:
+            # discord.pyのHTTPClient.requestと同じ方法でリクエストを組み立てる
+            if params.multipart:
+                data = aiohttp.FormData(quote_fields=False)
+                for field in params.multipart:
+                    data.add_field(**field)
+                request = self.session.post(url, params={"wait": "false"}, data=data)
+            else:
+                request = self.session.post(url, params={"wait": "false"}, json=params.payload)
+            async with request as response:
+                if response.status >= 300:
+                    raise WebhookError(response.status, await response.text())
+        finally:
+            for f in params.files or ():
+                f.close()
+
+    async def send_to(self, url, embeds=(), file=None, silent=False):
+        bucket = self.buckets.get(url)
+        if bucket is None:
+            bucket = self.buckets[url] = TokenBucket(self.webhook_rate, self.webhook_burst)
+        await bucket.acquire()
+        started_at = time.monotonic()
+        await self.post(url, embeds, file, silent)
+        self.send_seconds.observe(time.monotonic() - started_at)
+        record_delivery(None, "Webhookで送信")
+        self.sent += 1
+
+    async def _deliver(self, target, url, make_messages, fallback):
+        messages = make_messages()
+        sent = 0
+        try:
+            for message in messages:
+                await self.send_to(url, **message)
+                sent += 1
+            return sent
+        except Exception as e:
+            self.fallback += 1
+            # 想定外の例外だけスタックトレースを出力する
+            expected = isinstance(e, (WebhookError, aiohttp.ClientError, asyncio.TimeoutError))
+            logger.warning("チャンネル%dのWebhookへの送信に失敗したため、BOTから送信します: %s", target, e, exc_info=None if expected else e)
+            for message in messages[sent + 1:]:
+                if message.get("file") is not None:
+                    message["file"].close()
+            # discord.Fileは1回しか送信できないため、送信できなかった分だけを作り直す
+            return await fallback(target, make_messages(sent))
+
+    async def send(self, targets, make_messages, fallback):
+        # targetsは(チャンネルID, WebhookのURL)の組で、失敗した配信先はfallback(チャンネルID, メッセージ)で送信する
+        # make_messages(start)はstart件目以降のメッセージを作る
+        results = await asyncio.gather(
+            *(self._deliver(target, url, make_messages, fallback) for target, url in targets),
+            return_exceptions=True
+        )
+        for (target, url), result in zip(targets, results):
+            if isinstance(result, BaseException):
+                self.failed += 1
+                logger.error("チャンネル%dへの送信に失敗しました: %s", target, result, exc_info=result)
+        return results
+
+    def stats(self):
+        return {
+            "webhooks": len(self.buckets),
+            "sent": self.sent,
+            "failed": self.failed,
+            "fallback": self.fallback,
+        }